@@ -0,0 +1,106 @@
+'''
+Where palaso-python keeps its caches of work that is expensive to redo, such
+as compiled TECkit mappings and parsed Keyman keyboards, and the on disk store
+they share.
+'''
+__version__ = '20261019'
+__date__ = '19 October 2026'
+__history__ = '''
+    20261019 - Initial version
+'''
+import hashlib
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+__all__ = ('user_cache_dir', 'DiskCache')
+
+
+def user_cache_dir(kind: str) -> Path:
+    '''
+    The directory for the user's cache of the given kind. The PALASO_CACHE
+    environment variable, if set, replaces the platform's per user cache
+    directory: $XDG_CACHE_HOME or ~/.cache, ~/Library/Caches on macOS and
+    %LOCALAPPDATA% on Windows.
+    '''
+    base = os.environ.get('PALASO_CACHE')
+    if base:
+        return Path(base, kind)
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') \
+            or Path.home() / 'AppData' / 'Local'
+    elif sys.platform == 'darwin':
+        base = Path.home() / 'Library' / 'Caches'
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base, 'palaso-python', kind)
+
+
+class DiskCache(object):
+    '''
+    A directory of cache entries, one file per key, each holding bytes.
+    Entries are written atomically, so a reader never sees half an entry,
+    and reading one marks it as recently used. When the entries exceed
+    max_size bytes the least recently used are removed. Subclasses set the
+    kind of cache, which names its directory under user_cache_dir(), and
+    the suffix of its entries, and turn entries to and from objects.
+    '''
+    kind = 'misc'
+    suffix = '.cache'
+
+    def __init__(self, path: Optional[Union[str, os.PathLike]] = None,
+                 max_size: int = 64 << 20) -> None:
+        self.path = Path(path) if path is not None \
+            else user_cache_dir(self.kind)
+        self.max_size = max_size
+
+    @staticmethod
+    def digest(salt: str, data: bytes) -> str:
+        ''' A key for data made with the given settings '''
+        h = hashlib.sha256(salt.encode('utf-8') + b'\0')
+        h.update(data)
+        return h.hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.path / (key + self.suffix)
+
+    def read(self, key: str) -> Optional[bytes]:
+        path = self.entry(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def write(self, key: str, data: bytes) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.entry(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for p in self.path.glob('*' + self.suffix):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        size = sum(e[1] for e in entries)
+        for _, n, p in sorted(entries, key=lambda e: e[0]):
+            if size <= self.max_size:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                pass
+            size -= n
+
+    def clear(self) -> None:
+        for p in self.path.glob('*' + self.suffix):
+            p.unlink()
@@ -1,5 +1,6 @@
 import re, itertools
-import os, collections
+import os, collections, heapq, math
+from concurrent.futures import ProcessPoolExecutor
 try:
     from palaso.kmfl import kmfl
     kmflorobject = kmfl
@@ -333,7 +334,7 @@ sc_E1vks = ((0x1D, 0x0013))
 def keysyms_items(syms) :
     return [keysym_item(s) for s in re.split(r'(\\.|(?:\[[^\]]+\])|.)', syms)[1::2]]
 
-def keysym_item(sym) :
+def _keysym_item(sym) :
     if re.match(r'^\[[^\]]+\]$', sym) :
         words = re.split(r'\s+', sym[1:-1].strip())
         mod = 0
@@ -348,12 +349,7 @@ def keysym_item(sym) :
 
     return ord(char)
 
-def items_to_keys(items) :
-    r = ""
-    for o in items: r += item_to_key(o)
-    return r
-
-def item_to_key(item) :
+def _item_to_key(item) :
     if (item >> 24) > 1 :
         return ""
     elif item > 0x1000000 :
@@ -380,7 +376,7 @@ def item_to_key(item) :
     else :
         return char_keysym(chr(item))
 
-def item_to_char(item) :
+def _item_to_char(item) :
     if item < 0x110000 :
         return chr(item)
     sym = item_to_key(item)
@@ -404,7 +400,7 @@ def item_to_char(item) :
     else :
         return sym
 
-def char_keysym(char) :
+def _char_keysym(char) :
     if re.match(r'^\[[^\]]+\]$', char) :
         return char
     res = _keysyms.get(char)
@@ -420,7 +416,7 @@ def char_keysym(char) :
 def chars_scancodes(syms) :
     return itertools.chain(*(keysym_scancodes(char_keysym(s)) for s in re.split(r'(\\.|\[[^\]]*\]|.)', syms)[1::2]))
 
-def keysym_scancodes(sym) :
+def _keysym_scancodes(sym) :
     resdown = []
     resup = []
     if re.match(r'^\[[^\]]+\]$', sym) :
@@ -434,10 +430,7 @@ def keysym_scancodes(sym) :
     resup.reverse()
     return tuple(resdown + resup)
 
-def keysym_klcinfo(sym) :
-    """ returns a tupe (scancode, virtual key name, 
-        modifier number, keyname, extended keyname) for a given
-        key symbol"""
+def _keysym_klcinfo(sym) :
     mod = 0
     vkey = ""
     sc = 0
@@ -459,6 +452,69 @@ def keysym_klcinfo(sym) :
         _, _, sc, vkc, kn, ekn = _rawkeys["K_" + sym.upper()]
     return (sc, vkey, mod, kn, ekn, vkc)
 
+# The conversions above are pure functions of their argument, and
+# converting a keyboard asks for the same few hundred keys over and over,
+# so their results are kept in tables from keysym to item and from item
+# back to keysym or character, filled in as they are asked for. Dicts
+# rather than arrays, since keysym items span 24 bits.
+_sym_items = {}
+_item_keys = {}
+_item_chars = {}
+_char_syms = {}
+_sym_scancodes = {}
+_sym_klcinfo = {}
+
+def keysym_item(sym) :
+    res = _sym_items.get(sym)
+    if res is None :
+        res = _sym_items[sym] = _keysym_item(sym)
+    return res
+
+def item_to_key(item) :
+    res = _item_keys.get(item)
+    if res is None :
+        res = _item_keys[item] = _item_to_key(item)
+    return res
+
+def item_to_char(item) :
+    # None is a result here, for items with no character of their own
+    if item in _item_chars :
+        return _item_chars[item]
+    res = _item_chars[item] = _item_to_char(item)
+    return res
+
+def char_keysym(char) :
+    res = _char_syms.get(char)
+    if res is None :
+        res = _char_syms[char] = _char_keysym(char)
+    return res
+
+def keysym_scancodes(sym) :
+    res = _sym_scancodes.get(sym)
+    if res is None :
+        res = _sym_scancodes[sym] = _keysym_scancodes(sym)
+    return res
+
+def keysym_klcinfo(sym) :
+    """ returns a tupe (scancode, virtual key name, 
+        modifier number, keyname, extended keyname) for a given
+        key symbol"""
+    res = _sym_klcinfo.get(sym)
+    if res is None :
+        res = _sym_klcinfo[sym] = _keysym_klcinfo(sym)
+    return res
+
+def items_to_keys(items) :
+    """ The keysyms for a sequence of items, as one string """
+    keys = _item_keys
+    return "".join(keys[i] if i in keys else item_to_key(i) for i in items)
+
+def items_to_chars(items) :
+    """ The characters for a sequence of items, as one string """
+    chars = _item_chars
+    return "".join((chars[i] if i in chars else item_to_char(i)) or ""
+                   for i in items)
+
 def escape(keyname) :
     return "\\" + keyname if "\\[".find(keyname) >= 0 else keyname
         
@@ -476,84 +532,225 @@ class Key(int) :
         return item_to_key(self)
 
 
+class ReverseSearch(object) :
+    """ Searches back from a string of output items for the keystroke
+        sequences that produce it. A search state is the tuple of items still
+        to be produced, deadkeys included. Each rule whose output matches the
+        end of a state gives a keystroke and the state that must precede it.
+        Successor states, and the sequences completing each state, are
+        memoised so that shared prefixes are only searched once.
+            reverse_match - function (input, rule, mode) as kmfl.reverse_match
+            numrules - the number of rules to try
+            mode - which contexts of a matching rule to consider
+            passthrough - treat an item no rule produces as typed directly
+    """
+
+    def __init__(self, reverse_match, numrules, mode = 'all', passthrough = False) :
+        self.reverse_match = reverse_match
+        self.numrules = numrules
+        self.mode = mode
+        self.passthrough = passthrough
+        self._successors = {}
+        self._memo = {}
+
+    def successors(self, state) :
+        """ Returns a list of (previous state, keystroke) pairs for state """
+        res = self._successors.get(state)
+        if res is not None : return res
+        res = {}
+        input = list(state)
+        for rule in range(0, self.numrules) :
+            match = self.reverse_match(input, rule, mode = self.mode)
+            if not match : continue
+            prefix = state[:len(state) - match[0]]
+            for context in match[1] :
+                if context[-1] >= 0x100FF00 : continue   # ignore specials
+                res[(prefix + tuple(context[:-1]), context[-1])] = None
+        # No rule produces the last item, so it must have been typed
+        if not res and self.passthrough and state :
+            res[(state[:-1], state[-1])] = None
+        res = self._successors[state] = list(res)
+        return res
+
+    def sequences(self, input, limit = None, max_cost = None) :
+        """ Returns the keystroke sequences, as tuples of items, that produce
+            input, shortest first. At most limit sequences are returned and,
+            if max_cost is given, none longer than max_cost keystrokes.
+            Sequences that pass through the same state twice are left out."""
+        state = tuple(input)
+        if not state : return []
+        if max_cost is None : max_cost = math.inf
+        return self._complete(state, limit, max_cost, set())[0]
+
+    def _complete(self, state, limit, budget, active) :
+        """ Returns the sequences completing state within budget, and the
+            states on the current path that the search was cut short at. """
+        if not state : return [()], set()
+        if state in active : return [], {state}
+        known = self._memo.get((state, limit))
+        if known is not None and known[0] >= budget :
+            return [s for s in known[1] if len(s) <= budget], set()
+        if budget <= 0 : return [], set()
+        active.add(state)
+        res = {}
+        cut = set()
+        for prev, key in self.successors(state) :
+            seqs, below = self._complete(prev, limit, budget - 1, active)
+            cut |= below
+            for s in seqs :
+                res[s + (key,)] = None
+        active.discard(state)
+        cut.discard(state)
+        # Sorting by length means that a cut down list, filtered by a smaller
+        # budget, still holds the shortest sequences within that budget.
+        res = sorted(res, key=len)[:limit]
+        # A result cut short at a state further up the path depends on that
+        # path, so is only good for this search.
+        if not cut :
+            self._memo[(state, limit)] = (budget, res)
+        return res, cut
+
+    def shortest(self, input, limit = 1, max_cost = None) :
+        """ Yields keystroke sequences producing input in order of length,
+            searching best first so that only as much is explored as is
+            needed to find them. Each state is expanded at most limit times,
+            which is enough to find the limit shortest sequences. If max_cost
+            is given, no sequence longer than that is looked for."""
+        state = tuple(input)
+        if not state : return
+        if max_cost is None : max_cost = math.inf
+        heap = [(0, 0, state, None)]
+        expanded = collections.Counter()
+        tick = itertools.count(1)
+        found = set()
+        while heap :
+            cost, _, state, path = heapq.heappop(heap)
+            if limit is not None and expanded[state] >= limit : continue
+            expanded[state] += 1
+            if not state :
+                keys = []
+                while path :
+                    key, path = path
+                    keys.append(key)
+                keys = tuple(keys)
+                if keys not in found :
+                    found.add(keys)
+                    yield keys
+                continue
+            if cost >= max_cost : continue
+            for prev, key in self.successors(state) :
+                heapq.heappush(heap, (cost + 1, next(tick), prev, (key, path)))
+
+
+def rule_coverage(kb, rule, mode = 'all', cache = None, limit = None) :
+    """ Returns the distinct input sequences, as tuples of items, that reach
+        each left context of a rule in kb, which has flatten_context and
+        create_sequences methods like Keyman's"""
+    res = {}
+    for c in kb.flatten_context(rule, side = 'l', mode = mode) :
+        last_context_item = c[-1]
+        if (last_context_item & 0xFFFF) > 0xFF00 : continue
+        if len(c) > 1 :
+            for s in kb.create_sequences(c[:-1], mode, cache, limit = limit) :
+                res[tuple(map(int, s)) + (last_context_item,)] = None
+        else :
+            res[(last_context_item,)] = None
+    return list(res)
+
+_coverage_state = None
+
+def _coverage_init(cls, fname, mode, limit) :
+    global _coverage_state
+    _coverage_state = (cls(fname), mode, limit, {})
+
+def _coverage_rules(rules) :
+    kb, mode, limit, cache = _coverage_state
+    return [rule_coverage(kb, i, mode, cache, limit) for i in rules]
+
+def coverage_tests(kb, mode = 'all', jobs = 1, limit = None, cache = None) :
+    """ Yields the distinct input sequences, as tuples of items, that
+        exercise each rule of kb in turn. At most limit sequences are tried
+        for each context, limit=1 giving just the shortest. With jobs > 1
+        the rules are shared, in runs of neighbouring rules, among that many
+        worker processes. Each builds its own keyboard from kb.fname and
+        keeps its sequence memo across the rules it is given, so a cache,
+        which can only be shared within one process, may not be passed."""
+    if jobs > 1 and cache is not None :
+        raise ValueError("a sequence cache cannot be shared by worker processes")
+    return _coverage_tests(kb, mode, jobs, limit, cache)
+
+def _coverage_tests(kb, mode, jobs, limit, cache) :
+    if jobs > 1 :
+        size = max(1, kb.numrules // (jobs * 4))
+        runs = [range(i, min(i + size, kb.numrules)) for i in range(0, kb.numrules, size)]
+        pool = ProcessPoolExecutor(jobs, initializer = _coverage_init,
+                                   initargs = (type(kb), kb.fname, mode, limit))
+        results = itertools.chain.from_iterable(pool.map(_coverage_rules, runs))
+    else :
+        pool = None
+        if cache is None : cache = {}
+        results = (rule_coverage(kb, i, mode, cache, limit) for i in range(0, kb.numrules))
+    seen = set()
+    try :
+        for seqs in results :
+            for s in seqs :
+                if s not in seen :
+                    seen.add(s)
+                    yield s
+    finally :
+        if pool is not None : pool.shutdown(cancel_futures = True)
+
+
 class Keyman(kmflorobject) :
-    def create_sequences(self, input, mode = 'all', cache = None, history=None) :
+    def __init__(self, fname) :
+        super(Keyman, self).__init__(fname)
+        self.fname = fname
+
+    def _search(self, mode, cache = None) :
+        if cache is None :
+            if not hasattr(self, '_searches') : self._searches = {}
+            cache = self._searches
+        if mode not in cache :
+            cache[mode] = ReverseSearch(self.reverse_match, self.numrules,
+                                        mode = mode, passthrough = True)
+        return cache[mode]
+
+    def create_sequences(self, input, mode = 'all', cache = None, limit = None, max_cost = None) :
         """ Given an input string of items, return all the strings of items that
-            would produce this input sequence if executed
+            would produce this input sequence if executed, shortest first
                 mode - which sequences to include for any given rule
+                cache - dict to keep searches in, by default the keyboard's own
+                limit - the most sequences to return
+                max_cost - the longest sequence to return
         """
-        cache = cache or {}
-        history = history or collections.defaultdict(list)
-        found = False
-        for rule in range(0, self.numrules) :
-            res = self.reverse_match(input, rule, mode = mode)
-            if not res: continue
-            for y in self._sequence(input, rule, res, cache, history, mode) :
-                yield y
-            found = True
-        # No rule matched the last char of input, so pass it through
-        if not found and len(input) :
-            res = (1, [[input[-1]]])
-            for y in self._sequence(input, rule, res, cache, history, mode) :
-                yield y
-
-    def _sequence(self, input, rule, res, cache, history, mode) :
-        for output in res[1] :
-            if output[-1] >= 0x100FF00 : continue   # ignore specials
-            newinput = input[0:len(input) - res[0]] + output[:-1]
-            newstr ="".join(chr(i) for i in newinput)
-            if newstr and newstr in cache :
-                for x in cache[newstr] :
-                    yield x + [Key(output[-1])]
-                continue
-            else :
-                cache[newstr] = []
-            rule_history = history[rule]
-            if newinput and (not rule_history or rule_history[-1] > len(newinput)):
-                rule_history.append(len(newinput))
-                for x in self.create_sequences(newinput, mode, cache, history) :
-                    cache[newstr].append(x)
-                    yield x + [Key(output[-1])]
-                rule_history.pop()
-            else :
-                yield [Key(output[0])]
-
-    def reverse(self, string, mode = 'shortest') :
+        for s in self._search(mode, cache).sequences(input, limit, max_cost) :
+            yield [Key(k) for k in s]
+
+    def reverse(self, string, mode = 'shortest', limit = None, max_cost = None) :
         """ Given a output string, return a list of input item strings that if run
-            would generate the given string"""
-        submode = mode
-        if mode == 'shortest' : submode = 'first1'
+            would generate the given string. In shortest mode they are sorted
+            by length, and if limit is given only the limit shortest are
+            found, by a best first search."""
         input = [ord(i) for i in string]
-        res = list(self.create_sequences(input, mode = submode))
-        if mode == 'shortest' :
-            res.sort(key=len)
-        return res
+        if mode == 'shortest' and limit is not None :
+            res = self._search('first1').shortest(input, limit, max_cost)
+        elif mode == 'shortest' :
+            res = self._search('first1').sequences(input, None, max_cost)
+        else :
+            res = self._search(mode).sequences(input, limit, max_cost)
+        return [[Key(k) for k in s] for s in res]
 
-    def coverage_test(self, mode = 'all') :
+    def coverage_test(self, mode = 'all', jobs = 1, limit = None) :
         """ Analyse the rules to come up with test input strings that will
             ensure that all rules are exercised"""
-        cache = {}
-        outputted = set()
-        for i in range(0, self.numrules) :
-            for c in self.flatten_context(i, side = 'l', mode = mode) :
-                last_context_item = c[-1]
-                if (last_context_item & 0xFFFF) > 0xFF00 : continue
-                if len(c) > 1 :
-                    for output in self.create_sequences(c[:-1], mode, cache) :
-                        res = output + [last_context_item]
-                        if res not in outputted :
-                            outputted.add(res)
-                            yield res
-                else :
-                    res = [last_context_item]
-                    if not res in outputted :
-                        outputted.add(res)
-                        yield res
+        for res in coverage_tests(self, mode, jobs, limit) :
+            yield [Key(k) for k in res]
 
 
 
 __all__=["keysyms_items","keysym_item",
-         "items_to_keys","item_to_key", "item_to_char"
+         "items_to_keys","item_to_key", "item_to_char", "items_to_chars",
          "keysym_scancodes", "chars_scancodes",
          "keysym_klcinfo", "char_keysym", "escape",
-         "Key", "Keyman"]
+         "Key", "Keyman", "ReverseSearch",
+         "rule_coverage", "coverage_tests"]
@@ -0,0 +1,120 @@
+'''
+Dependency tracking for tools that generate files from Keyman keyboards,
+such as keyboard description XML and diagrams, so that regenerating a large
+set of outputs only redoes those whose inputs have changed.
+
+A Manifest records, for each output, the content hash of every input it was
+made from and a hash of the settings it was made with. An output is current
+if it still exists and none of those has changed since it was recorded.
+Hashes are of file contents rather than modification times, so checking out
+or copying unchanged files does not cause outputs to be regenerated.
+'''
+__version__ = '20261019'
+__date__ = '19 October 2026'
+__history__ = '''
+    20261019 - Initial version
+'''
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+__all__ = ('Manifest', 'kmn_sources')
+
+_MANIFEST_VERSION = 1
+
+# KMFL include statements and the Keyman &includecodes store both name
+# another file whose content is compiled into the keyboard.
+_include = re.compile(r'''^\s*(?:include\s*\(?|store\s*\(\s*&includecodes\s*\))
+                          \s*(["'])(.+?)\1''',
+                      re.IGNORECASE | re.MULTILINE | re.VERBOSE)
+
+
+def kmn_sources(fname):
+    ''' Returns the paths of a kmn file and of every file it includes,
+        directly or through other includes, relative to the including file.
+        Includes that do not exist are listed, so that their appearing
+        later is seen as a change. '''
+    res = []
+    todo = [Path(fname)]
+    while todo:
+        path = todo.pop()
+        if path in res:
+            continue
+        res.append(path)
+        try:
+            text = path.read_text(encoding='utf-8-sig', errors='replace')
+        except OSError:
+            continue
+        # Normalised, so an include reached again through .. is seen
+        todo.extend(Path(os.path.normpath(path.parent / m.group(2)))
+                    for m in _include.finditer(text))
+    return res
+
+
+class Manifest(object):
+    ''' The inputs each output in a set was generated from, kept in a JSON
+        file. Input hashes are computed once per Manifest, so an input
+        shared by many outputs, such as a template, is only read once. '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.outputs = {}
+        self._digests = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('version') == _MANIFEST_VERSION:
+            self.outputs = saved.get('outputs', {})
+
+    def digest(self, path):
+        ''' The content hash of a file, or None if it cannot be read '''
+        path = os.path.abspath(path)
+        if path not in self._digests:
+            try:
+                with open(path, 'rb') as f:
+                    self._digests[path] = hashlib.sha1(f.read()).hexdigest()
+            except OSError:
+                self._digests[path] = None
+        return self._digests[path]
+
+    @staticmethod
+    def settings(settings):
+        return hashlib.sha1(repr(settings).encode('utf-8')).hexdigest()
+
+    def _entry(self, inputs, settings):
+        return {'settings': self.settings(settings),
+                'inputs': {os.path.abspath(p): self.digest(p)
+                           for p in inputs}}
+
+    def current(self, output, inputs, settings=()):
+        ''' Whether output exists and was recorded as generated from the
+            same inputs, with the same content, and settings '''
+        entry = self.outputs.get(os.path.abspath(output))
+        if entry is None or not os.path.exists(output):
+            return False
+        return entry == self._entry(inputs, settings)
+
+    def record(self, output, inputs, settings=()):
+        ''' Notes that output has just been generated from inputs '''
+        self.outputs[os.path.abspath(output)] = self._entry(inputs, settings)
+
+    def forget(self, output):
+        self.outputs.pop(os.path.abspath(output), None)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': _MANIFEST_VERSION,
+                           'outputs': self.outputs},
+                          f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -1,8 +1,11 @@
 import re
 import itertools
+import pickle
 from pprint import pformat
 from funcparserlib.lexer import make_tokenizer, Token, LexerError
-from funcparserlib.parser import (some, a, maybe, many, skip, finished, NoParseError)
+from funcparserlib.parser import (some, a, maybe, many, skip, finished, NoParseError,
+                                  State)
+from palaso.cache import DiskCache
 
 keyrowmap = {
     "E" : "1234567890-=",
@@ -56,52 +59,85 @@ class Rule(object):
     def __repr__(self):
         return str(self.before) + " + " + repr(self.match) + " > " + str(self.output)
 
-    def _apply(self, allStores, x, val):
+    def _term(self, allStores, x):
+        # (flattened store values, index) for a store reference, else
+        # (None, the value itself)
         if isinstance(x, AnyIndex):
-            if x.index < 0:
-                return allStores[x.name].values[val]
-            else:
-                return allStores[x.name].values[val[x.index]]
+            if x.name not in allStores:
+                return ([], x.index)
+            return (allStores[x.name].flatten().values, x.index)
         elif isinstance(x, DeadKey):
-            return x.char
+            return (None, x.char)
         else:
-            return x
-
-    def apply(self, allStores, vec):
-        before = []
-        for i, b in enumerate(self.before):
-            before.append(self._apply(allStores, b, vec[i]))
-        match = self._apply(allStores, self.match, vec[len(self.before)])
-        out = []
+            return (None, x)
+
+    def plan(self, allStores):
+        """ Resolves the rule's store references against allStores once,
+            returning (terms, outputs, lengths). terms are the _term of each
+            context item and the key; outputs are (kind, value, index) steps
+            building the output; and lengths are the store sizes the
+            context is enumerated over. """
+        plan = getattr(self, '_plan', None)
+        if plan is not None and plan[0] is allStores:
+            return plan[1]
+        terms = [self._term(allStores, b) for b in self.before]
+        terms.append(self._term(allStores, self.match))
+        lengths = tuple(1 if v is None else len(v) for v, _ in terms)
+        outputs = []
         for o in self.output:
             if hasattr(o, '__len__') and isinstance(o[0], Token):
                 if o[0].value.lower() == 'context':
-                    out.append(before[o[1] - 1])
+                    outputs.append(('item', None, o[1] - 1))
                 elif o[0].value.lower() == 'outs':
-                    out.extend(allStores[o[1].lower()].values)
+                    outputs.append(('outs', allStores[o[1].lower()].flatten().values, None))
             elif isinstance(o, Token):
                 if o.value.lower() == 'context':
-                    out.extend(before)
+                    outputs.append(('context', None, None))
                 else:
-                    out.append(o)
+                    outputs.append(('const', o, None))
             else:
-                out.append(self._apply(allStores, o, vec))
-        return Rule((before, ('+', match), out))
+                values, index = self._term(allStores, o)
+                if values is None:
+                    outputs.append(('const', index, None))
+                else:
+                    outputs.append(('store', values, index))
+        plan = (terms, outputs, lengths)
+        self._plan = (allStores, plan)
+        return plan
 
-    def _len(self, allStores, x):
-        if isinstance(x, AnyIndex):
-            if x.name not in allStores:
-                return 0
-            return len(allStores[x.name].flatten().values)
-        else:
-            return 1
+    @classmethod
+    def _make(cls, before, match, output):
+        res = cls.__new__(cls)
+        res.before = before
+        res.match = match
+        res.output = output
+        return res
+
+    def apply(self, allStores, vec):
+        terms, outputs, _ = self.plan(allStores)
+        items = []
+        for i, (values, index) in enumerate(terms):
+            if values is None:
+                items.append(index)
+            else:
+                items.append(values[vec[i] if index < 0 else vec[index]])
+        before = items[:-1]
+        out = []
+        for kind, value, index in outputs:
+            if kind == 'const':
+                out.append(value)
+            elif kind == 'store':
+                out.append(value[vec[index]])
+            elif kind == 'item':
+                out.append(before[index])
+            elif kind == 'context':
+                out.extend(before)
+            else:
+                out.extend(value)
+        return Rule._make(before, items[-1], out)
 
     def itervec(self, allStores, vec = None, start = 0):
-        vec = []
-        for b in self.before:
-            vec.append(range(self._len(allStores, b)))
-        vec.append(range(self._len(allStores, self.match)))
-        return itertools.product(*vec)
+        return itertools.product(*map(range, self.plan(allStores)[2]))
 
     def flatten(self, allStores):
         for v in self.itervec(allStores):
@@ -130,6 +166,13 @@ class DeadKey(object):
     def set_excludes(cls, exclset):
         cls.excludes = exclset
 
+    @classmethod
+    def reset(cls):
+        """ Forgets all deadkeys, before reading an unrelated keyboard """
+        cls.missing = 0xE000
+        cls.allkeys = {}
+        cls.excludes = set()
+
     @classmethod
     def increment(cls):
         while True:
@@ -150,6 +193,20 @@ class DeadKey(object):
         cls.increment()
         return res
 
+    def __reduce__(self):
+        return (_restore_deadkey, (self.number, self.char))
+
+def _restore_deadkey(number, char):
+    # Unpickled deadkeys keep their character, unless one with the same
+    # number already exists in this process, as a fresh parse would.
+    res = DeadKey.allkeys.get(number)
+    if res is None:
+        res = object.__new__(DeadKey)
+        res.number = number
+        res.char = char
+        DeadKey.allkeys[number] = res
+    return res
+
 specialkeys = {
     "quote": "C11", "bkquote": "E00", "comma": "B08", "bksp": "bksp",
     "hyphen": "E11", "period": "B09", "slash": "B10", "colon": "C10",
@@ -198,6 +255,11 @@ class VKey(object):
 class Store(object):
     allStores = {}
 
+    @classmethod
+    def reset(cls):
+        """ Forgets all stores, before reading an unrelated keyboard """
+        cls.allStores = {}
+
     def __init__(self, toklist):
         base = len(toklist) - 2
         self.name = toklist[base][1].lower()
@@ -218,6 +280,8 @@ class Store(object):
                 self.values.append(s)
             elif isinstance (s, Token) and s.value == 'beep':
                 self.values.append(s)
+            elif isinstance(s, DeadKey):
+                self.values.append(s)
             elif isinstance(s[0], Token):
                 if s[0].value.lower() == 'outs':
                     sub = self.allStores[s[1].lower()]
@@ -227,6 +291,17 @@ class Store(object):
                 self.values.extend(s)
         return self
 
+    @property
+    def indices(self):
+        """ A dict from each item in the store to its first index """
+        res = getattr(self, '_indices', None)
+        if res is None:
+            res = {}
+            for i, v in enumerate(self.flatten().values):
+                res.setdefault(v, i)
+            self._indices = res
+        return res
+
 def get_num(s):
     try:
         return int(s)
@@ -243,46 +318,398 @@ def get_char(v):
     else:
         return chr(int(v, 8))
 
+lexer_specs = [
+    ('SPACE', (r'(\\[ \t]*\r?\n|[ \t])+',re.MULTILINE)),
+    ('COMMENT', (r'[cC](?:[ \t]+[^\r\n]*)?(?=\r?\n)',)),
+    ('NL', (r'\r?\n',re.MULTILINE)),
+    ('KEYWORD', (r'any|index|store|outs|group|begin|use|beep|deadkey|dk|context|'
+                  'if|match|nomatch|notany|return|reset|save|set|nul|platform', re.I)),
+    ('USINGKEYS', (r'using\s*keys', re.I)),
+    ('HEADER', (r'name|hotkey|baselayout|bitmap|bitmaps|caps always off|caps on only|'
+                 'shift frees caps|copyright|language|layer|layout|message|platform', re.I)),
+    ('HEADERN', (r'version', re.I)),
+    ('OP', (r'[(),\[\]>=]',)),
+    ('STRING', (r'(?P<quote>["\']).*?(?P=quote)',)),
+    ('CHAR', (r'([uU]\+[0-9a-fA-F]{4,6})|([dD][0-9]+)|([xX][0-9A-Fa-f]+)',)),
+    ('PLUS', (r'\+',)),
+    ('NAME', (r'[A-Za-z&][A-Za-z0-9_\-\.]*',)),
+    ('NUMBER', (r'[0-9]+(\.[0-9]+)?',)),
+    ('TARGET', (r'\$[a-z]+:',)),
+]
+_lexer_useless = frozenset(['SPACE', 'COMMENT'])
+
+def _scoped(pattern, flags=0):
+    if flags & re.I:
+        pattern = '(?i:' + pattern + ')'
+    return pattern
+
+# All the token patterns as one regex, tried in the same order as
+# make_tokenizer tries them, the name of the matching group being the type.
+_lexer_scan = re.compile('|'.join('(?P<{}>{})'.format(t, _scoped(*args))
+                                  for t, args in lexer_specs)).finditer
+
+
+class _FastParser(object):
+    """ A hand written recursive descent parser for the grammar in
+        Parser.parse. It gives the same results and calls the same Parser
+        methods, in the same order, as the funcparserlib grammar but works a
+        statement at a time without general backtracking. """
+
+    def __init__(self, parser, toks):
+        self.parser = parser
+        self.toks = toks
+        self.pos = 0
+
+    def fail(self, what):
+        tok = self.toks[self.pos] if self.pos < len(self.toks) else None
+        raise NoParseError("expected {}, got {}".format(what, tok),
+                           State(self.pos, self.pos))
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.toks[i] if i < len(self.toks) else None
+
+    def next(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def is_type(self, kind, offset=0):
+        tok = self.peek(offset)
+        return tok is not None and tok.type == kind
+
+    def is_keyword(self, *words, offset=0):
+        tok = self.peek(offset)
+        return tok is not None and tok.type == 'KEYWORD' and tok.value.lower() in words
+
+    def is_op(self, op, offset=0):
+        tok = self.peek(offset)
+        return tok is not None and tok.type == 'OP' and tok.value == op
+
+    def expect_op(self, op):
+        if not self.is_op(op):
+            self.fail(repr(op))
+        self.pos += 1
+
+    def expect_type(self, *kinds):
+        tok = self.peek()
+        if tok is None or tok.type not in kinds:
+            self.fail(" or ".join(kinds))
+        self.pos += 1
+        return tok.value
+
+    # Terms
+    def onename(self):
+        res = []
+        while self.is_type('NAME') or self.is_type('KEYWORD') or self.is_type('HEADER') \
+                or self.is_type('NUMBER'):
+            res.append(self.next().value)
+        return "".join(res)
+
+    def name(self):
+        return self.expect_type('NAME', 'KEYWORD', 'HEADER')
+
+    def number(self):
+        return get_num(self.expect_type('NUMBER'))
+
+    def is_string(self):
+        return self.is_type('STRING') or self.is_type('CHAR')
+
+    def string(self):
+        tok = self.next()
+        if tok is None or tok.type not in ('STRING', 'CHAR'):
+            self.pos -= 1
+            self.fail('string')
+        return tok.value[1:-1] if tok.type == 'STRING' else get_char(tok.value)
+
+    def func(self, arg):
+        kw = self.next()
+        self.expect_op('(')
+        res = (kw, arg())
+        self.expect_op(')')
+        return res
+
+    def assign_func(self):
+        kw = self.next()
+        self.expect_op('(')
+        n = self.name()
+        self.expect_op('=')
+        v = self.string() if self.is_string() else self.name()
+        self.expect_op(')')
+        return (kw, n, v)
+
+    def vkey(self):
+        self.expect_op('[')
+        names = []
+        while not self.is_op(']'):
+            names.append(self.name())
+        self.pos += 1
+        return VKey(names)
+
+    def deadkey(self):
+        kw = self.next()
+        self.expect_op('(')
+        arg = self.number() if self.is_type('NUMBER') else self.name()
+        self.expect_op(')')
+        return DeadKey((kw, arg))
+
+    def index(self):
+        kw = self.next()
+        self.expect_op('(')
+        n = self.onename()
+        self.expect_op(',')
+        i = self.number()
+        self.expect_op(')')
+        return AnyIndex((kw, n, i))
+
+    def prefixes(self):
+        res = []
+        while True:
+            if self.is_type('TARGET'):
+                res.append(self.next().value)
+            elif self.is_keyword('if'):
+                res.append(self.assign_func())
+            elif self.is_keyword('platform'):
+                res.append(self.func(self.string))
+            else:
+                return res
+
+    def match(self):
+        """ A left hand side item, or None if there isn't one """
+        if self.is_keyword('any'):
+            return AnyIndex(self.func(self.onename))
+        elif self.is_string():
+            return self.string()
+        elif self.is_keyword('deadkey', 'dk'):
+            return self.deadkey()
+        elif self.is_keyword('notany'):
+            return self.func(self.onename)
+        return None
+
+    def context(self):
+        """ A right hand side item, or None if there isn't one """
+        tok = self.peek()
+        if tok is None:
+            return None
+        if tok.type == 'KEYWORD':
+            kw = tok.value.lower()
+            if kw == 'context':
+                if self.is_op('(', 1) and self.is_type('NUMBER', 2) and self.is_op(')', 3):
+                    return self.func(self.number)
+                return self.next()
+            elif kw in ('beep', 'nul'):
+                return self.next()
+            elif kw == 'index':
+                return self.index()
+            elif kw in ('deadkey', 'dk'):
+                return self.deadkey()
+            elif kw in ('use', 'reset', 'save', 'outs'):
+                return self.func(self.onename)
+            elif kw == 'set':
+                return self.assign_func()
+            return None
+        elif tok.type in ('STRING', 'CHAR'):
+            return self.string()
+        return None
+
+    def items(self, item):
+        res = []
+        while True:
+            x = item()
+            if x is None:
+                return res
+            res.append(x)
+
+    def nl(self):
+        if not self.is_type('NL'):
+            self.fail('newline')
+        self.pos += 1
+
+    # Statements, each returning None if the statement is not of its type
+    def header(self):
+        if self.is_type('HEADER'):
+            n = self.next().value.replace(' ', '')
+            v = self.string()
+        elif self.is_type('HEADERN'):
+            n = self.next().value
+            v = self.number()
+        else:
+            return None
+        self.nl()
+        return (n, v)
+
+    def store(self):
+        start = self.pos
+        pre = self.prefixes()
+        if not self.is_keyword('store'):
+            self.pos = start
+            return None
+        name = self.func(self.onename)
+        values = []
+        while True:
+            if self.is_string():
+                values.append(self.string())
+            elif self.is_keyword('outs'):
+                values.append(self.func(self.onename))
+            elif self.is_op('['):
+                values.append(self.vkey())
+            elif self.is_keyword('deadkey', 'dk'):
+                values.append(self.deadkey())
+            elif self.is_keyword('beep'):
+                values.append(self.next())
+            else:
+                break
+        self.nl()
+        return (pre, name, values)
+
+    def begin(self):
+        if not self.is_keyword('begin'):
+            return None
+        kw = self.next()
+        n = self.onename()
+        self.expect_op('>')
+        if not self.is_keyword('use'):
+            self.fail("use")
+        use = self.func(self.onename)
+        self.nl()
+        return (kw, n, use)
+
+    def group(self):
+        if not self.is_keyword('group'):
+            return None
+        res = self.parser.set_group(self.func(self.onename))
+        keys = self.next().value if self.is_type('USINGKEYS') else None
+        self.nl()
+        return (res, keys)
+
+    def rule(self):
+        start = self.pos
+        pre = self.prefixes()
+        before = self.items(self.match)
+        key = None
+        if self.is_type('PLUS'):
+            plus = self.next().value
+            if self.is_op('['):
+                key = (plus, self.vkey())
+            elif self.is_string():
+                key = (plus, self.string())
+            elif self.is_keyword('any'):
+                key = (plus, AnyIndex(self.func(self.onename)))
+            else:
+                self.fail('key')
+        if not self.is_op('>'):
+            self.pos = start
+            return None
+        self.pos += 1
+        outs = self.items(self.context)
+        self.nl()
+        return (pre, before, key, outs)
+
+    def matchrule(self):
+        if not self.is_keyword('match', 'nomatch') or not self.is_op('>', 1):
+            return None
+        kw = self.next()
+        self.pos += 1
+        outs = self.items(self.context)
+        self.nl()
+        return (kw, outs)
+
+    def parse(self):
+        p = self.parser
+        heads = []
+        while self.pos < len(self.toks):
+            res = self.header()
+            if res is not None:
+                heads.append(Store([(Token('HEADER', 'header'), '&' + res[0]), [res[1]]]))
+                continue
+            res = self.store()
+            if res is not None:
+                heads.append(p.make_store(res))
+                continue
+            res = self.begin()
+            if res is None:
+                break
+            p.store_begin(res)
+            heads.append(None)
+        body = []
+        while self.pos < len(self.toks):
+            res = self.group()
+            if res is not None:
+                body.append(res)
+                continue
+            res = self.rule()
+            if res is not None:
+                body.append(p.make_rule(res))
+                continue
+            res = self.matchrule()
+            if res is not None:
+                body.append(p.make_match_rule(res))
+                continue
+            res = self.store()
+            if res is None:
+                self.fail('statement')
+            body.append(p.make_store(res))
+        return (heads, body, None)
+
+
 class Parser(object):
 
-    def __init__(self, s, debug=False, platform={}):
+    def __init__(self, s, debug=False, platform={}, fast=True):
         self.allRules = { "": [] }
         self.uses = {}
+        self.nomatches = {}
         self.current_group = ""
         self.begins = {}
         self.allStores = {}
         self.allHeaders = {}
         self.platform = platform
+        self.fast = fast
         seq = self.tokenize(s)
         if debug:
             print(seq)
         self.tree = self.parse(seq)
 
     def tokenize(self, text):
-        lexer_specs = [
-            ('SPACE', (r'(\\[ \t]*\r?\n|[ \t])+',re.MULTILINE)),
-            ('COMMENT', (r'[cC](?:[ \t]+[^\r\n]*)?(?=\r?\n)',)),
-            ('NL', (r'\r?\n',re.MULTILINE)),
-            ('KEYWORD', (r'any|index|store|outs|group|begin|use|beep|deadkey|dk|context|'
-                          'if|match|nomatch|notany|return|reset|save|set|nul|platform', re.I)),
-            ('USINGKEYS', (r'using\s*keys', re.I)),
-            ('HEADER', (r'name|hotkey|baselayout|bitmap|bitmaps|caps always off|caps on only|'
-                         'shift frees caps|copyright|language|layer|layout|message|platform', re.I)),
-            ('HEADERN', (r'version', re.I)),
-            ('OP', (r'[(),\[\]>=]',)),
-            ('STRING', (r'(["\']).*?\1',)),
-            ('CHAR', (r'([uU]\+[0-9a-fA-F]{4,6})|([dD][0-9]+)|([xX][0-9A-Fa-f]+)',)),
-            ('PLUS', (r'\+',)),
-            ('NAME', (r'[A-Za-z&][A-Za-z0-9_\-\.]*',)),
-            ('NUMBER', (r'[0-9]+(\.[0-9]+)?',)),
-            ('TARGET', (r'\$[a-z]+:',)),
-        ]
-        useless = ['SPACE', 'COMMENT']
+        if not self.fast:
+            return self._tokenize_slow(text)
+        res = []
+        append = res.append
+        blank = True
+        line, linestart = 1, 0
+        pos = 0
+        for m in _lexer_scan(text):
+            start = m.start()
+            if start != pos:
+                break
+            kind = m.lastgroup
+            pos = m.end()
+            if kind == 'NL' or kind == 'SPACE':
+                # Only these can span lines
+                value = m.group()
+                begin = (line, start - linestart + 1)
+                nls = value.count('\n')
+                if nls:
+                    line += nls
+                    linestart = start + value.rfind('\n') + 1
+                if kind == 'SPACE' or blank:
+                    continue
+                blank = True
+                append(Token(kind, value, begin, (line, pos - linestart)))
+            elif kind != 'COMMENT':
+                blank = False
+                append(Token(kind, m.group(), (line, start - linestart + 1),
+                             (line, pos - linestart)))
+        if pos != len(text):
+            raise LexerError((line, pos - linestart + 1),
+                             text.splitlines()[line - 1])
+        return res
+
+    def _tokenize_slow(self, text):
         t = make_tokenizer(lexer_specs)
         res = []
         blank = True
         for i, x in enumerate(t(text)):
-            if x.type in useless:
+            if x.type in _lexer_useless:
                 continue
             if blank and x.type == 'NL':
                 continue
@@ -330,15 +757,17 @@ class Parser(object):
         return r
 
     def make_match_rule(self, seq):
-        if seq[0].value == 'match' and \
-                isinstance(seq[1][0][0], Token) and seq[1][0][0].type == 'KEYWORD' and \
+        if isinstance(seq[1][0][0], Token) and seq[1][0][0].type == 'KEYWORD' and \
                     seq[1][0][0].value == 'use':
-            self.uses.setdefault(self.current_group, set()).add(seq[1][0][1].lower())
+            uses = self.uses if seq[0].value.lower() == 'match' else self.nomatches
+            uses.setdefault(self.current_group, set()).add(seq[1][0][1].lower())
 
     def store_begin(self, seq):
         self.begins[seq[1].lower()] = seq[2][1].lower()
 
     def parse(self, seq):
+        if self.fast:
+            return _FastParser(self, seq).parse()
         const = lambda x: lambda _: x
         unarg = lambda f: lambda x: f(*x)
         tokval = lambda x: x.value
@@ -391,3 +820,51 @@ class Parser(object):
                             (store >> self.make_store))) + finished
         return kmfile.parse(seq)
 
+
+
+class ParseCache(DiskCache):
+    """ A store of parsed keyboards on disk, keyed by a hash of the kmn
+        source and the platform it was parsed for, so that tools working on
+        the same keyboard only parse it once. By default the keyboards are
+        kept in the user's cache directory, see palaso.cache.DiskCache. """
+    kind = 'kmn'
+    suffix = '.pickle'
+    version = 2
+
+    def key(self, text, platform={}):
+        return self.digest(repr((self.version, sorted(platform.items()))),
+                           text.encode('utf-8'))
+
+    def get(self, key):
+        data = self.read(key)
+        if data is None:
+            return None
+        try:
+            saved = pickle.loads(data)
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        p = saved['parser']
+        # Stores register themselves by name when created, not when unpickled
+        for st in itertools.chain(p.tree[0], p.allStores.values(), p.allHeaders.values()):
+            if isinstance(st, Store):
+                Store.allStores[st.name] = st
+        DeadKey.missing = max(DeadKey.missing, saved['missing'])
+        return p
+
+    def put(self, key, parser):
+        self.write(key, pickle.dumps({'parser': parser, 'missing': DeadKey.missing},
+                                     pickle.HIGHEST_PROTOCOL))
+
+def load(fname, platform={}, cache=None):
+    """ Returns a Parser for the given kmn file, from cache if it has been
+        parsed for this platform before """
+    with open(fname, encoding='utf-8-sig') as f:
+        text = f.read()
+    if cache is None:
+        return Parser(text, platform=platform)
+    key = cache.key(text, platform)
+    p = cache.get(key)
+    if p is None:
+        p = Parser(text, platform=platform)
+        cache.put(key, p)
+    return p
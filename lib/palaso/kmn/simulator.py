@@ -0,0 +1,303 @@
+'''
+A pure Python simulator for Keyman keyboards, driven by the rules and stores
+read by palaso.kmn.parser.Parser, for testing keyboards where the kmfl
+binding is not available.
+
+Each group's rules are indexed by the key they match, and each key's rules
+are kept in a trie over the context, matched backwards from the cursor.
+Trie nodes are built lazily the first time a context item is seen at that
+depth, so after a few keystrokes finding the rule for a key is a handful of
+dictionary lookups rather than a scan of every rule in the group.
+'''
+__version__ = '20261019'
+__date__ = '19 October 2026'
+__history__ = '''
+    20261019 - Initial version
+'''
+import re
+from palaso.kmn.parser import (AnyIndex, DeadKey, VKey, Token,
+                               keymap, mapkey, load)
+
+__all__ = ('Simulator', 'parse_keys')
+
+# Key names VKey gives that keymap knows by another name
+_vkaliases = {'space': ' '}
+
+# The character a key produces when no rule handles it
+_keychars = {v: k for k, v in keymap.items() if len(k) == 1}
+
+
+def parse_keys(s):
+    ''' Splits a string of keys in kmn notation, where [SHIFT K_A] is a
+        virtual key, \\x is a literal x and any other character is the key
+        that types it, into a list of keystrokes '''
+    res = []
+    for k in re.split(r'(\\.|\[[^\]]+\]|.)', s)[1::2]:
+        if k[0] == '[' and len(k) > 1:
+            res.append(VKey(k[1:-1].split()))
+        else:
+            res.append(k[-1])
+    return res
+
+
+def _keyname(tok):
+    if isinstance(tok, VKey):
+        key, mods = tok.getkey()
+        if key in _vkaliases:
+            key = keymap[_vkaliases[key]][0]
+        return key, mods
+    try:
+        return mapkey(tok)
+    except KeyError:
+        return tok
+
+
+def _keystroke(key):
+    ''' Returns the (key name, character typed) for a keystroke given as a
+        character, VKey or (key, modifiers) pair '''
+    if isinstance(key, tuple):
+        return key, _keychars.get((key[0], key[1] == 'shift'))
+    name = _keyname(key)
+    if isinstance(key, str):
+        return name, key
+    return name, _keychars.get((name[0], name[1] == 'shift'))
+
+
+class _Rule(object):
+    ''' A rule compiled for one key. The context is a list of
+        (kind, value, store) tests, one per item, and keyindex is the store
+        index the key was matched at. '''
+    __slots__ = ('rule', 'context', 'length', 'keyindex')
+
+    def __init__(self, rule, context, keyindex=None):
+        self.rule = rule
+        self.context = context
+        self.length = len(context)
+        self.keyindex = keyindex
+
+    def accepts(self, depth, item):
+        kind, value, _ = self.context[self.length - depth - 1]
+        if kind == 'char':
+            return item == value
+        elif kind == 'store':
+            return item in value
+        elif kind == 'notany':
+            return isinstance(item, str) and item not in value
+        return item is value
+
+    def bind(self, items):
+        ''' Returns the store indices matched at each position of the rule,
+            or None if an index() in the context is not satisfied '''
+        res = [None] * (self.length + 1)
+        res[self.length] = self.keyindex
+        for i, (kind, value, ref) in enumerate(self.context):
+            if kind != 'store':
+                continue
+            if ref < 0:
+                res[i] = value[items[i]]
+            elif ref >= len(res) or res[ref] is None \
+                    or value.get(items[i]) != res[ref]:
+                return None
+            else:
+                res[i] = res[ref]
+        return res
+
+
+class _Node(object):
+    ''' A trie node holding the rules whose last depth context items are
+        known to match '''
+    __slots__ = ('depth', 'rules', 'final', 'deeper', 'children')
+
+    def __init__(self, rules, depth=0):
+        self.depth = depth
+        self.rules = rules
+        self.final = [r for r in rules if r.length == depth]
+        self.deeper = len(self.final) < len(rules)
+        self.children = {}
+
+    def child(self, item):
+        res = self.children.get(item)
+        if res is None:
+            res = _Node([r for r in self.rules
+                         if r.length > self.depth
+                         and r.accepts(self.depth, item)], self.depth + 1)
+            self.children[item] = res
+        return res
+
+    def find(self, context):
+        ''' Returns the first rule in keyboard order matching the end of
+            context, and its store bindings '''
+        path = [self]
+        node = self
+        n = len(context)
+        while node.deeper and node.depth < n:
+            node = node.child(context[n - node.depth - 1])
+            path.append(node)
+        for node in reversed(path):
+            for r in node.final:
+                binding = r.bind(context[n - r.length:])
+                if binding is not None:
+                    return r, binding
+        return None, None
+
+
+class _Group(object):
+    __slots__ = ('name', 'usingkeys', 'keys', 'root')
+
+    def __init__(self, name, rules, compiler):
+        self.name = name
+        self.usingkeys = any(r.match is not None for r in rules)
+        # Keyman tries rules with the longest context first
+        rules = sorted(rules, key=lambda r: -compiler.context_length(r))
+        if not self.usingkeys:
+            self.root = _Node([compiler.compile(r) for r in rules])
+            self.keys = {}
+            return
+        keys = {}
+        for r in rules:
+            for key, index in compiler.keys(r.match):
+                keys.setdefault(key, []).append(compiler.compile(r, index))
+        self.keys = {k: _Node(v) for k, v in keys.items()}
+        self.root = None
+
+    def find(self, key, context):
+        node = self.root if key is None else self.keys.get(key)
+        if node is None:
+            return None, None
+        return node.find(context)
+
+
+class Simulator(object):
+    ''' Types keystrokes into a Keyman keyboard read by Parser, keeping the
+        context, deadkeys included, as a list of items. '''
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.stores = parser.allStores
+        for s in self.stores.values():
+            s.flatten()
+        self.groups = {name: _Group(name, rules, self)
+                       for name, rules in parser.allRules.items()}
+        begin = parser.begins.get('unicode') or \
+            next(iter(parser.begins.values()), None)
+        self.begin = self.groups[begin]
+        self.uses = parser.uses
+        self.nomatches = parser.nomatches
+        self.reset()
+
+    @classmethod
+    def fromfile(cls, fname, platform={}, cache=None):
+        return cls(load(fname, platform, cache))
+
+    # Rule compilation
+    def store_index(self, name):
+        return self.stores[name].indices
+
+    def context_length(self, rule):
+        return sum(len(b) if isinstance(b, str) else 1 for b in rule.before)
+
+    def compile(self, rule, keyindex=None):
+        context = []
+        for b in rule.before:
+            if isinstance(b, str):
+                context.extend(('char', c, None) for c in b)
+            elif isinstance(b, AnyIndex):
+                context.append(('store', self.store_index(b.name), b.index))
+            elif isinstance(b, DeadKey):
+                context.append(('deadkey', b, None))
+            else:
+                values = set(self.stores[b[1].lower()].values)
+                context.append(('notany', values, None))
+        return _Rule(rule, context, keyindex)
+
+    def keys(self, match):
+        ''' Yields the (key, store index) for each key a rule matches '''
+        if isinstance(match, AnyIndex):
+            for i, v in enumerate(self.stores[match.name].values):
+                yield _keyname(v), i
+        else:
+            yield _keyname(match), None
+
+    # Typing
+    def reset(self, context=''):
+        self.context = list(context)
+        self.beeps = 0
+
+    @property
+    def output(self):
+        return ''.join(x for x in self.context if isinstance(x, str))
+
+    def press(self, key):
+        ''' Processes a single keystroke '''
+        name, char = _keystroke(key)
+        self._process(self.begin, name, char)
+
+    def type(self, keys):
+        ''' Processes a sequence of keystrokes, or a string in the notation
+            parse_keys accepts, returning the output '''
+        if isinstance(keys, str):
+            keys = parse_keys(keys)
+        for k in keys:
+            self.press(k)
+        return self.output
+
+    def run(self, keys, context=''):
+        ''' Returns the output of typing keys from the given context '''
+        self.reset(context)
+        return self.type(keys)
+
+    def _process(self, group, name=None, char=None):
+        rule, binding = group.find(name if group.usingkeys else None,
+                                   self.context)
+        if rule is None:
+            nomatches = self.nomatches.get(group.name, ())
+            # A nomatch rule takes over the key from the default output
+            if group.usingkeys and not nomatches:
+                if name == ('bksp', ''):
+                    self._backspace()
+                elif char is not None:
+                    self.context.append(char)
+            for g in nomatches:
+                self._process(self.groups[g], name, char)
+            return False
+        n = len(self.context) - rule.length
+        matched = self.context[n:]
+        del self.context[n:]
+        self._output(rule, matched, binding, name, char)
+        for g in self.uses.get(group.name, ()):
+            self._process(self.groups[g], name, char)
+        return True
+
+    def _backspace(self):
+        ctx = self.context
+        while ctx and isinstance(ctx[-1], DeadKey):
+            ctx.pop()
+        if ctx:
+            ctx.pop()
+        while ctx and isinstance(ctx[-1], DeadKey):
+            ctx.pop()
+
+    def _output(self, rule, matched, binding, name=None, char=None):
+        ctx = self.context
+        for o in rule.rule.output:
+            if isinstance(o, str):
+                ctx.extend(o)
+            elif isinstance(o, DeadKey):
+                ctx.append(o)
+            elif isinstance(o, AnyIndex):
+                i = binding[o.index] if 0 <= o.index < len(binding) else None
+                if i is not None:
+                    ctx.append(self.stores[o.name].values[i])
+            elif isinstance(o, Token):
+                if o.value.lower() == 'context':
+                    ctx.extend(matched)
+                elif o.value.lower() == 'beep':
+                    self.beeps += 1
+            elif isinstance(o[0], Token):
+                cmd = o[0].value.lower()
+                if cmd == 'context':
+                    ctx.append(matched[o[1] - 1])
+                elif cmd == 'outs':
+                    ctx.extend(self.stores[o[1].lower()].values)
+                elif cmd == 'use':
+                    self._process(self.groups[o[1].lower()], name, char)
@@ -29,11 +29,35 @@ def _iterate_random(digits):
     n_products = reduce(operator.mul,map(len,digits))
     return islice((_pick(pid,digits) for pid in _rands(n_products)), n_products)        
 
-def _iterate_random_all(digits):
+def permutation(n, seed=None, rounds=4):
+    """Yields each of range(n) once, in a pseudo-random order, using O(1)
+    memory however large n is. The order is a Feistel network over the
+    smallest even number of bits that covers n, walking the cycle from any
+    value outside range(n) until it falls inside. It is decided by seed,
+    or by the random module's state if seed is None."""
+    if n <= 0:
+        return
+    half = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    rng = random.Random(seed) if seed is not None else random
+    keys = [rng.getrandbits(64) for _ in range(rounds)]
+
+    def encrypt(x):
+        left, right = x >> half, x & mask
+        for k in keys:
+            f = ((right ^ k) * 0x9E3779B97F4A7C15 >> 17) & mask
+            left, right = right, left ^ f
+        return (left << half) | right
+
+    for i in range(n):
+        x = encrypt(i)
+        while x >= n:
+            x = encrypt(x)
+        yield x
+
+def _iterate_random_all(digits, seed=None):
     n_products = reduce(operator.mul,map(len,digits))
-    schedule = range(n_products)
-    random.shuffle(schedule)
-    return (_pick(pid,digits) for pid in schedule)
+    return (_pick(pid,digits) for pid in permutation(n_products, seed))
 
 def _iterate_random_all_depth(digits):
     digits = [ds[:] for ds in digits]
@@ -656,6 +656,9 @@ class parser(collections.Iterable):
         return parent_tag in occurs
 
     def _default_(self, parent):
+        # Track this locally rather than checking len(parent), so content
+        # streamed out by _subnode() is accounted for.
+        empty = parent is not None and len(parent) == 0
         for tok in self._tokens:
             tag = self.__get_tag(parent, tok)
             if tag:  # Parse markers.
@@ -674,8 +677,8 @@ class parser(collections.Iterable):
                     # and recurse
                     if tag.nested:
                         e.annotations['nested'] = True
-                    e.extend(sub_parser(e))
-                    yield e
+                    yield from self._subnode(e, sub_parser(e))
+                    empty = False
                 elif parent is None:
                     tok = Text(tag, tok.pos, tok.parent)
                     # We've failed to find a home for marker tag, poor thing.
@@ -700,19 +703,36 @@ class parser(collections.Iterable):
                     self._tokens.put_back(tok)
                     return
             else:   # Pass non marker data through with a litte fix-up
-                if parent is not None \
-                        and len(parent) == 0 \
+                if empty \
                         and not tok.startswith(('\r\n', '\n', '\\', '|')):
                     tok = tok[1:]
                 if tok:
                     tok.parent = parent
                     yield tok
+                    empty = False
         if parent is not None:
             if parent.meta['Endmarker']:
                 self._force_close(parent, self._eos)
                 parent.annotations['implicit-closed'] = True
         return
 
+    def _subnode(self, e, content):
+        """
+        Called by the parser to attach the content of a newly spawned element
+        to it. Returns an iterable over what to yield in its place.
+        Subclasses can override this to hand out elements before their
+        content has been parsed, so a whole document need never be held in
+        memory. Any content a consumer doesn't pull from the parser before
+        asking for the next node must be drained by the override. Parsers
+        that rework content after parsing it, such as USFM footnote
+        canonicalisation, need the content left attached to such elements.
+
+        e: The Element, with no content yet.
+        content: An iterator over e's child nodes, that drives the parse.
+        """
+        e.extend(content)
+        return (e,)
+
     def _Milestone_(self, parent):
         return tuple()
     _milestone_ = _Milestone_
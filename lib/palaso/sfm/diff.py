@@ -0,0 +1,204 @@
+'''
+Structural differences between two parsed SFM documents, such as two
+revisions of a USFM book. Rather than comparing the generated text, the
+element trees are flattened into verse anchored units of marker and text
+tokens. Each unit is digested once so unchanged verses are matched up in
+constant time, and only the units that differ are compared token by token.
+Digests are of the unit's content, so they are the same from run to run
+and can be saved alongside a document for comparison later.
+'''
+__version__ = '20261019'
+__date__ = '19 October 2026'
+__history__ = '''
+    20261019 - Initial version
+'''
+from .. import sfm
+from collections import defaultdict
+from difflib import SequenceMatcher
+import hashlib
+from typing import List, NamedTuple, Optional, Tuple
+
+__all__ = ('Marker', 'Unit', 'Edit', 'Op', 'units', 'diff')
+
+
+class Marker(NamedTuple):
+    '''A start or end marker token, with any marker arguments.'''
+    name: str
+    args: Tuple[str, ...] = ()
+
+    def __str__(self) -> str:
+        return f"\\{' '.join((self.name,) + self.args)}"
+
+
+Ref = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+class Unit(NamedTuple):
+    '''
+    The tokens from a verse marker up to the next verse or chapter marker.
+    Content before the first verse in a chapter forms a unit with no verse.
+    '''
+    ref: Ref
+    pos: sfm.Position
+    tokens: tuple
+    digest: bytes
+
+
+class Edit(NamedTuple):
+    '''
+    A run of tokens replaced within a unit. The kind is 'text' when only
+    text changed, otherwise 'markup'. An empty old or new side means the
+    tokens were inserted or deleted.
+    '''
+    kind: str
+    old: tuple
+    new: tuple
+
+
+class Op(NamedTuple):
+    '''
+    A difference between documents. The kind is one of 'insert', 'delete',
+    'move', for a unit found unchanged at a different place, or 'change',
+    which carries the edits needed to turn the old unit into the new one.
+    '''
+    kind: str
+    old: Optional[Unit]
+    new: Optional[Unit]
+    edits: Tuple[Edit, ...] = ()
+
+
+def _digest(tokens: tuple) -> bytes:
+    # Text tokens are plain strs and markers are tuples of strs, so the
+    # repr is an unambiguous serialisation of the unit.
+    return hashlib.blake2b(repr(tokens).encode('utf-8'),
+                           digest_size=16).digest()
+
+
+def units(doc) -> List[Unit]:
+    r'''
+    Flatten a sequence of element trees into verse anchored units.
+
+    >>> from palaso.sfm import usfm
+    >>> for u in units(usfm.parser([r'\id MAT\c 1\s Title\p\v 1 In \w the\w*'
+    ...                             r' beginning\v 2 Then'])):
+    ...     print(u.ref, ' '.join(map(str, u.tokens)))
+    ('MAT', None, None) \id MAT
+    ('MAT', '1', None) \c 1 \s Title \p
+    ('MAT', '1', '1') \v 1 In  \w the \w*  beginning
+    ('MAT', '1', '2') \v 2 Then
+    '''
+    result = []
+    ref = [None, None, None]
+    tokens = []
+    pos = [sfm.Position(1, 1)]
+    # Stylesheet lookups are comparatively slow, and metadata is shared by
+    # every element with the same marker, so cache the end markers.
+    endmarkers = {}
+
+    def _flush(node):
+        if tokens:
+            t = tuple(tokens)
+            result.append(Unit(tuple(ref), pos[0], t, _digest(t)))
+            tokens.clear()
+        pos[0] = node.pos
+
+    def _g(node):
+        if not isinstance(node, sfm.Element):
+            if not tokens:
+                pos[0] = node.pos
+            tokens.append(str(node))
+            return
+        if node.name == 'id':
+            _flush(node)
+            ref[:] = [str(node[0]).split()[0]
+                      if node and isinstance(node[0], str) else None,
+                      None, None]
+        elif node.name == 'c':
+            _flush(node)
+            ref[1:] = [node.args[0] if node.args else None, None]
+        elif node.name == 'v':
+            _flush(node)
+            ref[2] = node.args[0] if node.args else None
+        elif not tokens:
+            pos[0] = node.pos
+        tokens.append(Marker(node.name or '', tuple(node.args)))
+        for child in node:
+            _g(child)
+        meta = node.meta
+        end = endmarkers.get(id(meta), False)
+        if end is False:
+            end = endmarkers[id(meta)] = meta.get('Endmarker')
+        if end and 'implicit-closed' not in node.annotations:
+            tokens.append(Marker(end))
+
+    for tree in doc:
+        _g(tree)
+    _flush(sfm.Text(''))
+    return result
+
+
+def _edits(old: Unit, new: Unit) -> Tuple[Edit, ...]:
+    sm = SequenceMatcher(None, old.tokens, new.tokens, autojunk=False)
+    return tuple(
+        Edit('text' if all(isinstance(t, str)
+                           for t in old.tokens[i1:i2] + new.tokens[j1:j2])
+             else 'markup',
+             old.tokens[i1:i2], new.tokens[j1:j2])
+        for tag, i1, i2, j1, j2 in sm.get_opcodes() if tag != 'equal')
+
+
+def diff(old, new) -> List[Op]:
+    r'''
+    Compare two documents, given as sequences of element trees or lists of
+    units, returning the operations that turn old into new in new document
+    order, with deletions placed where they occured.
+
+    >>> from palaso.sfm import usfm
+    >>> old = list(usfm.parser([r'\id MAT\c 1\p\v 1 One \v 2 Two \v 3 Three'
+    ...                         r' \v 4 Four \v 5 Five']))
+    >>> new = list(usfm.parser([r'\id MAT\c 1\p\v 1 One \v 3 Three \v 2 Two'
+    ...                         r' \v 4 \nd Four\nd* \v 6 Six']))
+    >>> for op in diff(old, new):
+    ...     print(op.kind, (op.old or op.new).ref,
+    ...           [(e.kind, e.old, e.new) for e in op.edits])
+    move ('MAT', '1', '3') []
+    change ('MAT', '1', '4') [('markup', ('Four ',), (Marker(name='nd', args=()), 'Four', Marker(name='nd*', args=()), ' '))]
+    insert ('MAT', '1', '6') []
+    delete ('MAT', '1', '5') []
+    >>> diff(old, old)
+    []
+    '''  # noqa: E501
+    old = old if _is_units(old) else units(old)
+    new = new if _is_units(new) else units(new)
+    sm = SequenceMatcher(None,
+                         [u.digest for u in old], [u.digest for u in new],
+                         autojunk=False)
+    blocks = [(old[i1:i2], new[j1:j2])
+              for tag, i1, i2, j1, j2 in sm.get_opcodes() if tag != 'equal']
+
+    # Units outside the matched runs are paired up by reference, whichever
+    # block they are in, so a verse that moved is not seen as a deletion
+    # and an insertion.
+    unmatched = defaultdict(list)
+    for olds, _ in blocks:
+        for u in olds:
+            unmatched[u.ref].append(u)
+    ops = []
+    for olds, news in blocks:
+        for u in news:
+            matches = unmatched.get(u.ref)
+            if not matches:
+                ops.append([Op('insert', None, u)])
+                continue
+            o = matches.pop(0)
+            ops.append([Op('move', o, u) if o.digest == u.digest
+                        else Op('change', o, u, _edits(o, u))])
+        ops.append(olds)
+    deleted = {id(u) for us in unmatched.values() for u in us}
+    return [op if isinstance(op, Op) else Op('delete', op, None)
+            for block in ops for op in block
+            if isinstance(op, Op) or id(op) in deleted]
+
+
+def _is_units(doc) -> bool:
+    return isinstance(doc, list) and all(isinstance(u, Unit) for u in doc)
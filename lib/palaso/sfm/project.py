@@ -0,0 +1,263 @@
+'''
+A persistent index over the books of a Paratext project. Each book is parsed
+once with the USFM parser and summarised: its id, chapter and verse counts,
+a histogram of the markers used, the diagnostics the parser raised and a hash
+of the file's content. The index is saved between runs, and refreshing it
+only re-parses books whose content hash has changed, and only hashes those
+whose size or modification time has changed, so project wide queries
+such as which books use a marker, or how many warnings there are in total,
+are answered without parsing anything.
+'''
+__version__ = '20261019'
+__date__ = '19 October 2026'
+__history__ = '''
+    20261019 - Initial version
+'''
+from . import usfm, style
+from .. import sfm
+from collections import Counter
+from itertools import chain
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import bz2
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import time
+import warnings
+
+__all__ = ('Book', 'ProjectIndex')
+
+_INDEX_VERSION = 3
+# A file modified this recently may be changed again without its mtime
+# moving, at coarse timestamp resolutions, so its stat is not relied on.
+_RACY_NS = 2_000_000_000
+
+
+class Book(NamedTuple):
+    '''The summary of a single book file recorded in the index.'''
+    path: str
+    digest: str
+    id: Optional[str]
+    verses: Dict[str, int]
+    markers: Counter
+    warnings: Tuple[str, ...]
+    error: Optional[str] = None
+    stat: Optional[Tuple[int, int]] = None
+
+    @property
+    def chapters(self) -> int:
+        return len(self.verses)
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _stat(path: Path) -> Optional[Tuple[int, int]]:
+    st = path.stat()
+    if time.time_ns() - st.st_mtime_ns < _RACY_NS:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _summarise(path: str, data: bytes, stylesheet, error_level,
+               filename: Optional[str] = None) -> Book:
+    book_id = None
+    verses = {}
+    markers = Counter()
+    chapter = [None]
+
+    def _g(node):
+        nonlocal book_id
+        if not isinstance(node, sfm.Element):
+            return
+        markers[node.name] += 1
+        if node.name == 'id' and book_id is None \
+                and node and isinstance(node[0], str):
+            book_id = str(node[0]).split()[0] if node[0].split() else None
+        elif node.name == 'c' and node.args:
+            chapter[0] = node.args[0]
+            verses.setdefault(chapter[0], 0)
+        elif node.name == 'v' and chapter[0] is not None:
+            verses[chapter[0]] += 1
+        for child in node:
+            _g(child)
+
+    error = None
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter('always', SyntaxWarning)
+        try:
+            # The parser names its source in messages by its name attribute
+            source = io.StringIO(data.decode('utf_8_sig'))
+            source.name = filename or path
+            for tree in usfm.parser(source,
+                                    stylesheet=stylesheet,
+                                    error_level=error_level):
+                _g(tree)
+        except (SyntaxError, UnicodeDecodeError) as err:
+            error = str(err)
+    return Book(path, _digest(data), book_id, verses, markers,
+                tuple(str(w.message) for w in warns
+                      if issubclass(w.category, SyntaxWarning)),
+                error)
+
+
+class ProjectIndex(object):
+    '''
+    An index of the SFM files in a Paratext project directory, matching the
+    sfms glob patterns. The stylesheets, given as paths relative to the
+    project, are applied over the default USFM stylesheet in order, preceded
+    by the project's custom.sty if load_project_sty is set and it exists.
+
+    The index is kept in cache, by default a per project file in the user's
+    palaso-python data directory, and is brought up to date with refresh().
+    If the stylesheets or error level differ from those used to build the
+    saved index it is discarded and every book re-parsed.
+    '''
+    def __init__(self, project, sfms=('*.SFM', '*.sfm'),
+                 stylesheets=(), load_project_sty=True,
+                 error_level=usfm.ErrorLevel.Unrecoverable,
+                 cache=None):
+        self.project = Path(project)
+        self.sfms = tuple(sfms)
+        self.error_level = error_level
+        self.stylesheets = list(stylesheets)
+        if load_project_sty and (self.project / 'custom.sty').exists():
+            self.stylesheets.insert(0, 'custom.sty')
+        if cache is None:
+            key = _digest(str(self.project.resolve()).encode('utf-8'))
+            cache = Path(usfm._PALASO_DATA, 'index', key + os.extsep + 'cz')
+        self.cache = Path(cache)
+        self.books: Dict[str, Book] = {}
+        self._stylesheet = None
+        self._fingerprint = self._settings_digest()
+        self.load()
+
+    def _settings_digest(self) -> str:
+        h = hashlib.sha1(repr((_INDEX_VERSION, int(self.error_level),
+                               self.stylesheets)).encode('utf-8'))
+        for p in self.stylesheets:
+            h.update((self.project / p).read_bytes())
+        return h.hexdigest()
+
+    @property
+    def stylesheet(self):
+        if self._stylesheet is None:
+            sheet = usfm.default_stylesheet.copy()
+            for p in self.stylesheets:
+                with (self.project / p).open() as sty:
+                    sheet = style.update_sheet(sheet, style.parse(sty))
+            self._stylesheet = sheet
+        return self._stylesheet
+
+    def load(self) -> bool:
+        '''
+        Load the saved index, returning False if there is none or it was
+        built with different settings.
+        '''
+        try:
+            with contextlib.closing(bz2.BZ2File(self.cache, 'rb')) as zf:
+                saved = pickle.load(zf)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        if saved.get('fingerprint') != self._fingerprint:
+            return False
+        self.books = saved['books']
+        return True
+
+    def save(self):
+        '''Write the index to its cache file.'''
+        self.cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache.with_name(self.cache.name + '.tmp')
+        with contextlib.closing(bz2.BZ2File(tmp, 'wb')) as zf:
+            pickle.dump({'fingerprint': self._fingerprint,
+                         'books': self.books},
+                        zf, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.cache)
+
+    def paths(self) -> List[Path]:
+        '''The project files currently matching the sfms glob patterns.'''
+        return sorted(set(chain.from_iterable(map(self.project.glob,
+                                                  self.sfms))))
+
+    def refresh(self, save=True) -> List[str]:
+        '''
+        Bring the index up to date with the project on disk, parsing only
+        books that are new or whose content has changed, and dropping those
+        that no longer exist. A book is only read and hashed if its size or
+        modification time differ from those recorded. Returns the names of
+        the books that were added, updated or removed.
+        '''
+        changed = []
+        touched = False
+        seen = set()
+        for path in self.paths():
+            name = path.name
+            seen.add(name)
+            stat = _stat(path)
+            book = self.books.get(name)
+            if book is not None and stat is not None and book.stat == stat:
+                continue
+            data = path.read_bytes()
+            if book is not None and book.digest == _digest(data):
+                if book.stat != stat:
+                    self.books[name] = book._replace(stat=stat)
+                    touched = True
+                continue
+            self.books[name] = _summarise(name, data,
+                                          self.stylesheet, self.error_level,
+                                          str(path))._replace(stat=stat)
+            changed.append(name)
+        for name in set(self.books) - seen:
+            del self.books[name]
+            changed.append(name)
+        if (changed or touched) and save:
+            self.save()
+        return sorted(changed)
+
+    def watch(self, interval=1.0, save=True):
+        '''
+        Poll the project every interval seconds, yielding the list of
+        changed books each time the index is updated. This runs until the
+        consumer stops iterating.
+        '''
+        while True:
+            changed = self.refresh(save=save)
+            if changed:
+                yield changed
+            time.sleep(interval)
+
+    def __iter__(self):
+        return iter(self.books.values())
+
+    def __len__(self):
+        return len(self.books)
+
+    def __getitem__(self, name) -> Book:
+        return self.books[name]
+
+    def by_id(self, book_id) -> Optional[Book]:
+        '''Return the book with the given \\id code, if it is indexed.'''
+        return next((b for b in self if b.id == book_id), None)
+
+    def using(self, marker) -> List[Book]:
+        '''The books that contain at least one use of marker.'''
+        marker = marker.lstrip('\\')
+        return [b for b in self if b.markers[marker]]
+
+    def markers(self) -> Counter:
+        '''A histogram of marker usage across the whole project.'''
+        return sum((b.markers for b in self), Counter())
+
+    @property
+    def warnings(self) -> int:
+        '''The total number of parser warnings across the project.'''
+        return sum(len(b.warnings) for b in self)
+
+    @property
+    def errors(self) -> List[Book]:
+        '''The books that could not be parsed.'''
+        return [b for b in self if b.error is not None]
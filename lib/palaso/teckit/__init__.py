@@ -1,5 +1,5 @@
 import codecs
-from typing import Dict, Optional, Union, cast
+from typing import Dict, Optional, Union
 from os import PathLike
 from pathlib import Path
 from palaso.teckit import engine, compiler
@@ -15,6 +15,7 @@ class _mapping(object):
 
 
 _tec_mapping_cache_: Dict[str, _mapping] = {}
+_converter_pool_ = engine.ConverterPool()
 
 
 def register(mapping: Union[PathLike, engine.Mapping]):
@@ -66,76 +67,82 @@ def _teckit_search(mapping: str) -> Optional[codecs.CodecInfo]:
 
 class Codec(codecs.Codec):
     def __init__(self, mapping: _mapping):
-        self.__enc = engine.Converter(mapping.map, forward=False)
-        self.__dec = engine.Converter(mapping.map, forward=True)
-        mapping.replacement = self.__dec.convert(
-                                self.__enc.convert('\ufffd', finished=True),
-                                finished=True)
-        self.__enc.reset()
+        # Converters are checked out of the shared pool for each call, so
+        # a codec can be used from several threads at once.
+        self.__map = mapping.map
+        with _converter_pool_.converter(self.__map, forward=False) as enc, \
+                _converter_pool_.converter(self.__map, forward=True) as dec:
+            mapping.replacement = dec.convert(
+                                    enc.convert('\ufffd', finished=True),
+                                    finished=True)
 
     @staticmethod
     def convert(conv, data, final, errors='strict'):
-        try:
-            res = conv.convert(data, finished=final,
-                               options=Option.DontUseReplacementChar)
-            return (res, len(res))
-        except UnicodeEncodeError as uerr:
-            rep, rp = codecs.lookup_error(errors)(uerr)
-            try:
-                prefix = conv.convert(
-                            uerr.object[:uerr.start] + cast(str, rep),
-                            finished=final,
-                            options=Option.DontUseReplacementChar)
-            except UnicodeEncodeError:
-                raise UnicodeEncodeError(uerr.args[0], uerr.args[1],
-                                         uerr.args[2], uerr.args[3],
-                                         f'cannot convert replacement {rep}'
-                                         ' to target encoding') \
-                    from None
-            suffix = Codec.convert(conv, data[rp:], final, errors)
-            return (prefix+suffix[0], rp+suffix[1])
-        except UnicodeDecodeError as uerr:
-            rep, rp = codecs.lookup_error(errors)(uerr)
-            prefix = conv.convert(uerr.object[:uerr.start], finished=final,
-                                  options=Option.DontUseReplacementChar)
-            suffix = Codec.convert(conv, data[rp:], final, errors)
-            return (prefix+rep+suffix[0], rp+suffix[1])
+        handler = None if errors == 'strict' else codecs.lookup_error(errors)
+        res = conv.convert(data, finished=final,
+                           options=Option.DontUseReplacementChar,
+                           errors=handler)
+        return (res, len(data))
 
     def encode(self, input, errors='strict'):
-        return Codec.convert(self.__enc, input, True, errors)
+        with _converter_pool_.converter(self.__map, forward=False) as enc:
+            return Codec.convert(enc, input, True, errors)
 
     def decode(self, input, errors='strict'):
-        return Codec.convert(self.__dec, input, True, errors)
+        with _converter_pool_.converter(self.__map, forward=True) as dec:
+            return Codec.convert(dec, input, True, errors)
+
+
+def _check_snapshot(conv: engine.Converter):
+    if conv._pending:
+        raise ValueError('TECkit codec state cannot be saved part way'
+                         ' through a stream')
+
+
+def _check_restore(state, initial):
+    if state != initial:
+        raise ValueError(f'TECkit codec state {state!r} cannot be restored;'
+                         f' only the initial state {initial!r} can')
 
 
 class IncrementalEncoder(codecs.IncrementalEncoder):
     def __init__(self, mapping, errors='strict'):
-        super(IncrementalEncoder).__init__(errors)
+        super().__init__(errors)
         self._conv = engine.Converter(mapping.map, False)
 
     def encode(self, object, final=False):
         return Codec.convert(self._conv, object, final, self.errors)[0]
 
-    def reset(self): return self._conv.reset()
+    def reset(self): self._conv.reset()
 
-    def getstate(self): return self._conv
+    # Any context TECkit is holding is opaque, so the only state that can
+    # be saved and restored is the initial one, between streams.
+    def getstate(self):
+        _check_snapshot(self._conv)
+        return 0
 
-    def setstate(self, state): return self._conv
+    def setstate(self, state):
+        _check_restore(state, 0)
+        self._conv.reset()
 
 
 class IncrementalDecoder(codecs.IncrementalDecoder):
     def __init__(self, mapping, errors='strict'):
-        super(IncrementalEncoder).__init__(errors)
+        super().__init__(errors)
         self._conv = engine.Converter(mapping.map, True)
 
     def decode(self, object, final=False):
         return Codec.convert(self._conv, object, final, self.errors)[0]
 
-    def reset(self): return self._conv.reset()
+    def reset(self): self._conv.reset()
 
-    def getstate(self): return self._conv
+    def getstate(self):
+        _check_snapshot(self._conv)
+        return (b'', 0)
 
-    def setstate(self, state): return self._conv
+    def setstate(self, state):
+        _check_restore(state, (b'', 0))
+        self._conv.reset()
 
 
 class StreamWriter(Codec, codecs.StreamWriter):
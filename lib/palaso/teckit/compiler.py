@@ -14,8 +14,9 @@ __email__ = "tim_eves@sil.org"
 # 10-Jun-2009 tse   Initial version using the ctypes FFI
 
 from itertools import starmap
-from typing import AnyStr, List, cast
+from typing import AnyStr, List, Optional, cast
 
+from palaso.cache import DiskCache
 from palaso.teckit import _compiler
 from palaso.teckit import _common
 from palaso.teckit._common import Form
@@ -26,7 +27,7 @@ from palaso.teckit._compiler import (
 from palaso.teckit.engine import Mapping
 
 __all__ = ['Form', 'Mapping',
-           'CompilationError',
+           'CompilationError', 'MappingCache',
            'translate', 'compile',
            'getTECkitName', 'getVersion',
            'getUnicodeName', 'getUnicodeValue']
@@ -74,15 +75,52 @@ def __compile_opts(txt_: AnyStr, opts: Form):
     return res
 
 
+class MappingCache(DiskCache):
+    '''
+    A content addressed store of compiled mappings on disk. Entries are
+    keyed by a hash of the mapping source, the compile options and the
+    TECkit compiler version, so a changed source or compiler never returns
+    a stale mapping. By default the mappings are kept in the user's cache
+    directory, see palaso.cache.DiskCache.
+    '''
+    kind = 'teckit'
+    suffix = '.tec'
+
+    def key(self, txt: AnyStr, opts: int) -> str:
+        if isinstance(txt, str):
+            txt = cast(AnyStr, txt.encode('utf_8_sig'))
+        return self.digest(f'{getVersion()}:{opts}', cast(bytes, txt))
+
+    def get(self, key: str) -> Optional[Mapping]:
+        data = self.read(key)
+        if data is None:
+            return None
+        try:
+            return Mapping(data)
+        except (TypeError, _common.MappingVersionError):
+            # Corrupt, or from an incompatible engine, so recompile it.
+            return None
+
+    def put(self, key: str, mapping: bytes) -> None:
+        self.write(key, mapping)
+
+
 def compile(txt: AnyStr,
             compress: bool = True,
-            form: Form = Form.Unspecified) -> Mapping:
+            form: Form = Form.Unspecified,
+            cache: Optional[MappingCache] = None) -> Mapping:
     form &= Form.EncodingMask
-    tbl = __compile_opts(
-        txt,
-        (form | _compiler.Opt.Compress) if compress else form)
+    opts = (form | _compiler.Opt.Compress) if compress else form
+    if cache is not None:
+        key = cache.key(txt, opts)
+        buf = cache.get(key)
+        if buf is not None:
+            return buf
+    tbl = __compile_opts(txt, opts)
 
     buf = Mapping(tbl)
+    if cache is not None:
+        cache.put(key, buf)
     return buf
 
 
@@ -15,10 +15,19 @@ __email__ = "tim_eves@sil.org"
 # 10-Jun-2009 tse   Initial version using the ctypes FFI
 
 import codecs
+import contextlib
 import ctypes
+import hashlib
+import mmap as _mmap
+import os
+import struct
 import sys
-from typing import Any, AnyStr, Tuple, Union, cast
-from functools import lru_cache
+import threading
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, AnyStr, Callable, Deque, Dict, Iterator, List, \
+                   NamedTuple, Optional, Tuple, Union, cast
 from os import PathLike
 from palaso.teckit import _engine
 from palaso.teckit._common import (
@@ -30,10 +39,69 @@ from palaso.teckit._engine import (
 
 __all__ = ['ConverterBusy', 'MappingVersionError',
            'FullBuffer', 'EmptyBuffer', 'UnmappedChar',
-           'Converter', 'Flags', 'Form', 'Mapping', 'Option',
+           'Converter', 'ConverterPool', 'Flags', 'Form', 'Mapping',
+           'Option', 'Tables',
            'getVersion']
 
 
+class Tables(NamedTuple):
+    '''
+    Translation tables for a context free mapping between single bytes and
+    single characters (or bytes). forward is True when the byte side is the
+    mapping's left hand side. decode converts from the byte side and encode
+    converts back, it is None when the mapping does not round trip.
+    '''
+    forward: bool
+    decode: Callable
+    encode: Optional[Callable]
+
+
+class _Pass(NamedTuple):
+    # The kind of a pass, such as b'B->U' or b'NFC ', and the longest match,
+    # precontext and postcontext of any of its rules.
+    kind: bytes
+    match: int
+    pre: int
+    post: int
+
+
+def _read_passes(data: bytes) -> Optional[Tuple[Tuple[_Pass, ...],
+                                                Tuple[_Pass, ...]]]:
+    # The forward and reverse passes of a compiled mapping, from its file
+    # and table headers, or None if they cannot be read.
+    try:
+        if data[:4] == b'zQmp':
+            data = zlib.decompress(data[8:])
+        magic, _, _, _, _, names, fwd, rev = struct.unpack_from('>4s7I', data)
+        if magic != b'qMap':
+            return None
+        passes = []
+        for offset in struct.unpack_from(f'>{fwd + rev}I', data,
+                                         32 + 4*names):
+            kind = data[offset:offset + 4]
+            if kind in (b'NFC ', b'NFD '):
+                passes.append(_Pass(kind, 0, 0, 0))
+            else:
+                passes.append(_Pass(kind, *struct.unpack_from(
+                                              '>3B', data, offset + 40)))
+    except (struct.error, zlib.error):
+        return None
+    return tuple(passes[:fwd]), tuple(passes[fwd:])
+
+
+def _name_attr(obj, name: str) -> str:
+    # Look up a name record, raising IndexError for a valid name ID that is
+    # absent, as TECkit does.
+    if not name.startswith('_'):
+        names = obj._names
+        if name in names:
+            return names[name]
+        if name in _engine.NameID.__members__:
+            raise IndexError('TECkit: nameID index out of range')
+    raise AttributeError(
+        f'{type(obj).__name__!r} object has no attribute {name!r}')
+
+
 class Mapping(bytes):
     def __new__(cls, data: Union[PathLike, bytes]):
         if isinstance(data, bytes):
@@ -51,19 +119,24 @@ class Mapping(bytes):
             res.append(
                 f'{k}={v[:20]+ b"..." if isinstance(v, bytes) else v!r}')
         self._repr_args = ','.join(res)
+        self._tables = _UNPROBED
+        # Everything a Mapping is asked about is read once, up front.
+        self._names = {}
+        for nid in _engine.NameID:
+            try:
+                nlen = _engine.getMappingName(self, len(self), nid)
+            except IndexError:
+                continue
+            buf = ctypes.create_string_buffer(nlen)
+            nlen = _engine.getMappingName(self, len(self), nid, buf, nlen)
+            self._names[nid.name] = bytes(buf[:nlen]).decode('utf8')
+        lf, rf = _engine.getMappingFlags(self, len(self))
+        self._flags = (Flags(lf), Flags(rf))
+        self._digest = hashlib.sha1(self).hexdigest()
+        self._passes = _read_passes(self)
 
-    @lru_cache(maxsize=16)
     def __getattr__(self, name: str) -> str:
-        try:
-            nid = getattr(_engine.NameID, name)
-            nlen = _engine.getMappingName(self, len(self), nid)
-        except AttributeError:
-            raise AttributeError(f'{self!r} object has no attribute {name!r}')
-        except IndexError:
-            raise
-        buf = ctypes.create_string_buffer(nlen)
-        nlen = _engine.getMappingName(self, len(self), nid, buf, nlen)
-        return bytes(buf[:nlen]).decode('utf8')
+        return _name_attr(self, name)
 
     def __str__(self) -> str:
         return self.lhsName + ' <-> ' + self.rhsName
@@ -73,10 +146,12 @@ class Mapping(bytes):
                 else self.__str__())
 
     @property
-    @lru_cache(maxsize=8)
     def flags(self) -> Tuple[Flags, Flags]:
-        lf, rf = _engine.getMappingFlags(self, len(self))
-        return Flags(lf), Flags(rf)
+        return self._flags
+
+    @property
+    def digest(self) -> str:
+        return self._digest
 
     @property
     def lhsFlags(self) -> Flags:
@@ -86,6 +161,69 @@ class Mapping(bytes):
     def rhsFlags(self) -> Flags:
         return self.flags[1]
 
+    def contextFree(self, forward: bool = True) -> bool:
+        '''
+        Whether every pass of the mapping in the given direction converts
+        each character on its own: no rule matches more than one character
+        or has any context, and there is no normalisation pass. This is read
+        from the rule lengths recorded in the compiled mapping's headers.
+        '''
+        if self._passes is None:
+            return False
+        return all(p.kind not in (b'NFC ', b'NFD ')
+                   and p.match <= 1 and not (p.pre or p.post)
+                   for p in self._passes[0 if forward else 1])
+
+    @property
+    def tables(self) -> Optional[Tables]:
+        '''
+        Translation tables equivalent to this mapping, if it is a context
+        free one to one table between bytes and single characters, or None.
+        The tables are read off by converting every byte value, so they are
+        only worked out once per mapping. encode is only provided when the
+        reverse direction is context free too and round trips every byte.
+        '''
+        if self._tables is _UNPROBED:
+            self._tables = self._probe_tables()
+        return self._tables
+
+    def _probe_tables(self) -> Optional[Tables]:
+        forward = Flags.unicode not in self.lhsFlags
+        if not forward and Flags.unicode in self.rhsFlags:
+            return None
+        if not self.contextFree(forward):
+            return None
+        dec = Converter(self, forward=forward, fast=False)
+        enc = Converter(self, forward=not forward, fast=False)
+        singles = []
+        for b in range(256):
+            out = dec.convert(bytes((b,)), finished=True)
+            if len(out) != 1:
+                return None
+            singles.append(out)
+            dec.reset()
+        table = type(singles[0])().join(singles)
+        if isinstance(table, str):
+            encoding = codecs.charmap_build(table)
+            tables = Tables(
+                forward,
+                lambda data: codecs.charmap_decode(data, 'strict', table)[0],
+                lambda text: codecs.charmap_encode(text, 'strict',
+                                                   encoding)[0])
+        else:
+            inverse = bytearray(256)
+            for b, c in enumerate(table):
+                inverse[c] = b
+            inverse = bytes(inverse)
+            tables = Tables(forward,
+                            lambda data: data.translate(table),
+                            lambda data: data.translate(inverse))
+        if self.contextFree(not forward) \
+                and all(enc.convert(c, finished=True) == bytes((b,))
+                        for b, c in enumerate(singles)):
+            return tables
+        return tables._replace(encode=None)
+
 
 if sys.byteorder == 'little':
     _Form_UNICODE = Form.UTF32LE
@@ -97,6 +235,11 @@ else:
 _unicode_encoder = codecs.getencoder(_unicode_encoder_name)
 _unicode_decoder = codecs.getdecoder(_unicode_encoder_name)
 
+_UNPROBED = object()
+_BUFFER_SIZE = 80*4
+_MAX_RETAINED_BUFFER = 1 << 20
+_DELIMITERS = ('\n', '\x00', '\r', '\u2029')
+
 
 def _form_from_flags(form: Form, flags: Flags) -> Form:
     if form is Form.Unspecified or form is None:
@@ -110,9 +253,33 @@ def _form_from_flags(form: Form, flags: Flags) -> Form:
 
 
 class Converter(object):
+    '''
+    A TECkit converter for a mapping in one direction. Unless fast is False,
+    or non default normalisation forms are requested, a simple one to one
+    mapping is converted with the translation tables from Mapping.tables
+    instead of calling into TECkit.
+
+    The native converter is released when the object is garbage collected,
+    or deterministically by close() or using the Converter as a context
+    manager.
+    '''
+    __slots__ = ('_converter', '_buffer', '_translate', '_pending',
+                 '_held', '_batch', '_forms', '_names',
+                 '_flags', '_pool_key', '__weakref__')
+
     def __init__(self, mapping: Mapping, forward: bool = True,
                  source: Form = Form.Unspecified,
-                 target: Form = Form.Unspecified) -> None:
+                 target: Form = Form.Unspecified,
+                 fast: bool = True) -> None:
+        self._translate = None
+        self._pending = False
+        self._held: Optional[AnyStr] = None
+        self._pool_key: Optional[Tuple] = None
+        self._batch = mapping.contextFree(forward)
+        if fast and not (source or target) and mapping.tables:
+            tables = mapping.tables
+            self._translate = (tables.decode if forward == tables.forward
+                               else tables.encode)
         source = _form_from_flags(
             source,
             mapping.lhsFlags if forward else mapping.rhsFlags)
@@ -122,30 +289,49 @@ class Converter(object):
         self._converter = _engine.createConverter(
                             mapping, len(mapping), forward,
                             source, target)
-        self._buffer = ctypes.create_string_buffer(80*4)
+        self._forms = (source, target)
+        self._buffer = ctypes.create_string_buffer(_BUFFER_SIZE)
+        self._names = {}
+        for nid in _engine.NameID:
+            try:
+                nlen = getConverterName(self._converter, nid)
+            except IndexError:
+                continue
+            buf = ctypes.create_string_buffer(nlen)
+            nlen = getConverterName(self._converter, nid, buf, nlen)
+            self._names[nid.name] = str(cast(bytes, buf[:nlen]), 'ascii')
+        lf, rf = _engine.getConverterFlags(self._converter)
+        self._flags = (Flags(lf), Flags(rf))
+
+    def close(self) -> None:
+        '''Dispose of the TECkit converter. It cannot be used after this.'''
+        conv, self._converter = getattr(self, '_converter', None), None
+        if conv is not None:
+            _engine.disposeConverter(conv)
+
+    def __enter__(self) -> 'Converter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
 
     def __del__(self):
-        _engine.disposeConverter(self._converter)
+        self.close()
 
-    @lru_cache(maxsize=32)
     def __getattr__(self, name: str) -> str:
-        try:
-            nid = getattr(_engine.NameID, name)
-            nlen = getConverterName(self._converter, nid)
-        except (AttributeError):
-            raise AttributeError(f'{self!r} object has no attribute {name!r}')
-        except IndexError:
-            raise
-
-        buf = ctypes.create_string_buffer(nlen)
-        nlen = getConverterName(self._converter, nid, buf, nlen)
-        return str(cast(bytes, buf[:nlen]), 'ascii')
+        return _name_attr(self, name)
 
     @property
-    @lru_cache(maxsize=8)
     def flags(self) -> Tuple[Flags, Flags]:
-        lf, rf = _engine.getConverterFlags(self._converter)
-        return Flags(lf), Flags(rf)
+        return self._flags
+
+    @property
+    def sourceForm(self) -> Form:
+        return self._forms[0]
+
+    @property
+    def targetForm(self) -> Form:
+        return self._forms[1]
 
     @property
     def sourceFlags(self) -> Flags:
@@ -157,6 +343,8 @@ class Converter(object):
 
     def reset(self):
         _engine.resetConverter(self._converter)
+        self._pending = False
+        self._held = None
 
     def _unmapped_char(self, input: AnyStr, context: str,
                               uc: UnmappedChar):
@@ -182,8 +370,47 @@ class Converter(object):
                 if Flags.unicode in self.targetFlags
                 else data)
 
+    def _reserve(self, used: int, needed: int) -> ctypes.Array:
+        # Grow the output buffer geometrically, keeping what has been
+        # written so far, so large conversions stay linear time.
+        buf = self._buffer
+        if len(buf) - used < needed:
+            grown = ctypes.create_string_buffer(
+                        max(2*len(buf), used + needed))
+            ctypes.memmove(grown, buf, used)
+            self._buffer = buf = grown
+        return buf
+
+    def _estimate(self, size: int) -> int:
+        units = size//4 if Flags.unicode in self.sourceFlags else size
+        units += units//8 + 16
+        return units*4 if Flags.unicode in self.targetFlags else units
+
+    def _result(self, used: int) -> AnyStr:
+        res = self._coerce_to_target(ctypes.string_at(self._buffer, used))
+        if len(self._buffer) > _MAX_RETAINED_BUFFER:
+            self._buffer = ctypes.create_string_buffer(_BUFFER_SIZE)
+        return res
+
     def convert(self, input: AnyStr, finished: bool = False,
-                options: Option = Option.UseReplacementCharSilently) -> AnyStr:
+                options: Option = Option.UseReplacementCharSilently,
+                errors: Optional[Callable] = None) -> AnyStr:
+        '''
+        Convert input, which must be str or bytes to suit the mapping. When
+        the DontUseReplacementChar option is given, an unmapped character
+        raises a UnicodeError unless an errors handler is supplied. It is
+        called, like a codecs error handler, with the exception and returns
+        a replacement and the position to resume from. The replacement is
+        converted along with the text since the previous error, and
+        conversion then resumes on a reset converter.
+
+        Resetting discards any input TECkit is holding back for context
+        from earlier unfinished calls. So while an errors handler is used
+        on unfinished input, the converter keeps a copy of the input TECkit
+        reports holding back, which is never more than the mapping's
+        longest match. After an error that input is converted again ahead
+        of the new input.
+        '''
         # Validate input parameters and do an necessary conversions
         if Flags.unicode in self.sourceFlags:
             if isinstance(input, bytes):
@@ -195,48 +422,346 @@ class Converter(object):
                 raise TypeError(
                     "source is type 'str' but type 'bytes' is expected")
             data: bytes = input
+        # TECkit may be holding back input from an earlier unfinished call,
+        # so only take the fast path when it has nothing buffered.
+        if self._translate and not (options or self._pending):
+            try:
+                return self._translate(input)
+            except UnicodeError:
+                pass
+        was_pending = self._pending
+        opts = options
         options |= finished and Option.InputIsComplete
-
-        buf = self._buffer
-        cons = outs = 0
-        res: Any = '' if Flags.unicode in self.targetFlags else b''
-        while data:
+        unit = 4 if Flags.unicode in self.sourceFlags else 1
+        parts = []
+        seg = 0
+
+        # Walk a pointer through the input rather than slicing it, and
+        # convert straight into the unused tail of the output buffer.
+        size = len(data)
+        base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+        buf = self._reserve(0, self._estimate(size))
+        pos = used = 0
+        held = None
+        while pos < size:
             try:
                 cons, outs, lhc = _engine.convertBufferOpt(
                                     self._converter,
-                                    data, len(data),
-                                    buf, len(buf),
+                                    ctypes.c_char_p(base + pos), size - pos,
+                                    ctypes.c_char_p(
+                                        ctypes.addressof(buf) + used),
+                                    len(buf) - used,
                                     options)
             except FullBuffer as err:
                 cons, outs, lhc = err.args
+                buf = self._reserve(used + outs,
+                                    self._estimate(size - pos - cons))
             except EmptyBuffer as err:
                 if finished:
                     raise
                 cons, outs, lhc = err.args
             except UnmappedChar as err:
-                raise self._unmapped_char(input, 'convert', err) from None
-
-            res += self._coerce_to_target(cast(bytes, buf[:outs]))
-            data = data[cons:]
-
+                if errors is not None and seg == 0 and self._held:
+                    return self._resume(input, finished, opts, errors)
+                cons, outs, lhc = err.args
+                err = UnmappedChar(pos + cons, used + outs, lhc)
+                uerr = self._unmapped_char(input, 'convert', err)
+                if errors is None:
+                    raise uerr from None
+                # Discard the output since the last error and convert that
+                # text again with the replacement. Only that text is ever
+                # converted twice, so dense errors cost linear time.
+                rep, rp = errors(uerr)
+                parts.append(self._replace(uerr, input[seg:uerr.start], rep,
+                                           opts))
+                self.reset()
+                buf = self._buffer
+                seg, pos, used = rp, rp*unit, 0
+                continue
+            pos += cons
+            used += outs
+            held = lhc
+
+        self._pending = not finished
         if finished:
-            res += self.flush()
+            used, _ = self._flush(used, options)
+        res = self._result(used)
+        if finished or errors is None:
+            self._held = None
+        elif held is not None:
+            # Input from before this call is only known if the converter
+            # held nothing, or what it held was kept.
+            if parts or not was_pending:
+                self._hold(input[seg:], held)
+            elif self._held is not None:
+                self._hold(self._held + input, held)
+        if parts:
+            parts.append(res)
+            return type(parts[0])().join(parts)
         return res
 
-    def flush(self, finished: bool = True,
-              options: Option = Option.UseReplacementCharSilently) -> AnyStr:
-        options = cast(Option, options | (finished and Option.InputIsComplete))
+    def _hold(self, input: AnyStr, held: int) -> None:
+        # Keep the last held units of input, those TECkit has consumed but
+        # not yet produced output for.
+        self._held = input[len(input) - held:] if held <= len(input) \
+            else None
+
+    def _resume(self, input: AnyStr, finished: bool, options: Option,
+                errors: Callable) -> AnyStr:
+        # The input TECkit was holding back has produced no output yet, so
+        # convert it again ahead of this input on a reset converter, rather
+        # than lose it when the converter is reset for the error.
+        held = self._held
+        self.reset()
+        return self.convert(held + input, finished, options, errors)
+
+    def _replace(self, uerr: UnicodeError, prefix: AnyStr, rep: str,
+                 options: Option) -> AnyStr:
+        # The converter is reset after this, so the text before the error
+        # is converted as complete input, or any of it TECkit is holding
+        # back for lookahead would be lost.
+        if isinstance(uerr, UnicodeDecodeError):
+            return self.convert(prefix, True, options) + rep
+        try:
+            return self.convert(prefix + rep, True, options)
+        except UnicodeEncodeError:
+            raise UnicodeEncodeError(*uerr.args[:4],
+                                     f'cannot convert replacement {rep}'
+                                     ' to target encoding') from None
 
+    def _flush(self, used: int, options: Option) -> Tuple[int, int]:
         buf = self._buffer
-        outs = 0
-        res: Any = '' if Flags.unicode in self.targetFlags else b''
         while True:
             try:
                 outs, lhc = _engine.flushOpt(
-                                self._converter, buf, len(buf), options)
-                return res + self._coerce_to_target(cast(bytes, buf[:outs]))
+                                self._converter,
+                                ctypes.c_char_p(ctypes.addressof(buf) + used),
+                                len(buf) - used,
+                                options)
+                return used + outs, lhc
             except FullBuffer as err:
                 outs, lhc = err.args
-                res += self._coerce_to_target(cast(bytes, buf[:outs]))
+                used += outs
+                buf = self._reserve(used, len(buf))
             except UnmappedChar as err:
                 raise self._unmapped_char('', 'flush', err) from None
+
+    def flush(self, finished: bool = True,
+              options: Option = Option.UseReplacementCharSilently) -> AnyStr:
+        options = cast(Option, options | (finished and Option.InputIsComplete))
+        self._pending = not finished
+        used, held = self._flush(0, options)
+        res = self._result(used)
+        if finished:
+            self._held = None
+        elif self._held is not None:
+            self._hold(self._held, held)
+        return res
+
+    def _convert_each(self, items: List[AnyStr], options: Option) -> List:
+        res = []
+        for item in items:
+            self.reset()
+            res.append(self.convert(item, finished=True, options=options))
+        return res
+
+    def _delimiter(self, items: List[AnyStr],
+                   options: Option) -> Optional[Tuple[AnyStr, AnyStr]]:
+        # Find a delimiter that appears in none of the items and converts
+        # on its own to a single character or byte to split on. Being a
+        # single unit, it cannot combine with the ends of its neighbours'
+        # output to match anywhere but where it was put.
+        unicode = Flags.unicode in self.sourceFlags
+        for d in _DELIMITERS:
+            delim = d if unicode else d.encode('latin_1')
+            if any(delim in i for i in items):
+                continue
+            try:
+                self.reset()
+                out = self.convert(delim, finished=True, options=options)
+            except UnicodeError:
+                continue
+            if len(out) == 1:
+                return delim, out
+        return None
+
+    def convert_many(self, items, options: Option =
+                     Option.UseReplacementCharSilently,
+                     blocksize: int = 1 << 16) -> List:
+        '''
+        Convert each of a sequence of strings independently, as if the
+        converter were reset and each converted with finished=True. When
+        the mapping is context free in this direction, so no rule can see
+        past the end of an item, items are joined into blocks of about
+        blocksize characters with a delimiter none of them contain, and
+        only a few calls into TECkit are needed for all of them. A block is
+        converted item by item instead if its output does not split back
+        into as many items. Other mappings are converted item by item.
+        '''
+        items = list(items)
+        if not items:
+            return []
+        if self._translate and not options:
+            return [self.convert(i, finished=True) for i in items]
+        delim = self._batch and self._delimiter(items, options)
+        if not delim:
+            res = self._convert_each(items, options)
+            self.reset()
+            return res
+        res = []
+        start = 0
+        while start < len(items):
+            end, size = start, 0
+            while end < len(items) and (end == start or size < blocksize):
+                size += len(items[end]) + 1
+                end += 1
+            block = items[start:end]
+            start = end
+            out = None
+            try:
+                self.reset()
+                out = self.convert(delim[0].join(block), finished=True,
+                                   options=options).split(delim[1])
+            except UnicodeError:
+                pass
+            if out is None or len(out) != len(block):
+                out = self._convert_each(block, options)
+            res.extend(out)
+        self.reset()
+        return res
+
+    def convert_stream(self, src, dst, chunk_size: int = 1 << 16,
+                       progress: Optional[Callable] = None,
+                       total: Optional[int] = None,
+                       options: Option =
+                       Option.UseReplacementCharSilently) -> int:
+        '''
+        Convert everything read from src, chunk_size at a time, writing the
+        results to dst. src must read bytes or str, and dst accept them, to
+        suit the mapping. TECkit keeps the context across chunk boundaries,
+        so the output is the same as converting the whole input at once.
+        After each chunk progress, if given, is called with the amount
+        read so far and total. Returns the amount read.
+        '''
+        self.reset()
+        done = 0
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            dst.write(self.convert(chunk, options=options))
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+        dst.write(self.flush(options=options))
+        return done
+
+    def convert_file(self, path_in: PathLike, path_out: PathLike,
+                     encoding: str = 'utf-8', chunk_size: int = 1 << 16,
+                     mmap: bool = False,
+                     progress: Optional[Callable] = None,
+                     options: Option =
+                     Option.UseReplacementCharSilently) -> int:
+        '''
+        Convert the file at path_in to path_out with convert_stream().
+        Unicode sides of the mapping are read or written in encoding. If
+        mmap is True the input is memory mapped rather than read. progress
+        is called with the number of bytes read so far and the size of the
+        input file.
+        '''
+        unicode_in = Flags.unicode in self.sourceFlags
+        unicode_out = Flags.unicode in self.targetFlags
+        with open(path_in, 'rb') as fin, \
+                open(path_out, 'w' if unicode_out else 'wb',
+                     encoding=encoding if unicode_out else None) as fout:
+            total = os.fstat(fin.fileno()).st_size
+            with contextlib.ExitStack() as stack:
+                src = fin
+                if mmap and total:
+                    src = stack.enter_context(
+                            _mmap.mmap(fin.fileno(), 0,
+                                       access=_mmap.ACCESS_READ))
+                if progress:
+                    raw, report = src, progress
+
+                    def progress(_, total):
+                        report(raw.tell(), total)
+                if unicode_in:
+                    src = codecs.getreader(encoding)(src)
+                self.convert_stream(src, fout, chunk_size, progress, total,
+                                    options)
+        return total
+
+
+class ConverterPool(object):
+    '''
+    A thread safe pool of idle converters, keyed by the mapping's digest,
+    direction and normalisation forms. Converters are checked out for the
+    exclusive use of one thread or task and returned afterwards, reset,
+    ready for reuse. At most maxsize idle converters are kept, the least
+    recently returned are disposed of first.
+    '''
+    def __init__(self, maxsize: int = 16) -> None:
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple, Deque[Converter]] = {}
+        self._lru: 'OrderedDict[Converter, Tuple]' = OrderedDict()
+
+    @staticmethod
+    def _key(mapping: Mapping, forward: bool,
+             source: Form, target: Form) -> Tuple:
+        return (mapping.digest, bool(forward), int(source), int(target))
+
+    def acquire(self, mapping: Mapping, forward: bool = True,
+                source: Form = Form.Unspecified,
+                target: Form = Form.Unspecified) -> Converter:
+        key = self._key(mapping, forward, source, target)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conv = idle.pop()
+                del self._lru[conv]
+                return conv
+        conv = Converter(mapping, forward, source, target)
+        conv._pool_key = key
+        return conv
+
+    def release(self, conv: Converter) -> None:
+        key = conv._pool_key
+        if key is None:
+            raise ValueError('converter was not acquired from a pool')
+        conv.reset()
+        with self._lock:
+            if conv in self._lru:
+                raise ValueError('converter has already been released')
+            self._idle.setdefault(key, deque()).append(conv)
+            self._lru[conv] = key
+            while len(self._lru) > self.maxsize:
+                old, old_key = self._lru.popitem(last=False)
+                idle = self._idle[old_key]
+                idle.remove(old)
+                if not idle:
+                    del self._idle[old_key]
+                old.close()
+
+    @contextmanager
+    def converter(self, mapping: Mapping, forward: bool = True,
+                  source: Form = Form.Unspecified,
+                  target: Form = Form.Unspecified) -> Iterator[Converter]:
+        '''Check out a converter for the duration of a with block.'''
+        conv = self.acquire(mapping, forward, source, target)
+        try:
+            yield conv
+        finally:
+            self.release(conv)
+
+    def clear(self) -> None:
+        '''Dispose of all the idle converters.'''
+        with self._lock:
+            idle, self._lru = self._lru, OrderedDict()
+            self._idle.clear()
+        for conv in idle:
+            conv.close()
+
+    def __len__(self) -> int:
+        return len(self._lru)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse, codecs, unicodedata, re, os, itertools
-from palaso.kmn.parser import Parser, mapkey, Token, DeadKey, VKey, keyrowmap
+from palaso.kmn.parser import Parser, ParseCache, mapkey, Token, DeadKey, Store, VKey, keyrowmap
 from xml.etree import ElementTree as et
 from xml.etree import ElementPath as ep
 from pprint import pformat
@@ -57,13 +57,11 @@ class ETWriter(object):
         
     def _sortedattrs(self, n, attribs=None):
         def getorder(x):
-            return self.attributeOrder.get(x, self.maxAts)
-        def cmpat(x, y):
-            return cmp(getorder(x), getorder(y)) or cmp(x, y)
+            return (self.attributeOrder.get(x, self.maxAts), x)
         if attribs != None :
-            return sorted(attribs, cmp=cmpat)
+            return sorted(attribs, key=getorder)
         else:
-            return sorted(n.keys(), cmp=cmpat)
+            return sorted(n.keys(), key=getorder)
 
     def serialize_xml(self, write, base = None, indent = '', topns = True, namespaces = {}, doctype=""):
         """Output the object using write() in a normalised way:
@@ -220,8 +218,8 @@ class LDMLKeyboard(ETWriter):
     def addLayer(self, rows, modifiers, switches, extras):
         ls = et.SubElement(self.root, "layer", attrib={'modifier': modifiers})
         for r in rows:
-            a = {'keys': " ".join(zip(*r)[0])}
-            w = zip(*r)[1]
+            a = {'keys': " ".join(list(zip(*r))[0])}
+            w = list(zip(*r))[1]
             if extras and any(x for x in w if int(x) != 100):
                 a['widths'] = " ".join(w)
             et.SubElement(ls, "row", attrib=a)
@@ -274,20 +272,134 @@ def setlistmatch(this, other, rev=False):
             return False
     return True
 
+class ContextIndex:
+    """ Indexes a list of transform elements by their before and after
+        contexts, to find those within a given number of differences of a
+        new element without comparing against every one. Contexts that are
+        plain strings go in a trie per context shape (the lengths of before
+        and after), searched with a budget of mismatches. Contexts holding
+        sets, from merging, are kept aside and always returned. So are
+        elements of other shapes when mismatches are allowed, since one
+        lacking a context the other has still covers it. """
+    def __init__(self):
+        self.shapes = {}
+        self.loose = set()
+        self.count = 0
+
+    @staticmethod
+    def shape(e):
+        return tuple(len(e[k]) if k in e else None for k in ('before', 'after'))
+
+    @staticmethod
+    def key(e):
+        vals = [e[k] for k in ('before', 'after') if k in e]
+        if all(isinstance(v, str) for v in vals):
+            return "".join(vals)
+        return None
+
+    def add(self, e):
+        i = self.count
+        self.count += 1
+        k = self.key(e)
+        if k is None:
+            self.loose.add(i)
+            return
+        node = self.shapes.setdefault(self.shape(e), {})
+        for c in k:
+            node = node.setdefault(c, {})
+        node.setdefault(None, []).append(i)
+
+    def merged(self, i):
+        """ Element i's contexts have been merged into sets """
+        self.loose.add(i)
+
+    def find(self, e, budget):
+        """ Returns the sorted indices of elements that may be within budget
+            differences of e's contexts """
+        k = self.key(e)
+        if k is None:
+            return range(self.count)
+        shape = self.shape(e)
+        res = set(self.loose)
+        if budget:
+            for s, n in self.shapes.items():
+                if s != shape:
+                    res.update(self._all(n))
+        stack = [(self.shapes.get(shape, {}), 0, budget)]
+        while stack:
+            node, d, b = stack.pop()
+            if d == len(k):
+                res.update(node.get(None, ()))
+                continue
+            for c, child in node.items():
+                if c == k[d]:
+                    stack.append((child, d + 1, b))
+                elif b and c is not None:
+                    stack.append((child, d + 1, b - 1))
+        return sorted(res)
+
+    def _all(self, node):
+        for c, child in node.items():
+            if c is None:
+                yield from child
+            else:
+                yield from self._all(child)
+
 class TransformElements:
+    """ Collects transforms, merging those that differ in a single character
+        of their from or context into sets. The elements with each from and
+        to are indexed by context, and those with each to by their from
+        with one character left out, so that finding a transform to merge
+        with does not mean comparing against every transform so far. """
     def __init__(self):
         self.froms = {}
         self.tos = {}
         self.elements = {}
+        self.pairs = {}
+        self.contexts = {}
+        self.nears = {}
+        self.loosefroms = {}
+
+    def _append(self, l, e):
+        self.elements.setdefault(l, []).append(e)
+        self.contexts.setdefault(l, ContextIndex()).add(e)
+
+    def _addfrom(self, fr, to, l):
+        self.froms.setdefault(fr, {}).setdefault(l, None)
+        self.pairs.setdefault((fr, to), {}).setdefault(l, None)
+
+    def _addto(self, fr, to, l):
+        t = self.tos.setdefault(to, {})
+        if l in t:
+            return
+        t[l] = len(t)
+        for k in self._nearkeys(fr):
+            self.nears.setdefault((to, k), {})[l] = None
+
+    def _nearkeys(self, fr):
+        """ Keys shared by strings of the same length as fr that differ
+            from it in at most one place """
+        return [(i, fr[:i] + fr[i+1:]) for i in range(len(fr))]
+
+    def _nearto(self, fr, to):
+        """ The elements keys for to whose from may be one change from fr,
+            in the order of tos """
+        res = set(self.loosefroms.get(to, ()))
+        for k in self._nearkeys(fr):
+            res.update(self.nears.get((to, k), ()))
+        order = self.tos.get(to, {})
+        return sorted(res, key=order.get)
 
     def addElement(self, **kw):
         to = kw['to']
         fr = kw['from']
         test = "{}|{}".format(fr, to)
         if to == fr:    # special high priority insertion
-            self.elements.setdefault(test, []).append(kw)
-        for l in self.froms.get(fr, []):
-            for e in self.elements[l]:
+            self._append(test, kw)
+        for l in self.pairs.get((fr, to), ()):
+            elements = self.elements[l]
+            for i in self.contexts[l].find(kw, 1):
+                e = elements[i]
                 count = 0
                 if e['to'] != kw['to']:
                     continue
@@ -300,12 +412,14 @@ class TransformElements:
                     for k in ('before', 'after'):
                         if k not in kw: continue
                         e[k] = self.mergeTransform(e[k], kw[k])
-                        self.tos.setdefault(to, []).append(l)
+                    self.contexts[l].merged(i)
                     return
                 elif count == 0 and e['from'] == fr:
                     return
-        for l in self.tos.get(to, []):
-            for e in self.elements[l]:
+        for l in self._nearto(fr, to):
+            elements = self.elements[l]
+            for i in self.contexts[l].find(kw, 0):
+                e = elements[i]
                 if self.countDiffs(fr, e['from']) != 1:
                     continue
                 for k in ('before', 'after'):
@@ -314,15 +428,17 @@ class TransformElements:
                     if self.countDiffs(kw[k], e[k]): break
                 else:
                     e['from'] = self.mergeTransform(e['from'], fr)
-                    self.froms.setdefault(fr, []).append(l)
+                    self._addfrom(fr, to, l)
+                    self.loosefroms.setdefault(to, set()).add(l)
                     return
-        self.elements.setdefault(test, []).append(kw)
-        self.froms.setdefault(fr, []).append(test)
-        self.tos.setdefault(to, []).append(test)
+        self._append(test, kw)
+        self._addfrom(fr, to, test)
+        self._addto(fr, to, test)
 
     def countDiffs(self, new, old):
         if len(new) != len(old):
-            return max(len(new), len(old))
+            # never close enough to merge
+            return max(len(new), len(old), 2)
         count = 0
         for i,o in enumerate(old):
             if isinstance(o, (str,bytes)):
@@ -336,12 +452,14 @@ class TransformElements:
         if isinstance(old, (str,bytes)):
             old = [set(x) for x in old]
         for i, o in enumerate(old):
-            if new[i] not in o:
+            if isinstance(new[i], set):
+                o.update(new[i])
+            elif new[i] not in o:
                 o.add(new[i])
         return old
 
     def contextPriority(self):
-        for _, v in self.elements.items():
+        for _, v in list(self.elements.items()):
             for r in v:
                 if 'before' not in r:
                     continue
@@ -430,7 +548,7 @@ class OutputString:
             self.isreordering = True
         return self
 
-    def __unicode__(self):
+    def __str__(self):
         return self.str
 
     def __eq__(self, other):
@@ -439,7 +557,13 @@ class OutputString:
 def load_kmn(kmnfile, platform):
     with codecs.open(kmnfile, "r", encoding="utf-8-sig") as f:
         lines = "".join(f.readlines())
-    p = Parser(lines, debug = (args.debug & 2), platform = platform)
+    cache = ParseCache() if args.cache and not args.debug & 2 else None
+    key = cache.key(lines, platform) if cache else None
+    p = cache.get(key) if cache else None
+    if p is None:
+        p = Parser(lines, debug = (args.debug & 2), platform = platform)
+        if cache:
+            cache.put(key, p)
     if (args.debug & 1):
         print(pformat(p.tree))
     for s in p.allStores.values():
@@ -567,12 +691,22 @@ def parse_modifiers(modifiers):
             for c in itertools.combinations(reso, i):
                 yield sorted(resn + list(c))
 
+_basefiles = {}
+
 def process_basefile(basef):
-    ''' recursively reads an ldml file building a keymap '''
-    keymap = {}
+    ''' recursively reads an ldml file building a keymap. Each file is read
+        once per process and a copy of its keymap returned, since callers
+        update it. '''
     fname = find_file(basef)
     if fname is None:
         return {}
+    fname = os.path.abspath(fname)
+    if fname not in _basefiles:
+        _basefiles[fname] = read_basefile(fname)
+    return dict((m, dict(v)) for m, v in _basefiles[fname].items())
+
+def read_basefile(fname):
+    keymap = {}
     doc = et.parse(fname)
     for c in doc.getroot():
         if c.tag == 'keyMap':
@@ -653,10 +787,16 @@ nonoutputkeys = set(("lshift", "rshift", "shift", "lcontrol", "lctrl", "rcontrol
                     "numerals", "shifted", "upper", "lower", "symbols", "bksp", "numlock",
                     "lopt", "ropt", "opt", "enter", "space"))
 sparekeyCount = 1
+_layouts = {}
+
 def load_layout(jsfile):
-    with codecs.open(jsfile, "r", encoding="utf-8") as f:
-        linfo = json.load(f)
-    return linfo
+    ''' Reads a touch layout, once per process since keyboards may share
+        one. The result is not modified by processing. '''
+    fname = os.path.abspath(jsfile)
+    if fname not in _layouts:
+        with codecs.open(fname, "r", encoding="utf-8") as f:
+            _layouts[fname] = json.load(f)
+    return _layouts[fname]
 
 def preprocess_layout(linfo):
     allchars = set()
@@ -766,34 +906,47 @@ parser.add_argument('-u','--ui',default='touch',help='User Interface platform [t
 parser.add_argument('-O','--os',default='windows',help='Operating Systems platform [windows]')
 parser.add_argument('-F','--full',action="store_true",help="Output extra stuff")
 parser.add_argument('-C','--charreorder',help="Char in kmn that is inserted for reordering")
+parser.add_argument('-c','--cache',action="store_true",help="Keep parsed keyboards in the user cache")
 parser.add_argument('-z','--debug',type=int,default=0)
-args = parser.parse_args()
 
-ldml = LDMLKeyboard(args.locale, args.basefile)
+def main(argv=None):
+    """ Converts a keyboard as the command line argv asks. Module state
+        left by an earlier call is reset, so that a process can convert
+        many keyboards. """
+    global args, sparekeyCount
+    args = parser.parse_args(argv)
+    sparekeyCount = 1
+    DeadKey.reset()
+    Store.reset()
 
-platform = dict((x, getattr(args, x)) for x in ('form', 'ui', 'os'))
+    ldml = LDMLKeyboard(args.locale, args.basefile)
 
-if args.charreorder is not None:
-    args.charreorder = chr(int(args.charreorder, 16))
+    platform = dict((x, getattr(args, x)) for x in ('form', 'ui', 'os'))
 
-if args.kmn:
-    p = load_kmn(args.kmn, platform)
-    allchars = preprocess_kmn(p)
-if args.layout:
-    linfo = load_layout(args.layout)
-    allchars.update(preprocess_layout(linfo))
-DeadKey.set_excludes(allchars)
+    if args.charreorder is not None:
+        args.charreorder = chr(int(args.charreorder, 16))
+
+    allchars = set()
+    if args.kmn:
+        p = load_kmn(args.kmn, platform)
+        allchars = preprocess_kmn(p)
+    if args.layout:
+        linfo = load_layout(args.layout)
+        allchars.update(preprocess_layout(linfo))
+    DeadKey.set_excludes(allchars)
 
-if args.kmn:
-    process_kmn(ldml, p, reorder=args.reorder,
-                reorderfile=args.reorderfile, base=args.basefile, name=args.name)
+    if args.kmn:
+        process_kmn(ldml, p, reorder=args.reorder,
+                    reorderfile=args.reorderfile, base=args.basefile, name=args.name)
 
-if args.layout:
-    process_layout(ldml, linfo, platform=platform, extras=args.full)
+    if args.layout:
+        process_layout(ldml, linfo, platform=platform, extras=args.full)
 
-if args.imprt is not None:
-    ldml.addImport(args.imprt)
+    if args.imprt is not None:
+        ldml.addImport(args.imprt)
 
-with codecs.open(args.outfile, "w", encoding="utf-8") as f:
-    ldml.serialize_xml(f.write, doctype='<!DOCTYPE keyboard SYSTEM "../dtd/ldmlKeyboard.dtd">')
+    with codecs.open(args.outfile, "w", encoding="utf-8") as f:
+        ldml.serialize_xml(f.write, doctype='<!DOCTYPE keyboard SYSTEM "../dtd/ldmlKeyboard.dtd">')
 
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,10 @@ parser = optparse.OptionParser(usage='%prog [options] <KEYMAN FILE>\n' + __doc__
 parser.add_option("-m","--mode", 
                   default='all', choices=('all','first1','random','random1'),
                   help='Specify the search mode: all, first1, random, random1 (default: %default)')
+parser.add_option("-j","--jobs", type='int', default=1,
+                  help='Number of worker processes to share the rules between (default: %default)')
+parser.add_option("-s","--shortest", action='store_true',
+                  help='Only give the shortest input sequence for each rule context')
 
 (opts,kmns) = parser.parse_args()
 if len(kmns) == 0:
@@ -26,5 +30,6 @@ if len(kmns) == 0:
 
 with palaso.contexts.utf8out():
     k = Coverage(kmns[0])
-    results = sorted(sorted(k.coverage_test(opts.mode)),key=len,reverse=True)
+    limit = 1 if opts.shortest else None
+    results = sorted(sorted(k.coverage_test(opts.mode, opts.jobs, limit)),key=len,reverse=True)
     sys.stdout.writelines(l + '\n' for l in results)
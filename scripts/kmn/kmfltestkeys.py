@@ -3,7 +3,8 @@
 Given a sequence of key tops from a US 101 key keyboard or keyman symbol
 notation on stdin print the key names followed by the output the keyman
 keyboard would generate.  This allows us to try the keyboard without
-needing to install it.
+needing to install it. With --python the keyboard is run by a pure python
+simulator, so kmfl is not needed either.
 '''
 __version__ = '1.0'
 __date__ = '21 October 2009'
@@ -11,19 +12,27 @@ __author__ = 'Martin Hosken <martin_hosken@sil.org>'
 import sys
 from optparse import OptionParser
 from palaso.contexts import defaultapp
-from palaso.kmfl import kmfl
 from palaso.kmn import keysyms_items
 
 assert __doc__ is not None
 parser = OptionParser(usage='%prog [options] <KEYMAN FILE>\n' + __doc__)
-_, kmns = parser.parse_args()
+parser.add_option('-p', '--python', action='store_true',
+                  help='Simulate the keyboard in python rather than use kmfl')
+opts, kmns = parser.parse_args()
 if len(kmns) == 0:
     sys.stderr.write(parser.expand_prog_name('%prog: missing KEYMAN FILE\n'))
     parser.print_help(file=sys.stderr)
     sys.exit(1)
 
 with defaultapp():
-    k = kmfl(sys.argv[1])
+    if opts.python:
+        from palaso.kmn.simulator import Simulator
+        k = Simulator.fromfile(kmns[0])
+        run = k.run
+    else:
+        from palaso.kmfl import kmfl
+        k = kmfl(kmns[0])
+        run = lambda keys: k.run_items(keysyms_items(keys))
     for ln in sys.stdin.readlines():
-        r = k.run_items(keysyms_items(ln.strip()))
+        r = run(ln.strip())
         print(f"{ln}\t{r}")
@@ -80,83 +80,84 @@ ENDKBD
 parser = optparse.OptionParser(usage='%prog [options] <KEYMAN FILE>\n' + __doc__)
 parser.add_option("-n","--name", action='store', help='MSKLC Project name')
 
-(opts,kmns) = parser.parse_args()
-if len(kmns) == 0:
-    sys.stderr.write(parser.expand_prog_name('%prog: missing KEYMAN FILE\n'))
-    parser.print_help(file=sys.stderr)
-    sys.exit(1)
-
-kb = kmns[0]
-if not opts.name :
-    opts.name = re.sub(r'\..*$', '', os.path.basename(kb)).replace(' ', '')
-
-km = kmfl(kb)
-#sys.stdout = codecs.getwriter("utf_16_le")(sys.stdout)
-myprint(header(opts.name, km.store('NAME'), km.store('COPYRIGHT') or "GPL", km.store('AUTHOR') or "me"))
-
-deads = []
-ligs = []
-keys = [[None] * 2 for i in range(255)]    # declare array keys[255][2] !!
-keynames = [None] * 255
-ekeynames = [None] * 255
-for k in shifted + unshifted :
-    ksym = kmn.char_keysym(k)
-    sc, vkey, mod, kn, ekn, vkc = kmn.keysym_klcinfo(ksym)
-    keynames[sc] = kn
-    ekeynames[sc] = ekn
-    res = km.interpret_items([kmn.keysym_item(ksym)])
-    if (res[0] >> 24) == 5 :
-        deads.append([ksym,{},0])
-    elif len(res) > 1 :
-        ligs.append((vkey, mod, res))
-        keys[sc][mod] = (sc, vkey, 2)
-    else :
-        keys[sc][mod] = (sc, vkey, 0, res)
-
-for d in deads :
+def main(argv=None) :
+    (opts,kmns) = parser.parse_args(argv)
+    if len(kmns) == 0:
+        sys.stderr.write(parser.expand_prog_name('%prog: missing KEYMAN FILE\n'))
+        parser.print_help(file=sys.stderr)
+        sys.exit(1)
+
+    kb = kmns[0]
+    if not opts.name :
+        opts.name = re.sub(r'\..*$', '', os.path.basename(kb)).replace(' ', '')
+
+    km = kmfl(kb)
+    #sys.stdout = codecs.getwriter("utf_16_le")(sys.stdout)
+    myprint(header(opts.name, km.store('NAME'), km.store('COPYRIGHT') or "GPL", km.store('AUTHOR') or "me"))
+
+    deads = []
+    ligs = []
+    keys = [[None] * 2 for i in range(255)]    # declare array keys[255][2] !!
+    keynames = [None] * 255
+    ekeynames = [None] * 255
     for k in shifted + unshifted :
         ksym = kmn.char_keysym(k)
-        res = km.interpret_items([d[0], kmn.keysym_item(ksym)])
-        d[1][k] = res
-        if ksym == d[0] :
-            sc, vkey, mod, kn, ekn, vkc = kmn.keysym_klcinfo(ksym)
-            keys[sc][mod] = (sc, vkey, 1, res)
-            d[2] = res[0]
-
-for s in keys :
-    sc = None
-    vk = None
-    if not s : continue
-    res = [-1] * 2
-    for m in range(2) :
-        if not s[m] : continue
-        sc = s[m][0]
-        vk = s[m][1]
-        if s[m][2] == 2 :
-            res[m] = '%%'
+        sc, vkey, mod, kn, ekn, vkc = kmn.keysym_klcinfo(ksym)
+        keynames[sc] = kn
+        ekeynames[sc] = ekn
+        res = km.interpret_items([kmn.keysym_item(ksym)])
+        if (res[0] >> 24) == 5 :
+            deads.append([ksym,{},0])
+        elif len(res) > 1 :
+            ligs.append((vkey, mod, res))
+            keys[sc][mod] = (sc, vkey, 2)
         else :
-            res[m] = "%04x" % (ord(kmn.item_to_char(s[m][3][0])))
-        if s[m][2] == 1 and res[m] != '-1' :
-            res[m] += "@"
-    if sc :
-        myprint(key(sc, vk, 0, res[0], res[1]))
+            keys[sc][mod] = (sc, vkey, 0, res)
 
-if len(deads) > 0 :
     for d in deads :
-        if not d : continue
-        myprint("\nDEADKEY %04X\n" % (d[2] & 0xFFFF))
-        for k in d[1] :
-            res = res_str(d[1][k])
-            if res :
-                myprint("%04X\t%s" % (ord(k), res))
-
-if len(ligs) > 0 :
-    myprint(lighead)
-    for l in ligs :
-        codestr = res_str(l[2])
-        myprint(lig(l[0], l[1], codestr))
-
-myprint('''
+        for k in shifted + unshifted :
+            ksym = kmn.char_keysym(k)
+            res = km.interpret_items([d[0], kmn.keysym_item(ksym)])
+            d[1][k] = res
+            if ksym == d[0] :
+                sc, vkey, mod, kn, ekn, vkc = kmn.keysym_klcinfo(ksym)
+                keys[sc][mod] = (sc, vkey, 1, res)
+                d[2] = res[0]
+
+    for s in keys :
+        sc = None
+        vk = None
+        if not s : continue
+        res = [-1] * 2
+        for m in range(2) :
+            if not s[m] : continue
+            sc = s[m][0]
+            vk = s[m][1]
+            if s[m][2] == 2 :
+                res[m] = '%%'
+            else :
+                res[m] = "%04x" % (ord(kmn.item_to_char(s[m][3][0])))
+            if s[m][2] == 1 and res[m] != '-1' :
+                res[m] += "@"
+        if sc :
+            myprint(key(sc, vk, 0, res[0], res[1]))
+
+    if len(deads) > 0 :
+        for d in deads :
+            if not d : continue
+            myprint("\nDEADKEY %04X\n" % (d[2] & 0xFFFF))
+            for k in d[1] :
+                res = res_str(d[1][k])
+                if res :
+                    myprint("%04X\t%s" % (ord(k), res))
+
+    if len(ligs) > 0 :
+        myprint(lighead)
+        for l in ligs :
+            codestr = res_str(l[2])
+            myprint(lig(l[0], l[1], codestr))
+
+    myprint('''
 
 KEYNAME
 
@@ -257,3 +258,5 @@ ENDKBD
 #
 #myprint "\nENDKBD"
 
+if __name__ == '__main__' :
+    main()
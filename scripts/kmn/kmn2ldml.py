@@ -159,45 +159,50 @@ def process_rule(lhs, rhs, presets, iskey = True, contextref = False) :
 parser = OptionParser()
 parser.add_option("-l","--lang",help="Language tag for this LDML")
 
-(opts, argv) = parser.parse_args()
-id = {}
-if opts.lang :
-    m = re.match(r'^([^-_]+)(?:[-_]?([^-_]*)[-_]?(.*))$', opts.lang)
-    id['language'] = m.group(1)
-    if len(m.group(2)) == 4 :
-        id['script'] = m.group(2)
-    elif m.group(2) :
-        id['territory'] = m.group(2)
-
-kb = kmfl(argv[0])
-rules = {}
-name = kb.store("NAME")
-mnemonic = kb.store("MNEMONIC")
-mnemattr = ' mnemonic="1"' if mnemonic else ""
-print("""<?xml version="1.0"?>
+def main(argv=None) :
+    global kb
+    (opts, argv) = parser.parse_args(argv)
+    id = {}
+    if opts.lang :
+        m = re.match(r'^([^-_]+)(?:[-_]?([^-_]*)[-_]?(.*))$', opts.lang)
+        id['language'] = m.group(1)
+        if len(m.group(2)) == 4 :
+            id['script'] = m.group(2)
+        elif m.group(2) :
+            id['territory'] = m.group(2)
+
+    kb = kmfl(argv[0])
+    rules = {}
+    name = kb.store("NAME")
+    mnemonic = kb.store("MNEMONIC")
+    mnemattr = ' mnemonic="1"' if mnemonic else ""
+    print("""<?xml version="1.0"?>
 <ldml>
   <identity>""")
 
-for k, v in id.items() :
-    print('    <%s type="%s"/>' % (k, v))
-print('    <generation date="%s"/>' % (time.strftime('%Y-%m-%d')))
-print("""  </identity>
+    for k, v in id.items() :
+        print('    <%s type="%s"/>' % (k, v))
+    print('    <generation date="%s"/>' % (time.strftime('%Y-%m-%d')))
+    print("""  </identity>
   <special>
     <keyboards xmlns="http://www.palaso.org/ldml/0.2">
       <keyboard name="%s"%s>""" % (name, mnemattr))
-for i in range(kb._num_rules()) :
-    (lhs, rhs, gpnum, flags) = kb.rule(i)
-    for r in process_rule(lhs, rhs, [0] * len(lhs), iskey = (flags & 1)) :
-        if r.key in rules :
-            rules[r.key].append(r)
-        else :
-            rules[r.key] = [r]
-for k in sorted(rules.keys()) :
-    for r in sorted(rules[k], cmp = lambda a, b : cmp(len(b.inputs), len(a.inputs))) :
-        print("        " + r.asxml())
+    for i in range(kb._num_rules()) :
+        (lhs, rhs, gpnum, flags) = kb.rule(i)
+        for r in process_rule(lhs, rhs, [0] * len(lhs), iskey = (flags & 1)) :
+            if r.key in rules :
+                rules[r.key].append(r)
+            else :
+                rules[r.key] = [r]
+    for k in sorted(rules.keys()) :
+        for r in sorted(rules[k], key = lambda a : -len(a.inputs)) :
+            print("        " + r.asxml())
 
-print("""      </keyboard>
+    print("""      </keyboard>
     </keyboards>
   </special>
 </ldml>
 """)
+
+if __name__ == '__main__' :
+    main()
@@ -5,6 +5,9 @@ characters are output for every key (shifted and unshifted) on an standard
 105 key keyboard.
 NOTE: This will not generate mappings key sequences, dead-keys or keys in 
 combination with meta keys other than shift.
+Given an output directory, several keyboards may be converted at once, and
+with a dependency manifest only those whose source, includes or options have
+changed since the last run are converted again.
 '''
 __version__ = '1.2'
 __date__    = '25 September 2009'
@@ -15,9 +18,10 @@ This version uses libkmflcomp to process the source rather than parse the
 source directly so it works better with more complex keyboards.
 '''
 
-import codecs, optparse, sys
+import optparse, os, sys
 from palaso.kmfl import kmfl
 from palaso import kmn
+from palaso.kmn.depends import Manifest, kmn_sources
 from html.entities import codepoint2name
 
 
@@ -84,7 +88,7 @@ def quote(cs):
     return r
 
 
-def output_chars(keypresses):
+def output_chars(kb, keypresses):
     # return [kb.run_items([it]) or ' ' for it in kmn.keysyms_items(keypresses)]
     res = []
     for it in keypresses :
@@ -92,7 +96,7 @@ def output_chars(keypresses):
         res.append(r)
     return res
 
-def output_modified_chars(keytops, mod) :
+def output_modified_chars(kb, keytops, mod) :
     res = []
     if mod.upper().endswith("ALT") or mod.upper().endswith("CTRL") :
         keys = ["[{0} {1}]".format(mod, kmn.char_keysym(x)[1:-1]) for x in keytops.replace(r'\\', '\\')]
@@ -108,13 +112,59 @@ def output_modified_chars(keytops, mod) :
     return res
 #    return [quote(kb.run_items([kmn.keysym_item(it)])) for it in keys]
 
-parser = optparse.OptionParser(usage='%prog [options] <KEYMAN FILE>\n' + __doc__)
+def write_keyboard(kb, out):
+    out.write(of['header'](font=opts.font or '', 
+                     size=opts.font and opts.size or '',
+                     name=kb.store('NAME'),
+                     modifiers=opts.modifiers or ''))
+    if opts.modifiers :
+        out.writelines(map(
+            of['key'],
+            key_tops,
+            map(of['prep'], output_modified_chars(kb, unshifted, opts.modifiers)),
+            map(of['prep'], output_modified_chars(kb, shifted, opts.modifiers)),
+            map(of['bytes'],shifted),
+            map(of['bytes'], unshifted)))
+    else :
+        out.writelines(map(
+            of['key'],
+            key_tops,
+            map(of['prep'], output_chars(kb, unshifted)),
+            map(of['prep'], output_chars(kb, shifted)),
+            map(of['bytes'], unshifted),
+            map(of['bytes'], shifted)))
+    out.write(of['footer'])
+
+def convert(kmnfile, outfile, manifest=None):
+    '''Converts a keyboard to outfile unless manifest shows it is up to
+       date. Returns whether it was converted.'''
+    settings = (opts.font, opts.size, opts.modifiers, opts.lang)
+    inputs = kmn_sources(kmnfile)
+    if manifest is not None and manifest.current(outfile, inputs, settings) :
+        return False
+    kb = kmfl(kmnfile)
+    with open(outfile, 'w', encoding='utf-8') as out :
+        write_keyboard(kb, out)
+    if manifest is not None :
+        manifest.record(outfile, inputs, settings)
+    return True
+
+
+parser = optparse.OptionParser(usage='%prog [options] <KEYMAN FILE>...\n' + __doc__)
 parser.add_option("-f","--font",action='store',metavar='FONTNAME',
                   help='Specify the preferred font for the keyboard output')
 parser.add_option("-s","--size",action='store',type="float", metavar='POINTS',
                   help='The size of the output characters')
 parser.add_option("-m","--modifiers",action="store",help="Modifiers to apply to keytops")
 parser.add_option("-l","--lang",action="store",help="xml output language [kmxml]")
+parser.add_option("-o","--output",action="store",metavar='FILE',
+                  help='Write to FILE rather than standard output')
+parser.add_option("-d","--outdir",action="store",metavar='DIR',
+                  help='Convert each keyboard to a .xml file of the same name in DIR')
+parser.add_option("-D","--depends",action="store",metavar='MANIFEST',
+                  help='Manifest of input hashes. Outputs whose keyboard, '
+                       'includes and options are unchanged since it was '
+                       'written are not converted again')
 
 (opts,kmns) = parser.parse_args()
 if not opts.lang : opts.lang = "kmxml"
@@ -124,27 +174,31 @@ if len(kmns) == 0:
     sys.stderr.write(parser.expand_prog_name('%prog: missing KEYMAN FILE\n'))
     parser.print_help(file=sys.stderr)
     sys.exit(1)
-
-kb = kmfl(kmns[0])
-out = codecs.getwriter('utf_8')(sys.stdout)
-out.write(of['header'](font=opts.font or '', 
-                 size=opts.font and opts.size or '',
-                 name=kb.store('NAME'),
-                 modifiers=opts.modifiers or ''))
-if opts.modifiers :
-    out.writelines(map(
-        of['key'],
-        key_tops,
-        map(of['prep'], output_modified_chars(unshifted, opts.modifiers)),
-        map(of['prep'], output_modified_chars(shifted, opts.modifiers)),
-        map(of['bytes'],shifted),
-        map(of['bytes'], unshifted)))
+if not opts.outdir and len(kmns) > 1:
+    parser.error('more than one KEYMAN FILE needs --outdir')
+if opts.depends and not (opts.outdir or opts.output):
+    parser.error('--depends needs --output or --outdir')
+
+if opts.outdir :
+    os.makedirs(opts.outdir, exist_ok=True)
+    jobs = [(k, os.path.join(opts.outdir,
+                             os.path.splitext(os.path.basename(k))[0] + '.xml'))
+            for k in kmns]
+elif opts.output :
+    jobs = [(kmns[0], opts.output)]
 else :
-    out.writelines(map(
-        outformats[opts.lang]['key'],
-        key_tops,
-        map(of['prep'], output_chars(unshifted)),
-        map(of['prep'], output_chars(shifted)),
-        map(of['bytes'], unshifted),
-        map(of['bytes'], shifted)))
-out.write(of['footer'])
+    write_keyboard(kmfl(kmns[0]), sys.stdout)
+    sys.exit(0)
+
+manifest = Manifest(opts.depends) if opts.depends else None
+done = 0
+try :
+    for k, out in jobs :
+        done += convert(k, out, manifest)
+finally :
+    # Keep the record of those converted before any failure
+    if manifest is not None :
+        manifest.save()
+if manifest is not None :
+    sys.stderr.write("%d of %d keyboards converted, the rest up to date\n"
+                     % (done, len(jobs)))
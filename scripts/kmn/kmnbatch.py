@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+'''
+Convert many Keyman keyboards with keyman2ldml, kmn2ldml or kmn2klc in one
+go. Keyboards are given as files or glob patterns and converted in a pool
+of worker processes, each of which imports the converter once and keeps it
+for every keyboard it is given. keyman2ldml keeps the base LDML keyboards
+and touch layouts it has read, so keyboards sharing them only read them
+once per worker.
+
+A JSON report is written giving, for each keyboard, its output file, the
+time taken and any error, which does not stop the rest of the batch. A
+keyboard's output is only replaced once it has converted successfully.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, suppress
+from glob import glob
+from pathlib import Path
+from typing import NamedTuple
+import argparse
+import importlib.machinery
+import importlib.util
+import io
+import json
+import os
+import shlex
+import sys
+import tempfile
+import time
+
+__version__ = '0.1'
+__date__ = '19 October 2026'
+
+
+class Tool(NamedTuple):
+    suffix: str
+    # Whether the tool writes its output to stdout rather than to the file
+    # named by its last argument
+    stdout: bool
+
+
+TOOLS = {
+    'keyman2ldml': Tool('.xml', False),
+    'kmn2ldml': Tool('.xml', True),
+    'kmn2klc': Tool('.klc', True),
+}
+
+
+def script(name):
+    '''The path of a sibling script, with or without its .py suffix.'''
+    here = Path(__file__).resolve().parent
+    for path in (here / (name + '.py'), here / name):
+        if path.exists():
+            return path
+    raise FileNotFoundError(f'{name} not found alongside'
+                            f' {Path(__file__).name}')
+
+
+def load_tool(name):
+    loader = importlib.machinery.SourceFileLoader(name, str(script(name)))
+    module = importlib.util.module_from_spec(
+        importlib.util.spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
+
+
+def keyboards(patterns):
+    found = []
+    for pat in patterns:
+        matches = glob(pat, recursive=True)
+        if not matches:
+            print(f'warning: {pat} matches no keyboards', file=sys.stderr)
+        found.extend(matches)
+    return sorted(set(map(Path, found)))
+
+
+def make_jobs(args):
+    tool = TOOLS[args.tool]
+    extra = shlex.split(args.args or '')
+    jobs = []
+    seen = {}
+    for kmn in keyboards(args.keyboards):
+        out = args.outdir / (kmn.stem + tool.suffix)
+        if out in seen:
+            raise SystemExit(f'{kmn} and {seen[out]} would both be'
+                             f' converted to {out}')
+        seen[out] = kmn
+        if args.tool == 'keyman2ldml':
+            layout = args.layout or kmn.with_suffix('.keyman-touch-layout')
+            argv = extra + ['-k', str(kmn)]
+            if Path(layout).exists():
+                argv += ['-l', str(layout)]
+        else:
+            argv = extra + [str(kmn)]
+        jobs.append((args.tool, argv, str(kmn), str(out)))
+    return jobs
+
+
+_tools = {}
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def convert(job):
+    name, argv, kmn, out = job
+    messages = io.StringIO()
+    error = None
+    start = time.perf_counter()
+    # The tool writes to a temporary file beside the output, which replaces
+    # it only if the conversion succeeds, so a failure mid way leaves any
+    # earlier output intact rather than truncated.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out)),
+                               prefix=Path(out).name + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        if name not in _tools:
+            _tools[name] = load_tool(name)
+        if TOOLS[name].stdout:
+            with open(tmp, 'w', encoding='utf-8', newline='') as f, \
+                    redirect_stdout(f):
+                _tools[name].main(argv)
+        else:
+            with redirect_stdout(messages):
+                _tools[name].main(argv + [tmp])
+    except SystemExit as err:
+        if err.code:
+            error = f'exit status {err.code}'
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+    if error is None:
+        try:
+            # mkstemp makes the file private; give it the usual permissions.
+            os.chmod(tmp, 0o666 & ~_umask())
+            os.replace(tmp, out)
+        except OSError as err:
+            error = f'{type(err).__name__}: {err}'
+    if error is not None:
+        with suppress(FileNotFoundError):
+            os.remove(tmp)
+    return {'kmn': kmn,
+            'output': out,
+            'seconds': round(time.perf_counter() - start, 6),
+            'error': error,
+            'messages': messages.getvalue()}
+
+
+def main(args):
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    jobs = make_jobs(args)
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(args.jobs) as pool:
+        for res in pool.map(convert, jobs):
+            results.append(res)
+            status = res['error'] or 'ok'
+            print(f'{res["seconds"]:8.3f}s {res["kmn"]}: {status}')
+    failed = sum(1 for r in results if r['error'])
+    report = {'tool': args.tool,
+              'jobs': args.jobs,
+              'seconds': round(time.perf_counter() - start, 6),
+              'converted': len(results) - failed,
+              'failed': failed,
+              'keyboards': results}
+    report_path = args.report or args.outdir / 'report.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'{len(results)} keyboards in {report["seconds"]:.2f}s,'
+          f' {failed} failed. Report in {report_path}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('keyboards', metavar='KMN', nargs='+',
+                        help='Keyboard files, or glob patterns for them')
+    parser.add_argument(
+        '-t', '--tool', choices=sorted(TOOLS), default='keyman2ldml',
+        help='Converter to run. default: %(default)s')
+    parser.add_argument(
+        '-o', '--outdir', type=Path, default=Path('.'),
+        help='Directory for the converted keyboards. default: current')
+    parser.add_argument(
+        '-a', '--args', metavar='ARGS',
+        help='Further options for the converter, as one quoted string')
+    parser.add_argument(
+        '-l', '--layout', type=Path,
+        help='keyman2ldml touch layout for every keyboard. default: a'
+             ' .keyman-touch-layout file beside the keyboard, if any')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count(),
+        help='Worker processes. default: one per CPU')
+    parser.add_argument(
+        '-r', '--report', type=Path,
+        help='JSON report file. default: report.json in the output'
+             ' directory')
+    parser.exit(main(parser.parse_args()))
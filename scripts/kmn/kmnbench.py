@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for the palaso.kmn keyboard tools.
+
+ldml: convert keyboards to LDML with keyman2ldml, timing each conversion.
+Without keyboards, synthetic ones are generated with doubling numbers of
+rules, each mapping a two character context and a key to an output of its
+own, so that few of the resulting transforms can be merged. The time per
+rule should stay roughly constant as the keyboard grows.
+
+items: time palaso.kmn's keysym and item conversions, through its lookup
+tables and by computing each result directly, for the keys of a US
+keyboard with and without modifiers. Also compares items_to_keys on a
+long sequence against converting its items one at a time.
+'''
+from palaso import kmn
+from palaso.kmn.parser import keymap
+import argparse
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+__version__ = '0.1'
+__date__ = '19 October 2026'
+
+CONSONANTS = [chr(0x915 + i) for i in range(37)]
+KEYS = '1234567890-=[]'
+KEYTOPS = r'''`1234567890-=qwertyuiop[]\\asdfghjkl;'zxcvbnm,./'''
+MODIFIERS = ('', 'Shift ', 'RAlt ', 'Ctrl ', 'Shift RAlt ')
+
+
+def script(name):
+    '''The path of a sibling script, with or without its .py suffix.'''
+    here = Path(__file__).resolve().parent
+    for path in (here / (name + '.py'), here / name):
+        if path.exists():
+            return path
+    raise SystemExit(f'{name} not found alongside {Path(__file__).name}')
+
+
+def timed(fn, *args, **kwds):
+    start = time.perf_counter()
+    res = fn(*args, **kwds)
+    return time.perf_counter() - start, res
+
+
+def synthetic_kmn(rules):
+    '''A keyboard with the given number of context rules.'''
+    lines = ["store(&NAME) 'Synthetic {}'".format(rules),
+             'begin Unicode > use(main)',
+             'group(main) using keys']
+    n = 0
+    for a in CONSONANTS:
+        for b in CONSONANTS:
+            for k in KEYS:
+                if n == rules:
+                    return '\n'.join(lines) + '\n'
+                n += 1
+                lines.append("'{0}{1}' + '{2}' > '{0}{1}{3}'".format(
+                             a, b, k, chr(0x1000 + n % 500)))
+    return '\n'.join(lines) + '\n'
+
+
+def base_ldml():
+    '''A base keyboard mapping each key to the character it types.'''
+    maps = {False: [], True: []}
+    for c, (iso, shift) in sorted(keymap.items()):
+        if len(c) == 1 and c not in '<>&"':
+            maps[shift].append(f'<map iso="{iso}" to="{c}"/>')
+    return ('<keyboard locale="en">\n<keyMap>\n'
+            + '\n'.join(maps[False])
+            + '\n</keyMap>\n<keyMap modifiers="shift">\n'
+            + '\n'.join(maps[True])
+            + '\n</keyMap>\n</keyboard>\n')
+
+
+def convert(kmn, base, out):
+    subprocess.run([sys.executable, str(script('keyman2ldml')),
+                    '-k', str(kmn), '-b', str(base), '-u', 'hardware',
+                    str(out)], check=True)
+    return out.read_text(encoding='utf-8').count('<transform ')
+
+
+def bench_ldml(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        base = tmp / 'base.xml'
+        base.write_text(base_ldml(), encoding='utf-8')
+        if args.keyboards:
+            kmns = [(k, k.name) for k in args.keyboards]
+        else:
+            kmns = []
+            for size in args.sizes:
+                path = tmp / f'synthetic{size}.kmn'
+                path.write_text(synthetic_kmn(size), encoding='utf-8')
+                kmns.append((path, size))
+        print(f'{"keyboard":>20} {"transforms":>10} {"seconds":>9}'
+              f' {"us/transform":>12}')
+        for path, name in kmns:
+            secs, count = timed(convert, path, base, tmp / 'out.xml')
+            per = f'{secs/count*1e6:12.1f}' if count else f'{"-":>12}'
+            print(f'{name:>20} {count:10d} {secs:9.3f} {per}')
+
+
+def rate(fn, args, calls):
+    '''Microseconds per call of fn, cycling through args.'''
+    args = (args * (calls//len(args) + 1))[:calls]
+    secs, _ = timed(lambda: [fn(a) for a in args])
+    return secs / calls * 1e6
+
+
+def keysyms():
+    syms = [kmn.char_keysym(c) for c in KEYTOPS + KEYTOPS.upper()]
+    syms += [f'[{m}{s[1:-1]}]' for s in syms if s.startswith('[K_')
+             for m in MODIFIERS[2:]]
+    return syms
+
+
+def accepted(fn, inputs):
+    '''The inputs fn does not raise an error for.'''
+    res = []
+    for x in inputs:
+        try:
+            fn(x)
+        except (KeyError, ValueError):
+            continue
+        res.append(x)
+    return res
+
+
+def bench_items(args):
+    syms = keysyms()
+    items = [kmn.keysym_item(s) for s in syms]
+    cases = [('keysym_item', kmn._keysym_item, kmn.keysym_item, syms),
+             ('item_to_key', kmn._item_to_key, kmn.item_to_key, items),
+             ('item_to_char', kmn._item_to_char, kmn.item_to_char, items),
+             ('char_keysym', kmn._char_keysym, kmn.char_keysym,
+              list(KEYTOPS + KEYTOPS.upper())),
+             ('keysym_scancodes', kmn._keysym_scancodes,
+              kmn.keysym_scancodes, syms),
+             ('keysym_klcinfo', kmn._keysym_klcinfo, kmn.keysym_klcinfo,
+              syms)]
+    print(f'{"function":16} {"inputs":>6} {"direct us":>10} {"table us":>10}'
+          f' {"speedup":>8}')
+    for name, direct, table, inputs in cases:
+        inputs = accepted(direct, inputs)
+        d = rate(direct, inputs, args.calls)
+        t = rate(table, inputs, args.calls)
+        print(f'{name:16} {len(inputs):6d} {d:10.3f} {t:10.3f}'
+              f' {d/t:8.1f}')
+    seq = random.Random(args.seed).choices(items, k=args.length)
+    # Both sides use the same cached tables; only the per call overhead
+    # differs.
+    kmn.items_to_keys(seq)
+    one, _ = timed(lambda: ''.join(kmn.item_to_key(i) for i in seq))
+    many, _ = timed(kmn.items_to_keys, seq)
+    print(f'items_to_keys on {args.length} items: {one*1e3:.2f}ms one at a'
+          f' time, {many*1e3:.2f}ms in one call')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='bench', required=True)
+    ldml = sub.add_parser('ldml', help='keyman2ldml conversion time')
+    ldml.add_argument('keyboards', metavar='KMN', type=Path, nargs='*',
+                      help='Keyboards to convert instead of synthetic ones')
+    ldml.add_argument(
+        '-s', '--sizes', type=int, nargs='+',
+        default=[1 << n for n in range(10, 15)],
+        help='Rules in each synthetic keyboard. default: 1K to 16K doubling')
+    ldml.set_defaults(run=bench_ldml)
+    items = sub.add_parser('items', help='keysym and item conversions')
+    items.add_argument(
+        '-n', '--calls', type=int, default=100000,
+        help='Calls to time for each function. default: %(default)s')
+    items.add_argument(
+        '-l', '--length', type=int, default=100000,
+        help='Items in the items_to_keys sequence. default: %(default)s')
+    items.add_argument(
+        '--seed', type=int, default=0,
+        help='Random number seed for the sequence. default: %(default)s')
+    items.set_defaults(run=bench_items)
+
+    args = parser.parse_args()
+    parser.exit(args.run(args) or 0)
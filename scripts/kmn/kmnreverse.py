@@ -13,5 +13,5 @@ kmn = Keyman(args.kmn)
 cache = {}
 with codecs.open(args.test, encoding="utf-8") as f :
     for l in f.readlines() :
-        res = kmn.reverse(l.strip())[0]
+        res = kmn.reverse(l.strip(), limit = 1)[0]
         print("".join(map(str, res)))
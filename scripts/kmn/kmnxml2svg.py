@@ -4,6 +4,7 @@ import os, sys, string
 from xml.dom.minidom import *
 import getopt
 from palaso import kmn
+from palaso.kmn.depends import Manifest
 
 _fontSize = 24
 _font = 'Charis SIL'
@@ -14,7 +15,9 @@ options = {
     'f': 'Charis SIL',
     's': '24',
     't': kmn.keyboard_template,
-    'w': 'normal'
+    'w': 'normal',
+    'd': None,
+    'D': None
 }
 
 _codeMap = {
@@ -60,12 +63,33 @@ nonKeys = ('back', 'tab', 'capslock', 'enter', 'shiftl', 'shiftr', 'ctrll',
 
 _keyMap = {}
 
-def processFiles(keyboardFile,outputsvg):
+# Parsed templates by path. Drawing many keyboards in one run parses the
+# template once, and each keyboard's labels are taken out of it again once
+# its diagram is written.
+_templates = {}
+
+def loadTemplate(file):
+    dom = _templates.get(file)
+    if dom is None :
+        dom = _templates[file] = parse(file)
+    return dom
+
+def processFiles(keyboardFile, outputsvg, manifest=None):
+    ''' Draws a keyboard unless manifest shows its diagram is up to date.
+        Returns whether it was drawn. '''
+    inputs = (keyboardFile, options['t'])
+    settings = (options['f'], options['s'], options['w'])
+    if manifest is not None and manifest.current(outputsvg, inputs, settings) :
+        return False
     parseKeyboardFile(keyboardFile)
     processSVGFile(options['t'],outputsvg)
+    if manifest is not None :
+        manifest.record(outputsvg, inputs, settings)
+    return True
 
 def parseKeyboardFile(file):
     global name
+    _keyMap.clear()
     dom = parse(file)
     kbd = dom.getElementsByTagName('keyboard')[0]
     name = kbd.getAttribute('name')
@@ -82,13 +106,30 @@ def parseKeyboardFile(file):
     # print(_keyMap)
 
 def processSVGFile(file,outputsvg):
+    dom = loadTemplate(file)
+    added = []
+    replaced = []
+    try :
+        drawKeyboard(dom, outputsvg, added, replaced)
+    finally :
+        for node in reversed(added) :
+            node.parentNode.removeChild(node)
+        for span, new, old in replaced :
+            span.replaceChild(old, new)
+
+def drawKeyboard(dom, outputsvg, added, replaced):
+    ''' Adds the keyboard's labels to the template dom and writes it out,
+        listing the nodes added and the (parent, new, old) nodes replaced
+        so the template can be restored '''
     global name
-    dom = parse(file)
     if name :
         for t in dom.getElementsByTagName('text') :
             if t.getAttribute('id') == 'title' :
                 span = t.getElementsByTagName('tspan')[0]
-                span.replaceChild(dom.createTextNode(name), span.firstChild, )
+                old = span.firstChild
+                new = dom.createTextNode(name)
+                span.replaceChild(new, old)
+                replaced.append((span, new, old))
     layers = dom.getElementsByTagName('g')
     for layer in layers:
         if layer.getAttribute('id') == 'labels':
@@ -127,7 +168,7 @@ def processSVGFile(file,outputsvg):
                     textDown.setAttribute('x', str(x + 25))
                     textDown.setAttribute('y', str(y + 50))
                     textDown.appendChild(dom.createTextNode(unshift))
-                    g.appendChild(textDown)
+                    added.append(g.appendChild(textDown))
                     textUp = dom.createElement('text')
                     textUp.setAttribute('id', 'textu_' + baseId)
                     textUp.setAttribute('sodipodi:role', 'line')
@@ -135,7 +176,7 @@ def processSVGFile(file,outputsvg):
                     textUp.setAttribute('x', str(x + 25))
                     textUp.setAttribute('y', str(y + 25))
                     textUp.appendChild(dom.createTextNode(shift))
-                    g.appendChild(textUp)
+                    added.append(g.appendChild(textUp))
                     # print(textDown.toxml())
                     textUpLabel = dom.createElement('text')
                     textUpLabel.setAttribute('id', 'textul_' + baseId)
@@ -144,7 +185,7 @@ def processSVGFile(file,outputsvg):
                     textUpLabel.setAttribute('x', str(x + 5))
                     textUpLabel.setAttribute('y', str(y + 25))
                     textUpLabel.appendChild(dom.createTextNode(upperKey if upperKey else keyId.upper()))
-                    g.appendChild(textUpLabel)
+                    added.append(g.appendChild(textUpLabel))
 
                     if upperKey != None :
                         textDownLabel = dom.createElement('text')
@@ -154,27 +195,31 @@ def processSVGFile(file,outputsvg):
                         textDownLabel.setAttribute('x', str(x + 5))
                         textDownLabel.setAttribute('y', str(y + 50))
                         textDownLabel.appendChild(dom.createTextNode(keyId))
-                        g.appendChild(textDownLabel)
+                        added.append(g.appendChild(textDownLabel))
 
             # print(newLayer.toprettyxml())
-            dom.documentElement.appendChild(newLayer)  
+            added.append(dom.documentElement.appendChild(newLayer))
 
             # print(dom.toprettyxml())
-            outf = open(outputsvg, 'w')
+            outf = open(outputsvg, 'wb')
             outf.write(dom.toxml('utf-8'))
             outf.close()
    
 def usage():
-    print("""%s [-f font] [-s point_size] [-w weight] [-t template.svg] input.xml output.svg
+    print("""%s [-f font] [-s point_size] [-w weight] [-t template.svg] [-D manifest] input.xml output.svg
+%s [options] -d outdir input.xml...
     -f font to use in svg file
     -s font point size
     -w font weight (defaults to normal)
     -t template .svg file (keyboard.svg)
-    use inkscape to change svg into another format""" % (sys.argv[0]))
+    -d directory to draw each input.xml into, as a .svg of the same name
+    -D manifest of input hashes. Diagrams whose input, template and
+       options are unchanged since it was written are not redrawn
+    use inkscape to change svg into another format""" % (sys.argv[0], sys.argv[0]))
     
 def main():
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], "hf:s:t:w:", ["help"])
+        optlist, args = getopt.getopt(sys.argv[1:], "hf:s:t:w:d:D:", ["help"])
     except getopt.GetoptError as err:
         # print help information and exit:
         print(str(err)) # will print something like "option -a not recognized"
@@ -185,10 +230,31 @@ def main():
         if o in ("-h", "--help"):
             usage()
             sys.exit()
-    if len(args) != 2:
+    if options['d'] :
+        if not args :
+            usage()
+            sys.exit()
+        os.makedirs(options['d'], exist_ok=True)
+        jobs = [(a, os.path.join(options['d'],
+                                 os.path.splitext(os.path.basename(a))[0] + '.svg'))
+                for a in args]
+    elif len(args) != 2:
         usage()
         sys.exit()
-    processFiles(args[0], args[1])
+    else :
+        jobs = [(args[0], args[1])]
+    manifest = Manifest(options['D']) if options['D'] else None
+    drawn = 0
+    try :
+        for x, svg in jobs :
+            drawn += processFiles(x, svg, manifest)
+    finally :
+        # Keep the record of those drawn before any failure
+        if manifest is not None :
+            manifest.save()
+    if manifest is not None :
+        sys.stderr.write("%d of %d diagrams drawn, the rest up to date\n"
+                         % (drawn, len(jobs)))
 
 if __name__ == "__main__":
 #    processFiles('keyboard.svg', 'thailit.xml')
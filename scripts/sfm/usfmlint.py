@@ -6,6 +6,7 @@ errors found for each SFM file in the project.
 Automatically load the usfm.sty and custom.sty stylesheets if present
 '''
 from palaso.sfm import usfm, style
+from palaso.sfm.project import ProjectIndex
 from pathlib import Path
 from itertools import chain
 import argparse
@@ -44,11 +45,36 @@ if __name__ == '__main__':
              'default USFM, project or custom stylesheets. Multiple uses of '
              'this option will see stylesheets applied in the order '
              'specified.')
+    parser.add_argument(
+        "-i", "--index", action='store_true', default=False,
+        help='Keep a persistent index of the project and only re-parse '
+             'files that have changed since the last run.')
 
     args = parser.parse_args()
     if not args.project.exists():
         parser.error('missing Paratext project directory.')
 
+    if args.index:
+        try:
+            index = ProjectIndex(args.project, sfms=args.sfms,
+                                 stylesheets=args.stylesheet,
+                                 load_project_sty=args.load_project_sty,
+                                 error_level=args.error_level)
+            index.refresh()
+        except SyntaxError as err:
+            parser.exit(3,
+                        f'{parser.prog}: Style sheet parsing error: {err!s}\n')
+        except IOError as err:
+            parser.exit(4, f'{parser.prog}: IO error: {err!s}\n')
+        if not len(index):
+            parser.error("no SFM files found to check.")
+        for book in index:
+            for issue in book.warnings:
+                print(issue)
+            if book.error:
+                print(book.error)
+        parser.exit(0)
+
     args.sfms = list(chain.from_iterable(args.project.glob(g)
                                          for g in args.sfms))
     if not args.sfms:
@@ -11,11 +11,11 @@ __credits__ = ''''''
 import palaso.sfm as sfm
 from palaso.sfm import usfm, style
 from itertools import chain
-from functools import reduce
 import codecs
 import glob
 import optparse
 import os.path
+import tempfile
 import warnings
 import sys
 
@@ -24,51 +24,126 @@ class StructureError(Exception):
     pass
 
 
-def validate_structure(*docs):
-    def iselement(e): return isinstance(e, sfm.Element)
-
-    def _e(name, args, children):
-        return (name, [], filter(iselement, children))
-
-    def _t(t): return ''
-
-    def op(a, b):
-        if a != b:
-            raise StructureError(b.source)
-        return a
-    return reduce(op, (sfm.smap(_e, _t, d) for d in docs)) is not None
+interleave = sfm.text_properties('paragraph', 'publishable', 'vernacular')
+
+
+class streamparser(usfm.parser):
+    '''
+    A USFM parser that yields container elements, such as \\id and \\c,
+    before their content is parsed, leaving it to be pulled from the
+    element's stream attribute. Paragraphs to be interleaved, and everything
+    in them, are parsed whole as normal, so only one of those per document
+    is ever in memory. Notes are parsed whole too, as footnote
+    canonicalisation rewrites a note's content once it is parsed.
+    '''
+    def _subnode(self, e, content):
+        if interleave(e) or e.meta.get('StyleType') == 'Note' \
+                or not (e.parent is None or hasattr(e.parent, 'stream')):
+            yield from super()._subnode(e, content)
+            return
+        e.stream = content
+        yield e
+        for _ in content:
+            pass
+
+
+def children(e):
+    return chain(e, getattr(e, 'stream', ()))
+
+
+def _relabel(tag, e):
+    if isinstance(e, sfm.Element):
+        for child in e:
+            _relabel(tag, child)
+        e.name += f'{opts.seperator!s}{tag!s}'
+
+
+def _next_element(nodes, source):
+    for n in nodes:
+        if isinstance(n, sfm.Element):
+            return n
+    raise StructureError(source)
+
+
+def _weave(tags, first, others):
+    '''
+    Walk the children of first and the elements in the other documents'
+    matching nodes in lock-step, yielding (node, text) output fragments.
+    Text outside interleaved paragraphs is taken from the first document.
+    '''
+    others = [(iter(children(o)), o.pos) for o in others]
+    for e in children(first):
+        if not isinstance(e, sfm.Element):
+            yield e, e
+            continue
+        es = [_next_element(i, pos) for i, pos in others]
+        if any(o.name != e.name for o in es):
+            raise StructureError(e.pos)
+        if interleave(e):
+            for tag, p in zip(tags, (e, ) + tuple(es)):
+                _relabel(tag, p)
+                yield p, sfm.generate([p])
+        else:
+            yield e, ''.join(_generate(e, _weave(tags, e, es)))
+    for i, pos in others:
+        if any(isinstance(n, sfm.Element) for n in i):
+            raise StructureError(pos)
+
+
+def _generate(e, body):
+    '''
+    Incrementally format e around its body fragments, following the same
+    rules as sfm.generate().
+    '''
+    body = iter(body)
+    first = next(body, None)
+    if not e.name:
+        for _ in body:
+            pass
+        return
+    styletype = e.meta['StyleType']
+    parent_styletype = e.parent and e.parent.meta['StyleType']
+    nested = '+' if 'nested' in e.annotations \
+                    or parent_styletype == 'Character' else ''
+    sep = ''
+    if first:
+        node, text = first
+        if styletype == 'Paragraph' \
+                and isinstance(node, sfm.Element) \
+                and node.meta['StyleType'] == 'Paragraph':
+            sep = os.linesep
+        elif not text.startswith(('\r\n', '\n')):
+            sep = ' '
+    elif styletype == 'Character':
+        sep = ' '
+    elif styletype == 'Paragraph':
+        sep = os.linesep
+    yield f"\\{nested}{' '.join([e.name] + e.args)}{sep}"
+    if first:
+        yield first[1]
+        for _, text in body:
+            yield text
+    if 'implicit-closed' not in e.annotations:
+        end = e.meta.get('Endmarker', '') or ''
+        if end:
+            yield f"\\{nested}{end}"
 
 
 def merge(tags, *docs):
-    pred = sfm.text_properties('paragraph', 'publishable', 'vernacular')
+    '''
+    Interleave parsed document streams, validating their structure matches
+    as it goes. Returns an iterator over output text fragments.
+    '''
     assert len(tags) == len(docs), 'not enough tags for supplied documents'
-
-    def _relabel(tag, e):
-        if isinstance(e, sfm.Element):
-            for child in e:
-                _relabel(tag, child)
-            e.name += f'{opts.seperator!s}{tag!s}'
-        else:
-            return e
-
-    def _merge(e, *es):
-        if isinstance(e, sfm.Element):
-            if pred(e):
-                cs = (e, ) + es
-                for child in cs:
-                    _relabel(tags, child)
-                return cs
-            else:
-                e = sfm.Element(
-                    e.name, e.pos, e.args,
-                    content=chain.from_iterable(map(_merge, e, *es)),
-                    meta=e.meta)
-                for child in e:
-                    setattr(child, 'parent', e)
-                return [e]
-        else:
-            return [e]
-    return chain.from_iterable(map(_merge, *docs))
+    root = sfm.Element(None)
+    first, *others = docs
+    root.stream = first
+    roots = []
+    for d in others:
+        r = sfm.Element(None)
+        r.stream = d
+        roots.append(r)
+    return (text for _, text in _weave(tags, root, roots))
 
 
 if __name__ == '__main__':
@@ -134,23 +209,26 @@ if __name__ == '__main__':
             opts.tags = range(1, len(args))
     else:
         opts.tags = [tag.strip() for tag in opts.tags.split(', ')]
-    output = codecs.open(os.path.expanduser(args[0]),
-                         mode='w',
-                         encoding='utf_8_sig')
+    # The merge is written as it is made, so write it to a temporary file
+    # and only replace the output once it is complete.
+    output_path = os.path.expanduser(args[0])
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(output_path)), suffix='.tmp')
+    output = open(fd, mode='w', encoding='utf_8_sig')
     paths = chain.from_iterable(map(glob.iglob, args[1:]))
-    files = (codecs.open(p, mode='r', encoding='utf_8_sig') for p in paths)
     try:
+        files = [codecs.open(p, mode='r', encoding='utf_8_sig')
+                 for p in paths]
         with warnings.catch_warnings():
             warnings.simplefilter(
                 "always" if opts.warnings else "ignore",
                 SyntaxWarning)
-            docs = [list(usfm.parser(stylesheet=opts.stylesheet,
-                                     error_level=opts.error_level))
+            docs = [streamparser(f,
+                                 stylesheet=opts.stylesheet,
+                                 error_level=opts.error_level)
                     for f in files]
-
-            validate_structure(*docs)
-
-            output.write(sfm.generate(merge(opts.tags, *docs)))
+            for text in merge(opts.tags, *docs):
+                output.write(text)
     except IOError as err:
         sys.stderr.write(parser.expand_prog_name(
             f'%prog: IO error: {err!s}\n'))
@@ -159,3 +237,14 @@ if __name__ == '__main__':
         sys.stderr.write(parser.expand_prog_name(
             '%prog: Structure error: A USFM file does not match the others\n'))
         sys.exit(3)
+    else:
+        output.close()
+        # mkstemp makes the file private; give it the usual permissions.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, output_path)
+    finally:
+        if not output.closed:
+            output.close()
+            os.remove(tmp)
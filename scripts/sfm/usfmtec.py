@@ -12,8 +12,9 @@ Tim Eves provided the concordance program on which this is based.
 '''
 
 from palaso.sfm import usfm, style, Element, Text, generate
-from palaso.teckit.engine import Converter, Mapping
-from itertools import groupby, chain
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, chain, islice
 import csv
 import codecs
 import glob
@@ -22,6 +23,7 @@ import os.path
 import re
 import warnings
 import sys
+import time
 import unicodedata
 
 
@@ -42,6 +44,8 @@ word_cat = {
 
 isletters = ""
 
+run_re = re.compile(r'[^\x00-\x1f]+')
+
 
 def sfmmap(elements, elemente, textf, doc):
     def _g(e):
@@ -71,9 +75,44 @@ def aswords(txt):
     return res
 
 
+class trie(object):
+    ''' A token level trie. Finds every key that prefixes a sequence in a
+        single walk, however many keys it holds. '''
+    def __init__(self):
+        self.root = {}
+
+    def _node(self, key):
+        node = self.root
+        for t in key:
+            node = node.setdefault(t, {})
+        return node
+
+    def __setitem__(self, key, value):
+        self._node(key)[None] = value
+
+    def __bool__(self):
+        return bool(self.root)
+
+    def setdefault(self, key, value):
+        return self._node(key).setdefault(None, value)
+
+    def prefixes(self, seq):
+        ''' yields (length, value) for each key prefixing seq, shortest
+            first '''
+        node = self.root
+        for n, t in enumerate(seq, 1):
+            node = node.get(t)
+            if node is None:
+                return
+            if None in node:
+                yield n, node[None]
+
+
 class notec(object):
     def convert(self, txt, **kw): return txt
 
+    def convert_many(self, txts, **kw): return list(txts)
+
 
 class pyconverter(object):
     def __init__(self, fname, fnname=None):
@@ -88,6 +127,9 @@ class pyconverter(object):
     def convert(self, txt, **kw):
         return self.fn(txt)
 
+    def convert_many(self, txts, **kw):
+        return [self.fn(t) for t in txts]
+
 
 class usfm_transducer(object):
 
@@ -104,10 +146,11 @@ class usfm_transducer(object):
         self.tags = {}
         self.dict = {}
         self.phrases = {}
-        self.phrase_keys = {}
+        self.phrase_keys = trie()
         self.morphs = {}
-        self.morph_keys = ''
+        self.morph_keys = trie()
         self.morphid = '!'
+        self.pending = None
         if opts.capitaltags:
             self.ctags = set(opts.capitaltags.split())
         else:
@@ -122,26 +165,24 @@ class usfm_transducer(object):
             self.normal = None
 
     def load_dict(self, fname, incol, outcol, tagcol=-1, binary=False):
-        morph_keys = []
         fh = open(fname, 'rt', encoding='latin_1' if binary else 'utf_8_sig')
         entries = csv.reader(fh, skipinitialspace=True)
         maxcol = max(incol, outcol, tagcol)
-        for e in entries:
-            if len(e) <= maxcol or (len(e[0]) and e[0][0] == "#"):
-                continue
-            k = self.enc.convert(e[incol], finished=True).strip()
+        entries = [e for e in entries
+                   if len(e) > maxcol and not (len(e[0]) and e[0][0] == "#")]
+        keys = self.enc.convert_many(self.encode_input(e[incol])
+                                     for e in entries)
+        for e, k in zip(entries, keys):
+            k = k.strip()
             if k.find(self.morphid) != -1:     # has stem marker
-                if k[0] != self.morphid:
-                    mk = '^' + k
-                else:
-                    mk = k[1:]
+                at_start = k[0] != self.morphid
+                if not at_start:
                     k = k[1:]
-                if k[-1] != self.morphid:
-                    mk = mk + '$'
-                else:
+                at_end = k[-1] != self.morphid
+                if not at_end:
                     k = k[0:-1]
-                    mk = mk[0:-1]
-                morph_keys.append(mk)
+                self.morph_keys.setdefault([c.lower() for c in k], []) \
+                    .append((k, at_start, at_end))
                 self.morphs[k] = e[outcol].strip()
             elif len(list(filter(isword, k))) != len(k):
                 self.phrases[k] = e[outcol].strip()
@@ -149,17 +190,36 @@ class usfm_transducer(object):
                 self.dict[k] = e[outcol].strip()
             if tagcol >= 0 and e[tagcol]:  # has tag constraints
                 self.tags[k] = set(e[tagcol].split())
-        morph_keys.sort(key=len)
-        self.morph_keys = "|".join(morph_keys)
-        phrase_keys = sorted(self.phrases.keys(), key=len)
-        for k in phrase_keys:
-            p = aswords(k)
-            if p[0] in self.phrase_keys:
-                self.phrase_keys[p[0]].append(p)
-            else:
-                self.phrase_keys[p[0]] = [p]
+        for k in self.phrases:
+            self.phrase_keys[aswords(k)] = k
         fh.close()
 
+    def replace_morphs(self, wd, parent_node):
+        ''' Replace morphs in a word, scanning left to right and taking the
+            shortest morph at each position that satisfies its anchoring and
+            tag constraints. '''
+        def _allowed(k):
+            return k not in self.tags or parent_node.name in self.tags[k]
+
+        folded = [c.lower() for c in wd]
+        res = []
+        i = 0
+        while i < len(wd):
+            for n, keys in self.morph_keys.prefixes(islice(folded, i, None)):
+                end = i + n
+                k = next((k for k, at_start, at_end in keys
+                          if (i == 0 or not at_start)
+                          and (end == len(wd) or not at_end)
+                          and _allowed(k)), None)
+                if k is not None:
+                    res.append(self.morphs[k])
+                    i = end
+                    break
+            else:
+                res.append(wd[i])
+                i += 1
+        return ''.join(res)
+
     def element_start(self, node):
         try:
             if node.meta.get('StyleType') == 'Note':
@@ -177,9 +237,36 @@ class usfm_transducer(object):
             e.args = ("Element: %s at %r" % (node.name, node.pos), )
             raise e
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(enc=None, tnode=None, pending=None)
+        return state
+
+    def reset(self):
+        self.caps = [1]
+        self.pending = None
+
+    def convertible(self, tnode):
+        return not (tnode.parent
+                    and not (set(tnode.parent.meta['TextProperties'])
+                             & set(('publishable', 'vernacular'))))
+
+    def batch_convert(self, doc, blocksize=1 << 16):
+        ''' Convert all the text runs convert_node() will see in a few large
+            calls, queuing the results for convert() in document order. '''
+        def _runs(e):
+            if isinstance(e, Element):
+                return chain.from_iterable(map(_runs, e))
+            elif self.convertible(e):
+                return run_re.findall(e)
+            return []
+
+        runs = [self.encode_input(r) for r in chain.from_iterable(
+                                                        map(_runs, doc))]
+        self.pending = deque(self.enc.convert_many(runs, blocksize=blocksize))
+
     def convert_node(self, tnode):
-        if tnode.parent and not (set(tnode.parent.meta['TextProperties'])
-                                 & set(('publishable', 'vernacular'))):
+        if not self.convertible(tnode):
             return tnode
         if (tnode.parent
             and ((tnode.parent.meta.get('StyleType') == 'Paragraph'
@@ -187,17 +274,20 @@ class usfm_transducer(object):
                  or tnode.parent.name in self.ctags)):
             self.caps[-1] = 1
         self.tnode = tnode
-        res = re.sub(r'[^\x00-\x1f]+', self.convert, tnode)
+        res = run_re.sub(self.convert, tnode)
         if self.normal:
             res = unicodedata.normalize(self.normal, res)
         return res
 
+    def encode_input(self, txt):
+        return txt.encode('latin_1') if self.opts.binary else txt
+
     def convert(self, match):
-        if self.opts.binary:
-            input = match.group(0).encode('latin_1')
+        if self.pending is not None:
+            res = self.pending.popleft()
         else:
-            input = match.group(0)
-        res = self.enc.convert(input, finished=True)
+            res = self.enc.convert(self.encode_input(match.group(0)),
+                                   finished=True)
         if res.strip() == '':
             return res
         if self.caps[-1]:
@@ -213,24 +303,18 @@ class usfm_transducer(object):
         rlist = aswords(res)
         res = ""
         while len(rlist) > 0:
-            rlen = len(rlist)
             wd = rlist.pop(0)
             if wd:
                 case = wd[0].isupper()
                 wd = wd[0].lower() + wd[1:]
                 found = False
-                if wd in self.phrase_keys:
-                    for p in self.phrase_keys[wd]:
-                        if len(p) <= rlen and p[1:] == rlist[0:len(p)-1]:
-                            s = "".join(p)
-
-                            if s in self.tags \
-                                    and parent_node.name not in self.tags[s]:
-                                continue
-                            del rlist[0:len(p)-1]
-                            wd = self.phrases[s]
-                            found = True
-                            break
+                for n, s in self.phrase_keys.prefixes(chain((wd,), rlist)):
+                    if s in self.tags and parent_node.name not in self.tags[s]:
+                        continue
+                    del rlist[0:n-1]
+                    wd = self.phrases[s]
+                    found = True
+                    break
                 if (not found
                     and wd in self.dict
                     and (wd not in self.tags
@@ -238,14 +322,7 @@ class usfm_transducer(object):
                     wd = self.dict[wd] or wd
                     found = True
                 elif self.morph_keys and not found:
-                    def _g(m):
-                        g = m.group(1)
-                        if g not in self.tags \
-                                or parent_node.name in self.tags[wd]:
-                            g = self.morphs[g]
-                        return g
-
-                    wd = re.sub(f'(?iu)({self.morph_keys})', _g, wd)
+                    wd = self.replace_morphs(wd, parent_node)
                 if case:
                     wd = wd[0].upper() + wd[1:]
             if len(rlist):
@@ -286,35 +363,77 @@ class usfm_transducer(object):
         return res
 
 
-def transduce(fname, opts):
-    def identity_mkr(*args): return args
+def load_mapping(source):
+    # TECkit is only needed, and only loaded, when a .tec file is used
+    from palaso.teckit.engine import Mapping
+    return Mapping(source)
 
-    conv = usfm_transducer(case=opts.capitalise, opts=opts)
+
+def load_converter(opts, mapping=None):
     if opts.tec:
-        tec = Converter(Mapping(opts.tec), forward=not opts.reverse)
-        conv.enc = tec
+        from palaso.teckit.engine import Converter
+        return Converter(mapping or load_mapping(opts.tec),
+                         forward=not opts.reverse)
     elif opts.python:
-        conv.enc = pyconverter(opts.python, opts.pythonfunc)
+        return pyconverter(opts.python, opts.pythonfunc)
+    return notec()
 
+
+def load_transducer(opts, mapping=None):
+    conv = usfm_transducer(case=opts.capitalise, opts=opts)
+    conv.enc = load_converter(opts, mapping)
     if opts.dict:
         conv.load_dict(opts.dict, opts.dictinput, opts.dictoutput,
                        tagcol=opts.dicttag, binary=opts.binary)
+    return conv
+
+
+def transduce(fname, opts, conv=None):
+    if conv is None:
+        conv = load_transducer(opts)
+    conv.reset()
 
     infh = codecs.open(fname, 'r', 'latin_1' if opts.binary else 'utf_8_sig')
     try:
+        doc = scrparser(infh,
+                        stylesheet=opts.stylesheet,
+                        error_level=opts.error_level)
+        if opts.batch:
+            doc = list(doc)
+            conv.batch_convert(doc)
         doc = sfmmap(conv.element_start, conv.element_end, conv.convert_node,
-                     scrparser(infh,
-                               stylesheet=opts.stylesheet,
-                               error_level=opts.error_level))
-    except SyntaxError as err:
-        sys.stderr.write(parser.expand_prog_name(
-            f'%prog: failed to parse USFM: {err!s}\n'))
-        sys.exit(1)
+                     doc)
     finally:
         infh.close()
     return doc
 
 
+_worker = None
+
+
+def init_worker(opts, mapping, conv):
+    ''' Set up the transducer a process uses for every book it converts.
+        conv arrives with its dictionary tables already built, so at most
+        the converter needs recreating from the compiled mapping. '''
+    global _worker, isletters
+    if opts.letters:
+        isletters = uni_unescape(opts.letters)
+    warnings.simplefilter("always" if opts.warnings else "ignore",
+                          SyntaxWarning)
+    if conv.enc is None:
+        conv.enc = load_converter(opts, mapping and load_mapping(mapping))
+    _worker = (opts, conv)
+
+
+def convert_book(job):
+    opts, conv = _worker
+    start = time.perf_counter()
+    res = generate(transduce(job[0], opts, conv))
+    with codecs.open(job[1], "w", "utf-8") as ofh:
+        ofh.write(res)
+    return job[0], time.perf_counter() - start
+
+
 if __name__ == '__main__':
     parser = optparse.OptionParser(
         usage=f'%prog [options] <SFM FILE>\n{__doc__}')
@@ -377,6 +496,10 @@ if __name__ == '__main__':
                       help="TECKit .tec file to use for conversion")
     parser.add_option("-r", "--reverse", action="store_true",
                       help="Run .tec file in reverse")
+    parser.add_option(
+        "--no-batch", action="store_false", dest="batch", default=True,
+        help="Convert each text run with a separate call to the converter,"
+             " instead of batching up all the runs in a book")
     parser.add_option("--normalize", action="store",
                       help="Unicode normalize converted text [c, d, kc, kd]")
     parser.add_option("-v", "--verbose", action='store_true', default=False,
@@ -400,6 +523,9 @@ if __name__ == '__main__':
         metavar='PATH', default=None,
         help='User stylesheet to add/override marker definitions to the'
              ' default USFM stylesheet')
+    parser.add_option(
+        "-j", "--jobs", action="store", type="int", default=1,
+        help="Number of books to convert in parallel [%default]")
     parser.add_option("-V", "--version", action="store_true",
                       help="Print program version and exit")
 
@@ -446,15 +572,31 @@ if __name__ == '__main__':
 
     try:
         with warnings.catch_warnings():
-            warnings.simplefilter("always" if opts.warnings
-                                  else "ignore", SyntaxWarning)
-            for job in work:
-                res = generate(transduce(job[0], opts))
-                ofh = codecs.open(job[1], "w", "utf-8")
-                ofh.write(res)
-                ofh.close()
-
+            mapping = load_mapping(opts.tec) if opts.tec else None
+            conv = load_transducer(opts, mapping)
+            start = time.perf_counter()
+            if opts.jobs > 1:
+                with ProcessPoolExecutor(
+                        opts.jobs,
+                        initializer=init_worker,
+                        initargs=(opts, mapping and bytes(mapping),
+                                  conv)) as pool:
+                    timings = list(pool.map(convert_book, work))
+            else:
+                init_worker(opts, mapping, conv)
+                timings = list(map(convert_book, work))
+            total = time.perf_counter() - start
+    except SyntaxError as err:
+        sys.stderr.write(parser.expand_prog_name(
+            f'%prog: failed to parse USFM: {err!s}\n'))
+        sys.exit(1)
     except IOError as err:
         sys.stderr.write(
             parser.expand_prog_name(f'%prog: IO error: {err!s}\n'))
         sys.exit(2)
+
+    if opts.verbose or opts.jobs > 1:
+        for fname, t in timings:
+            sys.stdout.write(f'{fname}: {t:.3f}s\n')
+        sys.stdout.write(f'{len(timings)} books in {total:.3f}s'
+                         f' ({sum(t for _, t in timings):.3f}s converting)\n')
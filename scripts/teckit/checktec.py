@@ -54,7 +54,7 @@ def main(cmd, map_src, test_data, *argv):
     try:
         src  = open(map_src,'rb').read()
         with stage('compiling %r' % map_src):
-            mapping = compiler.compile(src)
+            mapping = compiler.compile(src, cache=compiler.MappingCache())
     except IOError as err:
         sys.stderr.write("%s: cannot read TECKit source: %s: '%s'\n" % (cmd, err.strerror, err.filename))
         sys.exit(2)
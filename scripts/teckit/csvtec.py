@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from palaso.teckit.engine import Converter, Mapping
+from palaso.teckit.engine import Converter, Flags, Mapping
 import csv
 from optparse import OptionParser
 
@@ -16,11 +16,16 @@ parser.add_option('--codepage',action='store',help="Convert Unicode to bytes usi
 if not opts.codepage : opts.codepage = 'cp1252'
 
 eng = Converter(Mapping(opts.teckit), forward = not opts.reverse)
-rdr = csv.reader(open(argv[0], 'rb'))
-wtr = csv.writer(open(argv[1], 'wb'))
-for row in rdr :
-    for c in opts.column :
-        chrs = row[c]
-        if opts.unicode : chrs = chrs.decode('utf-8').encode(opts.codepage)
-        row[c] = eng.convert(row[c].decode('utf-8').encode('cp1252'), finished=True).encode('utf-8')
-    wtr.writerow(row)
+rdr = csv.reader(open(argv[0], 'r', encoding='utf-8', newline=''))
+wtr = csv.writer(open(argv[1], 'w', encoding='utf-8', newline=''))
+rows = list(rdr)
+
+# Convert all the cells in one batch rather than a call per cell.
+cells = [(row, c) for row in rows for c in opts.column if c < len(row)]
+if Flags.unicode in eng.sourceFlags :
+    texts = [row[c] for row, c in cells]
+else :
+    texts = [row[c].encode(opts.codepage) for row, c in cells]
+for (row, c), res in zip(cells, eng.convert_many(texts)) :
+    row[c] = res if isinstance(res, str) else res.decode(opts.codepage)
+wtr.writerows(rows)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for the palaso.teckit engine and codec.
+
+throughput: forward and reverse conversion rates in characters per second
+for several input sizes and chunk sizes, through TECkit and through the
+translation table fast path where the mapping has one.
+
+overhead: the cost of a single call into TECkit, from converting one
+character at a time.
+
+fuzz: convert random byte strings forward, back and forward again in
+parallel, reporting any whose second conversion differs from the first.
+
+errors: time the registered codec's error handling on text where every other
+character is unmapped, at doubling input sizes. The time per character
+should stay roughly constant as the input grows.
+
+Input for the throughput benchmark is random bytes unless a corpus in the
+mapping's byte encoding is given.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from palaso.teckit import engine, register
+from palaso.teckit._engine import Option
+import argparse
+import codecs
+import os
+import random
+import time
+from pathlib import Path
+
+__version__ = '0.1'
+__date__ = '19 October 2026'
+
+# A private use character from the last plane, which no mapping is likely
+# to cover.
+UNMAPPED = '\U0010fffd'
+
+
+def timed(fn, *args, **kwds):
+    start = time.perf_counter()
+    res = fn(*args, **kwds)
+    return time.perf_counter() - start, res
+
+
+def mapped_text(mapping):
+    '''Characters the mapping's reverse direction is known to accept.'''
+    dec = engine.Converter(mapping, forward=True, fast=False)
+    enc = engine.Converter(mapping, forward=False, fast=False)
+    text = dec.convert(bytes(range(0x20, 0x7f)), finished=True)
+    good = []
+    for c in text:
+        try:
+            enc.reset()
+            enc.convert(c, finished=True,
+                        options=Option.DontUseReplacementChar)
+        except UnicodeError:
+            continue
+        good.append(c)
+    return ''.join(good) or ' '
+
+
+def corpus(args, size):
+    if args.corpus:
+        data = args.corpus.read_bytes()
+        return (data * (size//len(data) + 1))[:size]
+    rng = random.Random(args.seed)
+    return bytes(rng.randrange(0x20, 0x100) for _ in range(size))
+
+
+def convert_chunked(conv, data, chunk):
+    conv.reset()
+    if not chunk:
+        return conv.convert(data, finished=True)
+    res = [conv.convert(data[i:i+chunk]) for i in range(0, len(data), chunk)]
+    res.append(conv.flush())
+    return type(res[0])().join(res)
+
+
+def rate(secs, n):
+    return f'{n/secs:12,.0f}' if secs else f'{"-":>12}'
+
+
+def bench_throughput(args, mapping):
+    paths = [('ffi', False)] + ([('fast', True)] if mapping.tables else [])
+    print(f'{"path":4} {"size":>9} {"chunk":>7} {"fwd chars/s":>12}'
+          f' {"rev chars/s":>12}')
+    for name, fast in paths:
+        dec = engine.Converter(mapping, forward=True, fast=fast)
+        enc = engine.Converter(mapping, forward=False, fast=fast)
+        for size in args.sizes:
+            data = corpus(args, size)
+            for chunk in args.chunks:
+                fwd, text = timed(convert_chunked, dec, data, chunk)
+                rev, _ = timed(convert_chunked, enc, text, chunk)
+                print(f'{name:4} {size:9d} {chunk or "-":>7}'
+                      f' {rate(fwd, len(data))} {rate(rev, len(text))}')
+
+
+def bench_overhead(args, mapping):
+    dec = engine.Converter(mapping, forward=True, fast=False)
+    data = corpus(args, args.calls)
+    one = [data[i:i+1] for i in range(len(data))]
+    per_char, _ = timed(lambda: [dec.convert(c) for c in one])
+    dec.reset()
+    whole, _ = timed(dec.convert, data)
+    print(f'{args.calls} calls: {per_char/args.calls*1e6:.3f} us/call,'
+          f' one call: {whole*1e6:.1f} us,'
+          f' overhead: {(per_char - whole)/args.calls*1e6:.3f} us/call')
+
+
+_fuzz_state = None
+
+
+def init_fuzz(mapping):
+    global _fuzz_state
+    mapping = engine.Mapping(mapping)
+    _fuzz_state = (engine.Converter(mapping, forward=True),
+                   engine.Converter(mapping, forward=False))
+
+
+def fuzz_batch(job):
+    seed, count, length = job
+    dec, enc = _fuzz_state
+    rng = random.Random(seed)
+    failures = []
+    for _ in range(count):
+        data = bytes(rng.randrange(0x100)
+                     for _ in range(rng.randrange(1, length + 1)))
+        text = convert_chunked(dec, data, 0)
+        again = convert_chunked(dec, convert_chunked(enc, text, 0), 0)
+        if again != text:
+            failures.append((data, text, again))
+    return count, failures
+
+
+def bench_fuzz(args, mapping):
+    batches = [(args.seed + i, args.batch, args.length)
+               for i in range(0, args.count, args.batch)]
+    start = time.perf_counter()
+    total = 0
+    failures = []
+    with ProcessPoolExecutor(args.jobs, initializer=init_fuzz,
+                             initargs=(bytes(mapping),)) as pool:
+        for n, fails in pool.map(fuzz_batch, batches):
+            total += n
+            failures.extend(fails)
+    secs = time.perf_counter() - start
+    print(f'{total} round trips in {secs:.2f}s, {len(failures)} failed')
+    for data, text, again in failures[:args.show]:
+        print(f'  {data!r}: {text!r} != {again!r}')
+    return 1 if failures else 0
+
+
+def bench_errors(args, mapping):
+    # Go through the registered codec, as applications do, which is also
+    # what the teckitreplace handler looks the mapping up in.
+    register(mapping)
+    name = f'{mapping.lhsName}<->{mapping.rhsName}'.lower()
+    good = mapped_text(mapping)
+    print(f'{"chars":>10} {"errors":>8} {"seconds":>9} {"us/char":>8}')
+    for size in args.sizes:
+        text = ''.join(good[i % len(good)] + UNMAPPED
+                       for i in range(size//2))
+        secs, _ = timed(codecs.encode, text, name, args.errors)
+        print(f'{len(text):10d} {size//2:8d} {secs:9.4f}'
+              f' {secs/len(text)*1e6:8.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mapping', metavar='TEC', type=engine.Mapping,
+                        help='Compiled TECkit mapping (.tec) to benchmark')
+    parser.add_argument(
+        '-c', '--corpus', metavar='FILE', type=Path, default=None,
+        help='Sample text in the byte encoding to use as input')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Random number seed for generated input. default: %(default)s')
+    sub = parser.add_subparsers(dest='bench', required=True)
+    throughput = sub.add_parser('throughput', help='conversion rates')
+    throughput.add_argument(
+        '-s', '--sizes', type=int, nargs='+',
+        default=[1 << 10, 1 << 16, 1 << 22],
+        help='Input sizes in bytes. default: %(default)s')
+    throughput.add_argument(
+        '-k', '--chunks', type=int, nargs='+', default=[0, 4096],
+        help='Sizes to feed the input in, 0 for all at once.'
+             ' default: %(default)s')
+    throughput.set_defaults(run=bench_throughput)
+    overhead = sub.add_parser('overhead', help='per call cost')
+    overhead.add_argument(
+        '-n', '--calls', type=int, default=100000,
+        help='Number of single character calls. default: %(default)s')
+    overhead.set_defaults(run=bench_overhead)
+    fuzz = sub.add_parser('fuzz', help='round trip consistency')
+    fuzz.add_argument(
+        '-n', '--count', type=int, default=100000,
+        help='Number of random strings. default: %(default)s')
+    fuzz.add_argument(
+        '-l', '--length', type=int, default=32,
+        help='Maximum random string length. default: %(default)s')
+    fuzz.add_argument(
+        '-b', '--batch', type=int, default=1000,
+        help='Strings per worker task. default: %(default)s')
+    fuzz.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count(),
+        help='Worker processes. default: one per CPU')
+    fuzz.add_argument(
+        '--show', type=int, default=10,
+        help='Number of failures to print. default: %(default)s')
+    fuzz.set_defaults(run=bench_fuzz)
+    errors = sub.add_parser('errors', help='dense unmapped character'
+                                           ' handling')
+    errors.add_argument(
+        '-e', '--errors', default='replace',
+        help='Codec error handler to use. default: %(default)s')
+    errors.add_argument(
+        '-s', '--sizes', type=int, nargs='+',
+        default=[1 << n for n in range(10, 17)],
+        help='Input sizes in characters. default: 1K to 64K doubling')
+    errors.set_defaults(run=bench_errors)
+
+    args = parser.parse_args()
+    parser.exit(args.run(args, args.mapping) or 0)
@@ -0,0 +1,3 @@
+import importlib.resources
+
+pkg_data = importlib.resources.files(__name__) / 'data'
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from palaso.kmn.depends import Manifest, kmn_sources
+
+
+class DependsTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def write(self, name, text):
+        path = self.dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+        return path
+
+
+class KmnSourcesTestCase(DependsTestCase):
+    def test_includes(self):
+        kmn = self.write('main.kmn', 'include("sub/part.kmn")\n'
+                                     "store(&includecodes) 'codes.txt'\n"
+                                     '+ "a" > "b"\n')
+        self.write('sub/part.kmn', 'include "more.kmn"\n')
+        self.write('sub/more.kmn', 'include("../main.kmn")\n')
+        self.write('codes.txt', '')
+        self.assertEqual(
+            sorted(map(str, kmn_sources(kmn))),
+            sorted(str(self.dir / p) for p in ('main.kmn', 'codes.txt',
+                                               'sub/part.kmn',
+                                               'sub/more.kmn')))
+
+    def test_missing_include(self):
+        kmn = self.write('main.kmn', 'INCLUDE("absent.kmn")\n')
+        self.assertEqual(kmn_sources(kmn),
+                         [kmn, self.dir / 'absent.kmn'])
+
+
+class ManifestTestCase(DependsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.input = self.write('in.kmn', 'one')
+        self.output = self.write('out.xml', 'made')
+        self.manifest = Manifest(self.dir / 'manifest.json')
+        self.manifest.record(self.output, [self.input], ('font', 12))
+
+    def current(self, settings=('font', 12)):
+        # A fresh Manifest rereads the inputs rather than reusing hashes
+        m = Manifest(self.dir / 'manifest.json')
+        m.outputs = self.manifest.outputs
+        return m.current(self.output, [self.input], settings)
+
+    def test_current(self):
+        self.assertTrue(self.current())
+
+    def test_content_changed(self):
+        os.utime(self.input, (0, 0))
+        self.assertTrue(self.current())
+        self.input.write_text('two', encoding='utf-8')
+        self.assertFalse(self.current())
+
+    def test_settings_changed(self):
+        self.assertFalse(self.current(('font', 14)))
+
+    def test_output_removed(self):
+        self.output.unlink()
+        self.assertFalse(self.current())
+
+    def test_unrecorded(self):
+        self.manifest.forget(self.output)
+        self.assertFalse(self.current())
+
+    def test_save(self):
+        self.manifest.save()
+        again = Manifest(self.dir / 'manifest.json')
+        self.assertEqual(again.outputs, self.manifest.outputs)
+        self.assertTrue(again.current(self.output, [self.input],
+                                      ('font', 12)))
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()),
+                         ['in.kmn', 'manifest.json', 'out.xml'])
+
+    def test_save_failure(self):
+        self.manifest.save()
+        saved = (self.dir / 'manifest.json').read_text(encoding='utf-8')
+        self.manifest.record(self.dir / 'other.xml', [self.input])
+        with mock.patch('json.dump', side_effect=ValueError):
+            self.assertRaises(ValueError, self.manifest.save)
+        # The old manifest is untouched and no temporary file is left
+        self.assertEqual((self.dir / 'manifest.json').read_text(
+                         encoding='utf-8'), saved)
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()),
+                         ['in.kmn', 'manifest.json', 'out.xml'])
+
+    def test_other_version(self):
+        (self.dir / 'manifest.json').write_text(
+            json.dumps({'version': -1, 'outputs': {'x': {}}}),
+            encoding='utf-8')
+        self.assertEqual(Manifest(self.dir / 'manifest.json').outputs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import importlib.util
+import unittest
+from pathlib import Path
+
+script = Path(__file__).resolve().parents[2] / 'scripts' / 'kmn' / \
+    'keyman2ldml.py'
+spec = importlib.util.spec_from_file_location('keyman2ldml', script)
+keyman2ldml = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(keyman2ldml)
+
+
+def transform(fr, to, before=None, after=None):
+    res = {'from': fr, 'to': to}
+    if before is not None:
+        res['before'] = before
+    if after is not None:
+        res['after'] = after
+    return res
+
+
+class TransformElementsTestCase(unittest.TestCase):
+    ''' Merging results, as given by the unindexed implementation '''
+    def merge(self, *transforms):
+        t = keyman2ldml.TransformElements()
+        for kw in transforms:
+            t.addElement(**kw)
+        return list(t.asReadable())
+
+    def test_merge_from(self):
+        self.assertEqual(
+            self.merge(transform('ka', 'X'), transform('ga', 'X'),
+                       transform('ta', 'Y'), transform('kb', 'X')),
+            [{'from': '[gk][ab]', 'to': 'X'}, {'from': 'ta', 'to': 'Y'}])
+
+    def test_merge_before(self):
+        self.assertEqual(
+            self.merge(transform('a', 'b', 'xy'), transform('a', 'b', 'xz'),
+                       transform('a', 'b', 'qz'), transform('a', 'c', 'xw'),
+                       transform('a', 'b', 'xy')),
+            [{'before': '[qx][yz]', 'from': 'a', 'to': 'b'},
+             {'before': 'xw', 'from': 'a', 'to': 'c'}])
+
+    def test_merge_after(self):
+        self.assertEqual(
+            self.merge(transform('a', 'b', after='p'),
+                       transform('a', 'b', after='q')),
+            [{'after': '[pq]', 'from': 'a', 'to': 'b'}])
+
+    def test_no_merge(self):
+        # Two differences, or contexts of different shapes, do not merge
+        self.assertEqual(
+            self.merge(transform('a', 'b', 'xy'), transform('a', 'b', 'zz'),
+                       transform('a', 'b', 'x', 'p')),
+            [{'before': 'xy', 'from': 'a', 'to': 'b'},
+             {'before': 'zz', 'from': 'a', 'to': 'b'},
+             {'after': 'p', 'before': 'x', 'from': 'a', 'to': 'b'}])
+
+    def test_identity(self):
+        self.assertEqual(
+            self.merge(transform('a', 'a'), transform('a', 'a', 'x'),
+                       transform('b', 'b', 'x')),
+            [{'from': 'a', 'to': 'a'},
+             {'from': 'a', 'to': 'a'},
+             {'before': 'x', 'from': 'a', 'to': 'a'},
+             {'before': 'x', 'from': 'b', 'to': 'b'},
+             {'before': 'x', 'from': 'b', 'to': 'b'}])
+
+
+class ContextIndexTestCase(unittest.TestCase):
+    def test_find(self):
+        index = keyman2ldml.ContextIndex()
+        for e in (transform('a', 'b', 'xy'), transform('a', 'b', 'xz'),
+                  transform('a', 'b', 'qq'), transform('a', 'b', 'x', 'p'),
+                  transform('a', 'b')):
+            index.add(e)
+        e = transform('a', 'b', 'xy')
+        self.assertEqual(index.find(e, 0), [0])
+        self.assertEqual(index.find(e, 1), [0, 1, 3, 4])
+        index.merged(2)
+        self.assertEqual(index.find(e, 0), [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
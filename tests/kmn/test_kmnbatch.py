@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import importlib.util
+import os
+import tempfile
+import types
+import unittest
+from pathlib import Path
+from unittest import mock
+
+script = Path(__file__).resolve().parents[2] / 'scripts' / 'kmn' / \
+    'kmnbatch.py'
+spec = importlib.util.spec_from_file_location('kmnbatch', script)
+kmnbatch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(kmnbatch)
+
+
+def stdout_tool(argv):
+    print('partial', end='')
+    if argv[-1] == 'fail':
+        raise ValueError('bad keyboard')
+
+
+def file_tool(argv):
+    Path(argv[-1]).write_text('converted', encoding='utf-8')
+    if argv[0] == 'fail':
+        raise SystemExit(2)
+
+
+class ConvertTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.out = Path(self._dir.name, 'kbd.klc')
+        self.out.write_text('previous', encoding='utf-8')
+        tools = {'kmn2klc': types.SimpleNamespace(main=stdout_tool),
+                 'keyman2ldml': types.SimpleNamespace(main=file_tool)}
+        patch = mock.patch.dict(kmnbatch._tools, tools)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def convert(self, tool, argv):
+        return kmnbatch.convert((tool, argv, 'kbd.kmn', str(self.out)))
+
+    def assertOutput(self, text):
+        self.assertEqual(self.out.read_text(encoding='utf-8'), text)
+        self.assertEqual(os.listdir(self._dir.name), [self.out.name])
+
+    def test_stdout(self):
+        self.assertIsNone(self.convert('kmn2klc', ['ok'])['error'])
+        self.assertOutput('partial')
+
+    def test_stdout_failure(self):
+        res = self.convert('kmn2klc', ['fail'])
+        self.assertEqual(res['error'], 'ValueError: bad keyboard')
+        self.assertOutput('previous')
+
+    def test_file(self):
+        self.assertIsNone(self.convert('keyman2ldml', ['ok'])['error'])
+        self.assertOutput('converted')
+
+    def test_file_failure(self):
+        res = self.convert('keyman2ldml', ['fail'])
+        self.assertEqual(res['error'], 'exit status 2')
+        self.assertOutput('previous')
+
+
+if __name__ == '__main__':
+    unittest.main()
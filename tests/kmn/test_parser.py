@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import tempfile
+import unittest
+from pathlib import Path
+from pprint import pformat
+from palaso.kmn.parser import Parser, ParseCache, Store, load
+
+# The kmfl tests are skipped without the kmfl extension, so read their
+# sample keyboard directly.
+kmfl_data = Path(__file__).resolve().parent.parent / 'kmfl' / 'data'
+
+SAMPLE = r'''c A keyboard using most kinds of statement
+store(&NAME) "Sample"
+store(&VERSION) "10.0"
+begin Unicode > use(main)
+
+store(cons) "kgc" U+0D1A
+store(vowels) 'aeiou'
+store(marks) [SHIFT K_A] dk(acute) beep
+store(both) outs(cons) outs(vowels)
+$keyman: store(keymanonly) "x"
+platform("touch") store(touchonly) "y"
+
+group(main) using keys
++ [K_A] > "a"
++ [SHIFT CTRL K_B] > "B"
+"k" + "h" > "ഖ"
+any(cons) + any(vowels) > index(cons, 1) index(vowels, 2)
+notany(cons) + "~" > context beep
+dk(acute) + "e" > U+00E9
++ "'" > dk(acute)
+"a" dk(acute) + "a" > context(1) "á" outs(marks)
+if(opt = "1") + "z" > set(opt = "0") "Z"
+$keymanonly: + "q" > "Q"
+platform("touch") + "w" > "W"
+nomatch > use(other)
+match > use(post)
+
+group(other) using keys
++ [K_BKSP] > nul
++ any(vowels) > index(vowels, 1) reset(opt)
+
+group(post)
+"aa" > "A"
+'''
+
+
+def unwrap(x):
+    # funcparserlib keeps the result of a skipped parser, wrapped
+    if type(x).__name__ == '_Ignored':
+        return unwrap(x.value)
+    if isinstance(x, (list, tuple)):
+        return type(x)(unwrap(i) for i in x)
+    return x
+
+
+def dump(p):
+    return pformat(unwrap((p.tree, p.allRules, p.uses, p.nomatches,
+                           p.begins, p.allStores, p.allHeaders)))
+
+
+class ParserTestCase(unittest.TestCase):
+    def assertSameParse(self, text, **kwds):
+        self.assertEqual(dump(Parser(text, fast=True, **kwds)),
+                         dump(Parser(text, fast=False, **kwds)))
+
+    def test_fast_matches_funcparserlib(self):
+        self.assertSameParse(SAMPLE)
+        self.assertSameParse(SAMPLE, platform={'ui': 'touch'})
+
+    def test_fast_matches_funcparserlib_sample_file(self):
+        text = (kmfl_data / 'kyu-mymr.kmn').read_text(encoding='utf-8-sig')
+        self.assertSameParse(text)
+
+    def test_groups(self):
+        p = Parser(SAMPLE)
+        self.assertEqual(p.begins, {'unicode': 'main'})
+        self.assertEqual(p.nomatches, {'main': {'other'}})
+        self.assertEqual(p.uses, {'main': {'post'}})
+        self.assertEqual(len(p.allRules['post']), 1)
+
+    def test_store_reset(self):
+        # Stores register themselves by name, so an unrelated keyboard read
+        # after a reset must not see the last one's.
+        Parser(SAMPLE)
+        self.assertIn('cons', Store.allStores)
+        Store.reset()
+        p = Parser('store(other) "z"\n')
+        self.assertEqual(set(Store.allStores), {'other'})
+        self.assertEqual(Store.allStores['other'].flatten().values,
+                         p.allStores['other'].flatten().values)
+
+
+class ParseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.kmn = Path(self.dir.name, 'sample.kmn')
+        self.kmn.write_text(SAMPLE, encoding='utf-8')
+        self.cache = ParseCache(Path(self.dir.name, 'cache'))
+
+    def entries(self):
+        return sorted(self.cache.path.glob('*.pickle'))
+
+    def test_hit(self):
+        first = load(self.kmn, cache=self.cache)
+        entries = self.entries()
+        self.assertEqual(len(entries), 1)
+        again = load(self.kmn, cache=self.cache)
+        self.assertIsNot(again, first)
+        self.assertEqual(dump(again), dump(first))
+        self.assertEqual(self.entries(), entries)
+
+    def test_invalidate(self):
+        load(self.kmn, cache=self.cache)
+        # A changed source or platform is parsed again
+        self.kmn.write_text(SAMPLE + '"b" > "B"\n', encoding='utf-8')
+        changed = load(self.kmn, cache=self.cache)
+        self.assertEqual(len(changed.allRules['post']), 2)
+        load(self.kmn, {'ui': 'touch'}, cache=self.cache)
+        self.assertEqual(len(self.entries()), 3)
+
+    def test_corrupt_entry(self):
+        key = self.cache.key(SAMPLE)
+        self.cache.path.mkdir(parents=True)
+        self.cache.entry(key).write_bytes(b'not a pickle')
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(dump(load(self.kmn, cache=self.cache)),
+                         dump(Parser(SAMPLE)))
+
+    def test_evict(self):
+        load(self.kmn, cache=self.cache)
+        self.cache.max_size = 0
+        self.cache.evict()
+        self.assertEqual(self.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import unittest
+from palaso.kmn import ReverseSearch, coverage_tests
+
+
+class GraphSearch(ReverseSearch):
+    ''' A search over a fixed graph of states rather than keyboard rules '''
+    def __init__(self, graph):
+        super().__init__(None, 0)
+        self.graph = graph
+
+    def successors(self, state):
+        return self.graph.get(state, [])
+
+
+# X is reached from A by key 1 or from B by key 2, A from nothing by key 4
+# or from B by key 3, and B only from A by key 5, so A and B form a cycle.
+CYCLE = {('X',): [(('A',), 1), (('B',), 2)],
+         ('A',): [(('B',), 3), ((), 4)],
+         ('B',): [(('A',), 5)]}
+
+
+class ReverseSearchTestCase(unittest.TestCase):
+    def test_cycles(self):
+        search = GraphSearch(CYCLE)
+        # B is first searched below A, where the cycle back to A is cut,
+        # which must not hide the sequence through B then A from X.
+        self.assertEqual(search.sequences('X'), [(4, 1), (4, 5, 2)])
+        self.assertEqual(search.sequences('B'), [(4, 5)])
+        self.assertEqual(search.sequences('X'), [(4, 1), (4, 5, 2)])
+
+    def test_limit(self):
+        search = GraphSearch(CYCLE)
+        self.assertEqual(search.sequences('X', limit=1), [(4, 1)])
+        self.assertEqual(search.sequences('X', limit=2),
+                         [(4, 1), (4, 5, 2)])
+
+    def test_max_cost(self):
+        search = GraphSearch(CYCLE)
+        self.assertEqual(search.sequences('X', max_cost=2), [(4, 1)])
+        self.assertEqual(search.sequences('X', max_cost=1), [])
+        # A memoised result for a smaller budget is not reused for a larger
+        self.assertEqual(search.sequences('X'), [(4, 1), (4, 5, 2)])
+        self.assertEqual(search.sequences('X', max_cost=2), [(4, 1)])
+
+    def test_no_default_cost(self):
+        # A chain longer than two keystrokes per item is still found
+        chain = {('X',): [(('A',), 1)], ('A',): [(('B',), 2)],
+                 ('B',): [(('C',), 3)], ('C',): [((), 4)]}
+        self.assertEqual(GraphSearch(chain).sequences('X'), [(4, 3, 2, 1)])
+        self.assertEqual(list(GraphSearch(chain).shortest('X')),
+                         [(4, 3, 2, 1)])
+
+    def test_shortest(self):
+        search = GraphSearch(CYCLE)
+        self.assertEqual(list(search.shortest('X')), [(4, 1)])
+        res = list(search.shortest('X', limit=3))
+        self.assertEqual(res[:2], [(4, 1), (4, 5, 2)])
+        self.assertEqual([len(s) for s in res], sorted(len(s) for s in res))
+        self.assertEqual(list(search.shortest('X', limit=3, max_cost=2)),
+                         [(4, 1)])
+
+    def test_passthrough(self):
+        search = ReverseSearch(lambda input, rule, mode: None, 0,
+                               passthrough=True)
+        self.assertEqual(search.sequences([1, 2]), [(1, 2)])
+        self.assertEqual(search.sequences([]), [])
+
+
+class CoverageTestsTestCase(unittest.TestCase):
+    def test_cache_with_jobs(self):
+        # Worker processes cannot share the caller's cache, so it is
+        # refused up front rather than silently ignored.
+        with self.assertRaises(ValueError):
+            coverage_tests(None, jobs=2, cache={})
+
+
+if __name__ == '__main__':
+    unittest.main()
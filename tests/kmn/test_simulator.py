@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import unittest
+from palaso.kmn.parser import Parser
+from palaso.kmn.simulator import Simulator, parse_keys
+
+
+def simulator(rules, groups=''):
+    return Simulator(Parser('''store(&NAME) "Test"
+begin Unicode > use(main)
+''' + groups + rules))
+
+
+class SimulatorTestCase(unittest.TestCase):
+    def test_rules(self):
+        sim = simulator('''group(main) using keys
++ "a" > "x"
+"x" + "a" > "y"
+''')
+        self.assertEqual(sim.run('a'), 'x')
+        self.assertEqual(sim.run('aa'), 'y')
+        self.assertEqual(sim.run('ba'), 'bx')
+        self.assertEqual(sim.run('a', context='x'), 'y')
+
+    def test_use(self):
+        sim = simulator('''group(main) using keys
++ "q" > use(sub)
+group(sub) using keys
++ "q" > "Q"
+''')
+        self.assertEqual(sim.run('q'), 'Q')
+
+    def test_nomatch(self):
+        sim = simulator('''group(main) using keys
++ "a" > "A"
+nomatch > use(sub)
+group(sub) using keys
++ "b" > "B"
+''')
+        self.assertEqual(sim.run('ab'), 'AB')
+        self.assertEqual(sim.run('ac'), 'Ac')
+
+    def test_match(self):
+        sim = simulator('''group(main) using keys
++ "a" > "a"
+match > use(post)
+group(post)
+"a" > "A"
+''')
+        self.assertEqual(sim.run('ab'), 'Ab')
+
+    def test_deadkeys(self):
+        sim = simulator('''group(main) using keys
++ "`" > dk(grave)
+dk(grave) + "e" > "è"
+''')
+        self.assertEqual(sim.run('`'), '')
+        self.assertEqual(sim.run('`e'), 'è')
+        self.assertEqual(sim.run('e`'), 'e')
+
+    def test_any_index(self):
+        sim = simulator('''store(lower) "abc"
+store(upper) "ABC"
+group(main) using keys
+"^" + any(lower) > index(upper, 2)
+''')
+        self.assertEqual(sim.run('^a^cb'), 'ACb')
+        self.assertEqual(sim.run('^d'), '^d')
+
+    def test_backspace(self):
+        sim = simulator('''group(main) using keys
++ "`" > dk(grave)
+''')
+        self.assertEqual(sim.run('ab[K_BKSP]'), 'a')
+        self.assertEqual(sim.run('ab`[K_BKSP]'), 'a')
+        self.assertEqual(sim.run('[K_BKSP]'), '')
+
+    def test_parse_keys(self):
+        keys = parse_keys(r'a\[[SHIFT K_A]')
+        self.assertEqual(keys[:2], ['a', '['])
+        self.assertEqual(len(keys), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+import unittest
+from itertools import product
+from palaso.kmn.vector import VectorIterator, permutation
+
+
+class PermutationTestCase(unittest.TestCase):
+    def test_bijection(self):
+        for n in list(range(1, 70)) + [127, 1000, 4097, 65537]:
+            for seed in (0, 1, 12345):
+                with self.subTest(n=n, seed=seed):
+                    self.assertEqual(sorted(permutation(n, seed)),
+                                     list(range(n)))
+
+    def test_empty(self):
+        self.assertEqual(list(permutation(0, 1)), [])
+        self.assertEqual(list(permutation(-3, 1)), [])
+
+    def test_seed(self):
+        self.assertEqual(list(permutation(1000, 42)),
+                         list(permutation(1000, 42)))
+        self.assertNotEqual(list(permutation(1000, 42)),
+                            list(permutation(1000, 43)))
+        self.assertNotEqual(list(permutation(1000, 42)), list(range(1000)))
+
+    def test_random_all(self):
+        indices = [[1, 2, 3], [4, 5], [6, 7, 8, 9, 10]]
+        res = list(VectorIterator(indices, 'random-all'))
+        self.assertEqual(sorted(res), sorted(product(*indices)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import contextlib
+import io
+import os
+import runpy
+import sys
+import tempfile
+import time
+import unittest
+from . import pkg_data
+from palaso.sfm import project, usfm
+from palaso.sfm.project import ProjectIndex
+from pathlib import Path
+from unittest import mock
+
+USFMLINT = Path(__file__).resolve().parents[2] / 'scripts' / 'sfm' \
+    / 'usfmlint.py'
+
+
+class ProjectIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.project = Path(self._dir.name, 'project')
+        self.project.mkdir()
+        self.cache = Path(self._dir.name, 'index.cz')
+        (self.project / '41MATWEB.SFM').write_bytes(
+            (pkg_data / '41MATWEBorig.SFM').read_bytes())
+        (self.project / '64JHNTST.SFM').write_text(
+            '\\id 3JN\n\\c 1\n\\p\n\\v 1 One\n\\v 2 \\zfoo Two\\zfoo*\n'
+            '\\c 2\n\\p\n\\v 1 Three\n', encoding='utf-8')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def index(self):
+        return ProjectIndex(self.project, cache=self.cache)
+
+    def age(self, *names, by=10):
+        '''Backdate the files' mtimes so their stats are trusted.'''
+        t = time.time_ns() - by * 1_000_000_000
+        for name in names:
+            os.utime(self.project / name, ns=(t, t))
+
+    def test_summary(self):
+        index = self.index()
+        self.assertEqual(index.refresh(), ['41MATWEB.SFM', '64JHNTST.SFM'])
+        mat, jn = index.by_id('MAT'), index.by_id('3JN')
+        self.assertEqual(mat.chapters, 28)
+        self.assertEqual(mat.verses['5'], 48)
+        self.assertEqual(jn.verses, {'1': 2, '2': 1})
+        self.assertEqual([b.id for b in index.using('\\zfoo')], ['3JN'])
+        self.assertEqual(index.markers()['v'],
+                         sum(mat.verses.values()) + 3)
+        self.assertEqual(index.warnings, len(jn.warnings) + len(mat.warnings))
+
+    def test_refresh(self):
+        self.index().refresh()
+        index = self.index()
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.refresh(), [])
+        (self.project / '64JHNTST.SFM').write_text(
+            '\\id 3JN\n\\c 1\n\\p\n\\v 1 One\n', encoding='utf-8')
+        (self.project / '41MATWEB.SFM').unlink()
+        self.assertEqual(index.refresh(), ['41MATWEB.SFM', '64JHNTST.SFM'])
+        self.assertEqual(self.index()['64JHNTST.SFM'].verses, {'1': 1})
+        self.assertIsNone(self.index().by_id('MAT'))
+
+    def test_warning_source(self):
+        (self.project / '64JHNTST.SFM').write_text(
+            '\\id 3JN\n\\c 1\n\\p\n\\v 1 One\n\\mt9 Two\n', encoding='utf-8')
+        index = self.index()
+        index.refresh()
+        path = str(self.project / '64JHNTST.SFM')
+        self.assertTrue(index['64JHNTST.SFM'].warnings)
+        for w in index['64JHNTST.SFM'].warnings:
+            self.assertTrue(w.startswith(path + ':'), w)
+
+    def test_stat(self):
+        self.age('41MATWEB.SFM', '64JHNTST.SFM')
+        index = self.index()
+        index.refresh()
+        digest = mock.Mock(wraps=project._digest)
+        with mock.patch.object(project, '_digest', digest):
+            self.assertEqual(self.index().refresh(), [])
+            digest.assert_not_called()
+            # A new mtime with the same content is hashed but not re-parsed
+            self.age('64JHNTST.SFM', by=5)
+            self.assertEqual(index.refresh(), [])
+            self.assertEqual(digest.call_count, 1)
+            self.assertEqual(self.index().refresh(), [])
+            self.assertEqual(digest.call_count, 1)
+
+    def test_racy_stat(self):
+        # A book modified just now is hashed every time, as it could change
+        # again within the same mtime tick.
+        index = self.index()
+        index.refresh()
+        path = self.project / '64JHNTST.SFM'
+        self.assertIsNone(index['64JHNTST.SFM'].stat)
+        t = path.stat().st_mtime_ns
+        path.write_text(path.read_text(encoding='utf-8').replace('One', 'Uno'),
+                        encoding='utf-8')
+        os.utime(path, ns=(t, t))
+        self.assertEqual(index.refresh(), ['64JHNTST.SFM'])
+
+    def test_watch(self):
+        path = self.project / '64JHNTST.SFM'
+
+        def edit(interval):
+            self.assertEqual(interval, 0.5)
+            path.write_text('\\id 3JN\n\\c 1\n\\p\n\\v 1 One\n',
+                            encoding='utf-8')
+
+        with mock.patch.object(project.time, 'sleep', side_effect=edit) \
+                as sleep:
+            watch = self.index().watch(interval=0.5)
+            self.assertEqual(next(watch), ['41MATWEB.SFM', '64JHNTST.SFM'])
+            self.assertEqual(next(watch), ['64JHNTST.SFM'])
+            sleep.assert_called_once()
+            watch.close()
+        self.assertEqual(self.index()['64JHNTST.SFM'].verses, {'1': 1})
+
+
+class UsfmLintIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.project = Path(self._dir.name, 'project')
+        self.project.mkdir()
+        (self.project / '64JHNTST.SFM').write_text(
+            '\\id 3JN\n\\c 1\n\\p\n\\v 1 One\n\\mt9 Two\n',
+            encoding='utf-8')
+        patch = mock.patch.object(usfm, '_PALASO_DATA',
+                                  str(Path(self._dir.name, 'data')))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def lint(self, *args):
+        out = io.StringIO()
+        argv = [str(USFMLINT), str(self.project)] + list(args)
+        with mock.patch.object(sys, 'argv', argv), \
+                contextlib.redirect_stdout(out), \
+                self.assertRaises(SystemExit) as exit:
+            runpy.run_path(str(USFMLINT), run_name='__main__')
+        self.assertEqual(exit.exception.code, 0)
+        return out.getvalue()
+
+    def test_index(self):
+        report = self.lint('-i')
+        self.assertIn('64JHNTST.SFM', report)
+        index = Path(self._dir.name, 'data', 'index')
+        self.assertTrue(list(index.glob('*.cz')))
+        with mock.patch.object(project, '_summarise') as summarise:
+            self.assertEqual(self.lint('-i'), report)
+            summarise.assert_not_called()
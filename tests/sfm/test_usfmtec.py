@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import importlib.util
+import optparse
+import tempfile
+import unittest
+from pathlib import Path
+from palaso.sfm import Element, generate, usfm
+from . import pkg_data
+
+script = Path(__file__).resolve().parents[2] / 'scripts' / 'sfm' / \
+    'usfmtec.py'
+spec = importlib.util.spec_from_file_location('usfmtec', script)
+usfmtec = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(usfmtec)
+
+
+def options(**kwds):
+    ''' The options usfmtec's command line gives by default '''
+    opts = dict(
+        binary=False, capitalise=None, capitaltags=None, capitalalltags=None,
+        sentencepunc=b".!?",
+        openquotes=b"'\"\\u2018\\u201C\\[{(<\\u00AB",
+        closequotes=b"'\"\\u2019\\u201D\\]})>\\u00BB",
+        capitalopenquotes=None, letters=None,
+        dict=None, dictinput=0, dictoutput=1, dicttag=-1,
+        python=None, pythonfunc=None, tec=None, reverse=False, batch=True,
+        normalize=None, warnings=False,
+        error_level=usfm.ErrorLevel.Content,
+        stylesheet=usfm.default_stylesheet)
+    opts.update(kwds)
+    return optparse.Values(opts)
+
+
+class TrieTestCase(unittest.TestCase):
+    def test_prefixes(self):
+        t = usfmtec.trie()
+        self.assertFalse(t)
+        t[['a']] = 1
+        t[['a', 'b', 'c']] = 2
+        t[['x']] = 3
+        self.assertTrue(t)
+        self.assertEqual(list(t.prefixes('abcd')), [(1, 1), (3, 2)])
+        self.assertEqual(list(t.prefixes(iter('abx'))), [(1, 1)])
+        self.assertEqual(list(t.prefixes('ba')), [])
+        self.assertEqual(list(t.prefixes('')), [])
+
+    def test_word_keys(self):
+        t = usfmtec.trie()
+        self.assertEqual(t.setdefault(['in', ' ', 'the'], []), [])
+        t.setdefault(['in', ' ', 'the'], []).append('x')
+        self.assertEqual(list(t.prefixes(['in', ' ', 'the', ' ', 'end'])),
+                         [(3, ['x'])])
+
+
+class TransduceTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.converter = self.dir / 'conv.py'
+        self.converter.write_text(
+            'def convert(s):\n'
+            '    return s.translate(str.maketrans("aeiou", "eioua"))\n'
+            '__converter__ = "convert"\n', encoding='utf-8')
+        self.dict = self.dir / 'dict.csv'
+        self.dict.write_text(
+            '# input, output\n'
+            'jesus, JESUS\n'
+            'the lord, THE LORD\n'
+            '!ness, NESS\n'
+            'un!, UN\n', encoding='utf-8')
+        # The first few chapters are plenty, and quicker to convert
+        with (pkg_data / '41MATWEBorig.SFM').open(encoding='utf_8_sig') as f:
+            book = f.readlines()[:400]
+        self.sfm = self.dir / '41MAT.SFM'
+        self.sfm.write_text(''.join(book), encoding='utf_8_sig')
+
+    def transduce(self, **kwds):
+        opts = options(python=str(self.converter), **kwds)
+        return generate(usfmtec.transduce(self.sfm, opts))
+
+    def test_batch(self):
+        batched = self.transduce(batch=True)
+        self.assertEqual(batched, self.transduce(batch=False))
+        self.assertIn('Jisas', batched)
+
+    def test_batch_dict(self):
+        batched = self.transduce(batch=True, dict=str(self.dict))
+        self.assertEqual(batched,
+                         self.transduce(batch=False, dict=str(self.dict)))
+        self.assertIn('JESUS', batched)
+
+    def test_replace_morphs(self):
+        # Dictionary keys are converted like the text they match
+        conv = usfmtec.load_transducer(options(python=str(self.converter),
+                                               dict=str(self.dict)))
+        node = Element('p')
+        self.assertEqual(conv.replace_morphs('kondniss', node), 'kondNESS')
+        self.assertEqual(conv.replace_morphs('ankond', node), 'UNkond')
+        # Anchored morphs only match at their end of the word
+        self.assertEqual(conv.replace_morphs('nissan', node), 'nissan')
+
+
+if __name__ == '__main__':
+    unittest.main()
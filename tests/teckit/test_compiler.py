@@ -1,7 +1,12 @@
 from importlib import resources
+from pathlib import Path
+from unittest import mock
+import os
+import tempfile
 import unittest
 from . import pkg_data
-from palaso.teckit.compiler import compile, translate, CompilationError
+from palaso.teckit.compiler import (
+    compile, translate, CompilationError, MappingCache)
 from palaso.teckit.engine import Mapping
 
 
@@ -71,3 +76,26 @@ class TestCompilerFailure(unittest.TestCase):
     def test_compile_fail(self):
         source = (pkg_data / 'ISO-8859-1.map.reference.xml').read_bytes()
         self.assertRaises(CompilationError, compile, source)
+
+
+class TestMappingCache(unittest.TestCase):
+    def test_cache(self):
+        source = (pkg_data / 'SILGreek2004-04-27.map').read_bytes()
+        with tempfile.TemporaryDirectory() as path:
+            cache = MappingCache(path)
+            ref_map = compile(source)
+            self.assertEqual(compile(source, cache=cache), ref_map)
+            self.assertEqual(len(list(cache.path.glob('*.tec'))), 1)
+            self.assertEqual(compile(source, cache=cache), ref_map)
+            self.assertNotEqual(compile(source, False, cache=cache), ref_map)
+            self.assertEqual(len(list(cache.path.glob('*.tec'))), 2)
+            cache.max_size = len(ref_map)
+            cache.evict()
+            self.assertLessEqual(
+                sum(p.stat().st_size for p in cache.path.glob('*.tec')),
+                len(ref_map))
+
+    def test_default_path(self):
+        with mock.patch.dict(os.environ, PALASO_CACHE='/var/cache/palaso'):
+            self.assertEqual(MappingCache().path,
+                             Path('/var/cache/palaso', 'teckit'))